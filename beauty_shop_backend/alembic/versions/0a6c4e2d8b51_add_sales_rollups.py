@@ -0,0 +1,42 @@
+"""add sales rollups
+
+Revision ID: 0a6c4e2d8b51
+Revises: f3b9d2a64c17
+Create Date: 2026-10-18 18:10:26.907345
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6c4e2d8b51'
+down_revision: Union[str, Sequence[str], None] = 'f3b9d2a64c17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sales_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dimension', sa.String(length=16), nullable=False),
+    sa.Column('granularity', sa.String(length=8), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('dimension_key', sa.String(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dimension', 'granularity', 'bucket_start', 'dimension_key', name='uq_sales_rollups_bucket')
+    )
+    op.create_index(op.f('ix_sales_rollups_id'), 'sales_rollups', ['id'], unique=False)
+    # existing orders are loaded with `python rebuild_analytics.py`
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_sales_rollups_id'), table_name='sales_rollups')
+    op.drop_table('sales_rollups')
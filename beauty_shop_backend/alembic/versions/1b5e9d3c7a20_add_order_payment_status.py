@@ -0,0 +1,30 @@
+"""add order payment status
+
+Revision ID: 1b5e9d3c7a20
+Revises: 0a6c4e2d8b51
+Create Date: 2026-10-18 19:02:44.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b5e9d3c7a20'
+down_revision: Union[str, Sequence[str], None] = '0a6c4e2d8b51'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('payment_status', sa.String(length=16), nullable=True))
+    op.add_column('orders', sa.Column('payment_error', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('orders', 'payment_error')
+    op.drop_column('orders', 'payment_status')
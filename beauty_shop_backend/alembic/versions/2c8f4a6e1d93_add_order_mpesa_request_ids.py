@@ -0,0 +1,34 @@
+"""add order mpesa request ids
+
+Revision ID: 2c8f4a6e1d93
+Revises: 1b5e9d3c7a20
+Create Date: 2026-10-18 19:41:07.233915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c8f4a6e1d93'
+down_revision: Union[str, Sequence[str], None] = '1b5e9d3c7a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('checkout_request_id', sa.String(), nullable=True))
+    op.add_column('orders', sa.Column('merchant_request_id', sa.String(), nullable=True))
+    op.create_index(op.f('ix_orders_checkout_request_id'), 'orders', ['checkout_request_id'], unique=True)
+    op.create_index(op.f('ix_orders_merchant_request_id'), 'orders', ['merchant_request_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_orders_merchant_request_id'), table_name='orders')
+    op.drop_index(op.f('ix_orders_checkout_request_id'), table_name='orders')
+    op.drop_column('orders', 'merchant_request_id')
+    op.drop_column('orders', 'checkout_request_id')
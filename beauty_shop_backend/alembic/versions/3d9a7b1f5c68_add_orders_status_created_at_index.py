@@ -0,0 +1,28 @@
+"""add orders status created_at index
+
+Revision ID: 3d9a7b1f5c68
+Revises: 2c8f4a6e1d93
+Create Date: 2026-10-18 20:26:51.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9a7b1f5c68'
+down_revision: Union[str, Sequence[str], None] = '2c8f4a6e1d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_status_created_at', table_name='orders')
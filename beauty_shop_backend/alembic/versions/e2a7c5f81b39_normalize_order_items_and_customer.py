@@ -0,0 +1,187 @@
+"""normalize order items and customer columns
+
+Revision ID: e2a7c5f81b39
+Revises: d91f3b6e0a52
+Create Date: 2026-10-18 16:12:30.114520
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a7c5f81b39'
+down_revision: Union[str, Sequence[str], None] = 'd91f3b6e0a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+CUSTOMER_COLUMNS = {
+    'firstName': 'customer_first_name',
+    'lastName': 'customer_last_name',
+    'email': 'customer_email',
+    'address': 'customer_address',
+    'city': 'customer_city',
+    'zip': 'customer_zip',
+    'paymentMethod': 'payment_method',
+    'mpesaPhone': 'mpesa_phone',
+    'transactionId': 'transaction_id',
+}
+
+orders = sa.table(
+    'orders',
+    sa.column('id', sa.Integer),
+    sa.column('customer_json', sa.Text),
+    sa.column('items_json', sa.Text),
+    *[sa.column(c, sa.String) for c in CUSTOMER_COLUMNS.values()],
+)
+order_items = sa.table(
+    'order_items',
+    sa.column('order_id', sa.Integer),
+    sa.column('product_id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('unit_price', sa.Float),
+    sa.column('quantity', sa.Integer),
+)
+products = sa.table('products', sa.column('id', sa.Integer))
+
+
+def _loads(text):
+    try:
+        return json.loads(text) if text else None
+    except ValueError:
+        return None
+
+
+def _backfill(bind):
+    """Copy customer_json/items_json into the new columns, BATCH_SIZE orders per round trip."""
+    product_ids = {row.id for row in bind.execute(sa.select(products.c.id))}
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(orders.c.id, orders.c.customer_json, orders.c.items_json)
+            .where(orders.c.id > last_id)
+            .order_by(orders.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        customer_updates = []
+        item_rows = []
+        for row in rows:
+            customer = _loads(row.customer_json)
+            if isinstance(customer, dict):
+                values = {f'v_{column}': customer.get(key) for key, column in CUSTOMER_COLUMNS.items()}
+                values = {k: (str(v) if v is not None else None) for k, v in values.items()}
+                customer_updates.append({'order_id': row.id, **values})
+            items = _loads(row.items_json)
+            if isinstance(items, list):
+                for item in items:
+                    if not isinstance(item, dict):
+                        continue
+                    product_id = item.get('id') or item.get('product_id')
+                    try:
+                        product_id = int(product_id) if product_id is not None else None
+                    except (TypeError, ValueError):
+                        product_id = None
+                    item_rows.append({
+                        'order_id': row.id,
+                        # frontend ids may not be real products
+                        'product_id': product_id if product_id in product_ids else None,
+                        'name': str(item.get('name') or ''),
+                        'unit_price': float(item.get('price') or 0),
+                        'quantity': int(item.get('quantity') or 1),
+                    })
+
+        if customer_updates:
+            bind.execute(
+                orders.update()
+                .where(orders.c.id == sa.bindparam('order_id'))
+                .values({column: sa.bindparam(f'v_{column}') for column in CUSTOMER_COLUMNS.values()}),
+                customer_updates,
+            )
+        if item_rows:
+            bind.execute(order_items.insert(), item_rows)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('unit_price', sa.Float(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_items_id'), 'order_items', ['id'], unique=False)
+    op.create_index(op.f('ix_order_items_order_id'), 'order_items', ['order_id'], unique=False)
+    op.create_index(op.f('ix_order_items_product_id'), 'order_items', ['product_id'], unique=False)
+    for column in CUSTOMER_COLUMNS.values():
+        op.add_column('orders', sa.Column(column, sa.String(), nullable=True))
+    op.create_index(op.f('ix_orders_customer_email'), 'orders', ['customer_email'], unique=False)
+
+    _backfill(op.get_bind())
+
+
+def _restore_json(bind):
+    """Write the columns back into customer_json/items_json for orders placed since the upgrade."""
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(orders)
+            .where(orders.c.id > last_id, orders.c.items_json.is_(None))
+            .order_by(orders.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        items_by_order = {}
+        for item in bind.execute(
+            sa.select(order_items).where(order_items.c.order_id.in_([row.id for row in rows]))
+        ):
+            items_by_order.setdefault(item.order_id, []).append({
+                'id': item.product_id,
+                'name': item.name,
+                'quantity': item.quantity,
+                'price': item.unit_price,
+                'totalPrice': item.unit_price * item.quantity,
+            })
+        bind.execute(
+            orders.update()
+            .where(orders.c.id == sa.bindparam('order_id'))
+            .values(customer_json=sa.bindparam('customer'), items_json=sa.bindparam('items')),
+            [
+                {
+                    'order_id': row.id,
+                    'customer': json.dumps({
+                        key: getattr(row, column) for key, column in CUSTOMER_COLUMNS.items()
+                        if getattr(row, column) is not None
+                    }),
+                    'items': json.dumps(items_by_order.get(row.id, [])),
+                }
+                for row in rows
+            ],
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _restore_json(op.get_bind())
+    op.drop_index(op.f('ix_orders_customer_email'), table_name='orders')
+    for column in reversed(list(CUSTOMER_COLUMNS.values())):
+        op.drop_column('orders', column)
+    op.drop_index(op.f('ix_order_items_product_id'), table_name='order_items')
+    op.drop_index(op.f('ix_order_items_order_id'), table_name='order_items')
+    op.drop_index(op.f('ix_order_items_id'), table_name='order_items')
+    op.drop_table('order_items')
@@ -1,13 +1,64 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import auth, products, orders, cart, users, reviews, support
+from app.routes import auth, products, orders, cart, users, reviews, support, categories, exports, analytics
+from app.services.invalidation import bus
+from app.services.category_registry import category_registry
+from app.services.suggest import suggest_index
+from app.services import inventory, idempotency, reconciliation
+from app.services.search import prepare_search
+from app.services.invoices import invoice_renderer
+from app.services.payments import payment_dispatcher
+from app.utils.smtp import mail_queue
+from app.utils.periodic import PeriodicJob
+from app.database import SessionLocal
+from app.utils.serializers import FastJSONResponse
+from app.utils.compression import CompressionMiddleware
 from dotenv import load_dotenv
 import os
+import logging
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="Project 8: Beauty Shop API")
+logger = logging.getLogger(__name__)
+
+background_jobs = [
+    # puts back stock held by checkouts that were never paid
+    PeriodicJob("reservation sweep", inventory.release_expired, SessionLocal, inventory.RESERVATION_SWEEP_INTERVAL),
+    PeriodicJob("idempotency key purge", idempotency.purge_expired, SessionLocal, idempotency.IDEMPOTENCY_PURGE_INTERVAL),
+    # settles orders whose M-Pesa callback never arrived
+    PeriodicJob("payment reconciliation", reconciliation.reconcile_pending, SessionLocal, reconciliation.RECONCILE_INTERVAL),
+]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start listening for cache invalidations published by other workers
+    bus.start()
+    db = SessionLocal()
+    try:
+        category_registry.load(db)
+        suggest_index.build(db)
+        prepare_search(db)
+    except Exception as e:
+        # routes load these lazily, so a cold database shouldn't block startup
+        logger.warning(f"Could not preload catalog indexes: {e}")
+    finally:
+        db.close()
+    for job in background_jobs:
+        job.start()
+    payment_dispatcher.start()
+    yield
+    for job in background_jobs:
+        job.stop()
+    payment_dispatcher.stop()
+    invoice_renderer.shutdown()
+    # after the renderer, whose last invoices are still being queued
+    mail_queue.stop()
+    bus.stop()
+
+
+app = FastAPI(title="Project 8: Beauty Shop API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS Configuration - Must be before routes
 app.add_middleware(
@@ -18,15 +69,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli above COMPRESSION_MIN_SIZE; precompressed cache hits pass through
+app.add_middleware(CompressionMiddleware)
+
 # These assume that in your routes/__init__.py, you have:
 # from .orders import router as orders
 app.include_router(auth, prefix="/api/auth", tags=["Authentication"])
 app.include_router(products, prefix="/api/products", tags=["Products"])
+app.include_router(categories, prefix="/api/categories", tags=["Categories"])
 app.include_router(orders, prefix="/api/orders", tags=["Orders"])
 app.include_router(cart, prefix="/api/cart", tags=["Cart"])
 app.include_router(users, prefix="/api/users", tags=["Users"])
 app.include_router(reviews, prefix="/api/reviews", tags=["Reviews"])
 app.include_router(support, prefix="/api/support", tags=["Support"])
+app.include_router(exports, prefix="/api/exports", tags=["Exports"])
+app.include_router(analytics, prefix="/api/analytics", tags=["Analytics"])
 
 @app.get("/")
 async def root():
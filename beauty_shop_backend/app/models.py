@@ -1,9 +1,16 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
+from datetime import datetime, timezone
 import json
 
+
+def utcnow():
+    # Python-side so SQLite keeps sub-second precision (CURRENT_TIMESTAMP doesn't)
+    return datetime.now(timezone.utc)
+
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -36,6 +43,10 @@ class Product(Base):
     image = Column(String, nullable=True)
     rating = Column(Float, default=4.5)
     is_new = Column(Boolean, default=False)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, server_default=func.now(), index=True)
+    # PostgreSQL also has a generated `search_vector` tsvector column, added by
+    # migration and queried through app/services/search.py (not mapped here so
+    # SQLite test databases can be built with create_all)
     
     category = relationship("Category", back_populates="products")
 
@@ -55,27 +66,175 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     total_amount = Column(Float)
     status = Column(String, default="pending") 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
     
     invoice_number = Column(String, unique=True)
     billing_address = Column(String, default="123 Beauty Lane, Nairobi")
-    # New: store frontend-shaped payloads
     public_id = Column(String, unique=True, index=True, nullable=True)
+    # Customer details from the checkout form
+    customer_first_name = Column(String, nullable=True)
+    customer_last_name = Column(String, nullable=True)
+    customer_email = Column(String, nullable=True, index=True)
+    customer_address = Column(String, nullable=True)
+    customer_city = Column(String, nullable=True)
+    customer_zip = Column(String, nullable=True)
+    payment_method = Column(String, nullable=True)
+    mpesa_phone = Column(String, nullable=True)
+    transaction_id = Column(String, nullable=True)
+    # STK push progress, set by app/services/payments.py: pending, requested,
+    # unconfirmed (the push may or may not have reached Safaricom), failed, paid
+    # or paid_no_stock (paid after its stock was released and sold elsewhere)
+    payment_status = Column(String(16), nullable=True)
+    payment_error = Column(String, nullable=True)
+    # Daraja's ids for the latest STK push; callbacks find the order by these
+    checkout_request_id = Column(String, nullable=True, unique=True, index=True)
+    merchant_request_id = Column(String, nullable=True, index=True)
+    # Legacy frontend-shaped payloads, superseded by the columns above and
+    # order_items; only read for rows the backfill migration couldn't parse
     customer_json = Column(Text, nullable=True)
     items_json = Column(Text, nullable=True)
     owner = relationship("User", back_populates="orders")
+    # selectin: order lists load every order's items in one extra query
+    line_items = relationship("OrderItem", back_populates="order", order_by="OrderItem.id",
+                              cascade="all, delete-orphan", lazy="selectin")
+
+    __table_args__ = (
+        # admin listing: newest first, keyset-paginated on (created_at, id)
+        Index("ix_orders_created_at_id", "created_at", "id"),
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        # payment reconciliation: oldest unsettled orders first
+        Index("ix_orders_status_created_at", "status", "created_at"),
+    )
+
+    # frontend customer key -> column
+    CUSTOMER_FIELDS = {
+        "firstName": "customer_first_name",
+        "lastName": "customer_last_name",
+        "email": "customer_email",
+        "address": "customer_address",
+        "city": "customer_city",
+        "zip": "customer_zip",
+        "paymentMethod": "payment_method",
+        "mpesaPhone": "mpesa_phone",
+        "transactionId": "transaction_id",
+    }
 
     def set_customer(self, customer_obj):
-        self.customer_json = json.dumps(customer_obj)
+        for key, column in self.CUSTOMER_FIELDS.items():
+            setattr(self, column, (customer_obj or {}).get(key))
 
     def set_items(self, items_list):
-        self.items_json = json.dumps(items_list)
+        self.line_items = [OrderItem.from_dict(item) for item in items_list]
 
     def get_customer(self):
-        return json.loads(self.customer_json) if self.customer_json else None
+        if self.customer_email is None and self.customer_json:
+            return json.loads(self.customer_json)
+        customer = {key: getattr(self, column) for key, column in self.CUSTOMER_FIELDS.items()}
+        if not any(customer.values()):
+            return None
+        # payment details are only present for some orders
+        for key in ("paymentMethod", "mpesaPhone", "transactionId"):
+            if customer[key] is None:
+                del customer[key]
+        return customer
 
     def get_items(self):
-        return json.loads(self.items_json) if self.items_json else []
+        if not self.line_items and self.items_json:
+            return json.loads(self.items_json)
+        return [item.to_dict() for item in self.line_items]
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="SET NULL"), nullable=True, index=True)
+    name = Column(String, nullable=False)  # as it was when ordered
+    unit_price = Column(Float, nullable=False)
+    quantity = Column(Integer, nullable=False, default=1)
+
+    order = relationship("Order", back_populates="line_items")
+
+    @classmethod
+    def from_dict(cls, item):
+        return cls(
+            product_id=item.get("id") or item.get("product_id"),
+            name=item.get("name") or "",
+            unit_price=float(item.get("price") or 0),
+            quantity=int(item.get("quantity") or 1),
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.product_id,
+            "name": self.name,
+            "quantity": self.quantity,
+            "price": self.unit_price,
+            "totalPrice": self.unit_price * self.quantity,
+        }
+
+class StockReservation(Base):
+    """
+    Stock taken out of products.stock_quantity for an order. "held" rows
+    expire at expires_at unless the order is paid ("committed"); expired or
+    cancelled ones are put back ("released"). See app/services/inventory.py.
+    """
+    __tablename__ = "stock_reservations"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    status = Column(String, default="held", nullable=False)  # held, committed, released
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+
+    __table_args__ = (
+        # the expiry sweep scans held rows by age
+        Index("ix_stock_reservations_status_expires_at", "status", "expires_at"),
+    )
+
+class IdempotencyKey(Base):
+    """
+    A client's Idempotency-Key for one endpoint, and the response it got,
+    so retries are answered without running the request again.
+    """
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # endpoint + user the key belongs to
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String, default="in_progress", nullable=False)  # in_progress, completed
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),
+    )
+
+class SalesRollup(Base):
+    """
+    Pre-aggregated sales per hour/day bucket, kept up to date as orders
+    are placed and change status (app/services/analytics.py).
+
+    dimension/dimension_key: "status"/<order status>, "category"/<category id>
+    or "product"/<product id>. Category and product rows only count orders
+    in a sale status.
+    """
+    __tablename__ = "sales_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    dimension = Column(String(16), nullable=False)
+    granularity = Column(String(8), nullable=False)  # hour, day
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    dimension_key = Column(String, nullable=False)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        # upsert target, and the index dashboard range scans use
+        UniqueConstraint("dimension", "granularity", "bucket_start", "dimension_key", name="uq_sales_rollups_bucket"),
+    )
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -86,6 +245,7 @@ class Review(Base):
     rating = Column(Integer)
     comment = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, server_default=func.now())
 
 class SupportMessage(Base):
     __tablename__ = "support_messages"
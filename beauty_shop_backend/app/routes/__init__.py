@@ -4,4 +4,7 @@ from .orders import router as orders
 from .cart import router as cart
 from .users import router as users
 from .reviews import router as reviews
-from .support import router as support
\ No newline at end of file
+from .support import router as support
+from .categories import router as categories
+from .exports import router as exports
+from .analytics import router as analytics
@@ -0,0 +1,82 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import User, Product, Category
+from app.routes.auth import get_current_admin
+from app.services import analytics
+
+router = APIRouter()
+
+GRANULARITY_PATTERN = "^(hour|day)$"
+SORT_PATTERN = "^(revenue|units|orders)$"
+
+
+def _totals(rows, names):
+    return [
+        {"key": row.dimension_key, "name": names.get(row.dimension_key), "orders": row.orders or 0,
+         "units": row.units or 0, "revenue": row.revenue or 0.0}
+        for row in rows
+    ]
+
+
+@router.get("/sales")
+def sales_timeline(
+    granularity: str = Query("day", pattern=GRANULARITY_PATTERN),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Paid orders and revenue per hour/day bucket, read from the rollups."""
+    points = analytics.sales_timeline(db, granularity, start, end)
+    return {
+        "granularity": granularity,
+        "timezone": str(analytics.ANALYTICS_TIMEZONE),
+        "revenue": sum(p["revenue"] for p in points),
+        "orders": sum(p["orders"] for p in points),
+        "points": points,
+    }
+
+
+@router.get("/statuses")
+def orders_by_status(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Order count and value per status."""
+    return _totals(analytics.totals_by_key(db, "status", start, end, order_by="orders"), {})
+
+
+@router.get("/categories")
+def revenue_by_category(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Units and revenue per category for paid orders."""
+    rows = analytics.totals_by_key(db, "category", start, end)
+    ids = [int(row.dimension_key) for row in rows if row.dimension_key.isdigit()]
+    names = {str(c.id): c.name for c in db.query(Category.id, Category.name).filter(Category.id.in_(ids))}
+    return _totals(rows, names)
+
+
+@router.get("/products")
+def top_products(
+    limit: int = Query(10, ge=1, le=100),
+    sort: str = Query("units", pattern=SORT_PATTERN),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Best sellers for paid orders; items whose product was deleted are keyed "name:<name>"."""
+    rows = analytics.totals_by_key(db, "product", start, end, limit=limit, order_by=sort)
+    ids = [int(row.dimension_key) for row in rows if row.dimension_key.isdigit()]
+    names = {str(p.id): p.name for p in db.query(Product.id, Product.name).filter(Product.id.in_(ids))}
+    names.update({row.dimension_key: row.dimension_key[5:] for row in rows if row.dimension_key.startswith("name:")})
+    return _totals(rows, names)
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from jose import JWTError, jwt
 from app.database import get_db
 from app.models import User
+from app.services.invalidation import bus
+from app.utils.cache import TTLCache
 from app.schemas import UserCreate, Token, UserProfile
 # Ensure these are correctly defined in your auth_service.py
 from app.services.auth_service import (
@@ -13,12 +16,44 @@ from app.services.auth_service import (
     SECRET_KEY, 
     ALGORITHM
 )
+import os
 
 router = APIRouter()
 
 # This tells FastAPI where to look for the token (the login endpoint)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+# email -> detached User snapshot, so authenticated requests skip the users lookup
+user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "4096")), ttl=USER_CACHE_TTL)
+
+
+def _cache_user(user: User):
+    if not USER_CACHE_ENABLED:
+        return
+    snapshot = User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    make_transient_to_detached(snapshot)
+    user_cache.set(user.email, snapshot)
+
+
+def _load_cached_user(db: Session, email: str):
+    if not USER_CACHE_ENABLED:
+        return None
+    snapshot = user_cache.get(email)
+    if snapshot is None:
+        return None
+    # attach a copy to this session without emitting a SELECT
+    return db.merge(snapshot, load=False)
+
+
+def _on_user_changed(user_id, data):
+    user_cache.pop_where(lambda email, snapshot: snapshot.id == user_id)
+
+
+bus.subscribe("user", _on_user_changed)
+
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """
@@ -36,12 +71,23 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
+
+    user = _load_cached_user(db, email)
+    if user is not None:
+        return user
+
     user = db.query(User).filter(User.email == email).first()
     if user is None:
         raise credentials_exception
+    _cache_user(user)
     return user
 
+def get_current_admin(current_user: User = Depends(get_current_user)):
+    """Like get_current_user, but only lets admins through."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
 # --- Authentication Logic ---
 
 @router.post("/register", response_model=Token)
@@ -88,6 +134,7 @@ def update_profile(updates: dict, db: Session = Depends(get_db), current_user: U
         current_user.address = updates['address']
     db.commit()
     db.refresh(current_user)
+    bus.publish("user", current_user.id)
     return current_user
 
 # --- Dependency Logic (The Missing Piece) ---
@@ -4,6 +4,8 @@ from app.database import get_db
 from app.models import CartItem, Product, User
 from app.schemas import CartItemCreate
 from app.routes.auth import get_current_user
+from app.services.cart_service import load_cart
+from app.utils.serializers import json_response, cart_line_to_dict
 
 router = APIRouter()
 
@@ -40,8 +42,10 @@ def view_cart(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    cart_items = db.query(CartItem).filter(CartItem.user_id == current_user.id).all()
-    return cart_items
+    # product details come back with each line so the frontend doesn't
+    # have to resolve them one product request at a time
+    lines = load_cart(db, current_user.id)
+    return json_response([cart_line_to_dict(line, current_user.id) for line in lines])
 
 @router.put("/{item_id}")
 def update_cart_item(
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from app.database import get_db
+from app.models import Category
+from app.schemas import CategorySchema
+from app.services.category_registry import category_registry
+from app.services.invalidation import bus
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[CategorySchema])
+def get_categories(db: Session = Depends(get_db)):
+    category_registry.ensure_loaded(db)
+    return category_registry.all()
+
+
+@router.post("/", response_model=CategorySchema)
+def create_category(payload: dict, db: Session = Depends(get_db)):
+    name = (payload.get('name') or '').strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Category name is required")
+    if db.query(Category).filter(Category.name == name).first():
+        raise HTTPException(status_code=400, detail="Category already exists")
+
+    category = Category(name=name)
+    db.add(category)
+    db.commit()
+    db.refresh(category)
+    bus.publish("category", category.id, name=category.name)
+    return category
+
+
+@router.put("/{category_id}", response_model=CategorySchema)
+def rename_category(category_id: int, payload: dict, db: Session = Depends(get_db)):
+    category = db.query(Category).filter(Category.id == category_id).first()
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    name = (payload.get('name') or '').strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Category name is required")
+    if db.query(Category).filter(Category.name == name, Category.id != category_id).first():
+        raise HTTPException(status_code=400, detail="Category already exists")
+
+    category.name = name
+    db.commit()
+    db.refresh(category)
+    bus.publish("category", category.id, name=category.name)
+    return category
@@ -0,0 +1,126 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import Order, OrderItem, Product, Category, User
+from app.routes.auth import get_current_admin
+from app.services.order_service import filter_orders
+from app.utils.streaming import csv_chunks, ndjson_chunks, gzip_chunks
+
+router = APIRouter()
+
+# rows fetched per server-side cursor round trip
+EXPORT_BATCH = 1000
+FORMAT_PATTERN = "^(csv|ndjson)$"
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+ORDER_COLUMNS = [
+    ("id", Order.public_id),
+    ("invoice_number", Order.invoice_number),
+    ("created_at", Order.created_at),
+    ("status", Order.status),
+    ("total_amount", Order.total_amount),
+    ("user_id", Order.user_id),
+    ("first_name", Order.customer_first_name),
+    ("last_name", Order.customer_last_name),
+    ("email", Order.customer_email),
+    ("city", Order.customer_city),
+    ("payment_method", Order.payment_method),
+    ("transaction_id", Order.transaction_id),
+]
+PRODUCT_COLUMNS = [
+    ("id", Product.id),
+    ("name", Product.name),
+    ("category", Category.name),
+    ("price", Product.price),
+    ("stock_quantity", Product.stock_quantity),
+    ("rating", Product.rating),
+    ("is_new", Product.is_new),
+    ("updated_at", Product.updated_at),
+]
+USER_COLUMNS = [
+    ("id", User.id),
+    ("email", User.email),
+    ("first_name", User.first_name),
+    ("last_name", User.last_name),
+    ("phone_number", User.phone_number),
+    ("is_admin", User.is_admin),
+]
+
+
+def _export(db, name: str, columns, stmt, format: str, gzip: bool):
+    """
+    Stream `stmt` as CSV/NDJSON. Rows come off a server-side cursor
+    EXPORT_BATCH at a time and are encoded and sent as they arrive, so
+    memory stays flat however large the table is.
+    """
+    names = [label for label, _ in columns]
+    rows = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+    encode = csv_chunks if format == "csv" else ndjson_chunks
+    chunks = encode(names, rows)
+    filename = f"{name}-{datetime.now():%Y%m%d-%H%M%S}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        chunks, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/orders")
+def export_orders(
+    format: str = Query("csv", pattern=FORMAT_PATTERN),
+    gzip: bool = False,
+    status: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Orders (oldest first) with their line and unit counts; same filters as /api/orders/all."""
+    counts = (
+        select(OrderItem.order_id, func.count(OrderItem.id).label("lines"), func.sum(OrderItem.quantity).label("units"))
+        .group_by(OrderItem.order_id)
+        .subquery()
+    )
+    columns = ORDER_COLUMNS + [("lines", func.coalesce(counts.c.lines, 0)), ("units", func.coalesce(counts.c.units, 0))]
+    stmt = (
+        select(*[column.label(label) for label, column in columns])
+        .outerjoin(counts, counts.c.order_id == Order.id)
+        .order_by(Order.created_at, Order.id)
+    )
+    stmt = filter_orders(stmt, status, start, end, user_id)
+    return _export(db, "orders", columns, stmt, format, gzip)
+
+
+@router.get("/products")
+def export_products(
+    format: str = Query("csv", pattern=FORMAT_PATTERN),
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    stmt = (
+        select(*[column.label(label) for label, column in PRODUCT_COLUMNS])
+        .outerjoin(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+    )
+    return _export(db, "products", PRODUCT_COLUMNS, stmt, format, gzip)
+
+
+@router.get("/users")
+def export_users(
+    format: str = Query("csv", pattern=FORMAT_PATTERN),
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    stmt = select(*[column.label(label) for label, column in USER_COLUMNS]).order_by(User.id)
+    return _export(db, "users", USER_COLUMNS, stmt, format, gzip)
@@ -1,20 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Query
+from fastapi.responses import StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel  # Added for Option A
+from typing import Optional, Union
+from datetime import datetime
 from app.database import get_db
 from app.models import User, Order, CartItem
-from app.routes.auth import get_current_user
-from app.utils.mpesa import initiate_stk_push
-from app.utils.invoice import generate_invoice_pdf
-from app.utils.email import send_invoice_email
-from app.schemas import OrderCreate, OrderDetailResponse
-from app.services.order_service import create_order_record, fetch_order_by_public_id
-import uuid, time
-import json
+from app.routes.auth import get_current_user, get_current_admin
+from app.schemas import OrderCreate, OrderDetailResponse, OrderPage
+from app.services.order_service import create_order_record, fetch_order_by_public_id, revenue_summary, top_sellers, filter_orders
+from app.services.cart_service import load_cart, cart_total
+from app.services import inventory, analytics
+from app.services.idempotency import idempotent
+from app.services.invoices import invoice_renderer, invoice_job, queue_invoice
+from app.services.payments import payment_dispatcher, handle_callback
+from app.utils.email import send_payment_receipt_email
+from app.utils.ids import new_order_ids
+from app.utils.mpesa import normalize_phone
+from app.utils.serializers import json_response, order_summary_to_dict, order_to_dict, dumps
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_filter, order_by_keys
+import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Admin order listing: newest first, ties broken by id
+ORDER_KEYS = [(Order.created_at, True), (Order.id, True)]
+DEFAULT_ORDER_PAGE_SIZE = 50
+STREAM_BATCH = int(os.getenv("ORDER_STREAM_BATCH", "500"))
+# What Safaricom expects back from a callback, whatever we made of it
+MPESA_ACK = {"ResultCode": 0, "ResultDesc": "Callback received"}
+
 # 1. Define the schema to fetch phone number and cart items from the request body
 class CheckoutRequest(BaseModel):
     phone_number: str
@@ -26,68 +42,122 @@ router = APIRouter()
 @router.post("/", response_model=OrderDetailResponse)
 def create_order(
     payload: OrderCreate,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Public endpoint used by frontend to create an order.
     Returns an order object shaped like the frontend expects.
+
+    Send an Idempotency-Key header to make retries safe: a repeat of the
+    same request gets the first response back without creating another
+    order, invoice or email.
     """
+    return idempotent(
+        db, idempotency_key, f"orders:create:{current_user.id}", payload.model_dump(mode="json"),
+        lambda: _create_order(payload, db, current_user)
+    )
+
+
+def _create_order(payload, db, current_user):
     # create order record and return structured response
-    order_obj = create_order_record(db, payload)
+    try:
+        order_obj = create_order_record(db, payload)
+    except inventory.InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Associate order with authenticated user
     order_obj.user_id = current_user.id
     db.commit()
     db.refresh(order_obj)
 
-    # Generate PDF and send email in background
+    # Render the invoice off the request thread; it's emailed once ready
     try:
-        pdf_path = generate_invoice_pdf(order_obj.invoice_number or order_obj.public_id, order_obj.total_amount, (order_obj.get_customer() or {}).get('email'), order_obj.get_items())
-        background_tasks.add_task(send_invoice_email, recipient_email=(order_obj.get_customer() or {}).get('email'), invoice_no=order_obj.invoice_number or order_obj.public_id, pdf_path=pdf_path)
+        queue_invoice(order_obj)
     except Exception as e:
         print(f"Invoice generation/email error: {e}")
         pass
 
-    resp = {
-        "id": order_obj.public_id,
-        "createdAt": order_obj.created_at,
-        "customer": order_obj.get_customer(),
-        "items": order_obj.get_items(),
-        "total": order_obj.total_amount,
-        "status": order_obj.status
-    }
-    return resp
-
-
-@router.get("/all", response_model=list)
-def get_all_orders(db: Session = Depends(get_db)):
-    """Admin endpoint to fetch all orders."""
-    orders = db.query(Order).order_by(Order.created_at.desc()).all()
-    return [{
-        "id": order.public_id or order.id,
-        "invoice_number": order.invoice_number or f"ORD-{order.id}",
-        "total_amount": order.total_amount,
-        "status": order.status,
-        "created_at": order.created_at,
-        "customer_json": order.customer_json,
-        "items_json": order.items_json
-    } for order in orders]
+    return order_to_dict(order_obj)
+
+
+def _stream_json_array(query):
+    """Encode a query as a JSON array, STREAM_BATCH rows per server-side cursor fetch."""
+    yield b"["
+    separator = b""
+    batch = []
+    for order in query.yield_per(STREAM_BATCH):
+        batch.append(dumps(order_summary_to_dict(order)))
+        if len(batch) >= STREAM_BATCH:
+            yield separator + b",".join(batch)
+            separator, batch = b",", []
+    if batch:
+        yield separator + b",".join(batch)
+    yield b"]"
+
+
+@router.get("/all", response_model=Union[list, OrderPage])
+def get_all_orders(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Admin endpoint to fetch orders, newest first.
+
+    Filter with `status` (comma-separated), `start`/`end` (created_at
+    range, end exclusive) and `user_id`. With `limit`/`cursor` a page is
+    returned as {"items": [...], "next_cursor": ...}; pass `next_cursor`
+    back as `cursor` for the next one. Without them every matching order
+    is streamed as a JSON list, read from the database in batches so
+    memory stays flat however many orders there are.
+    """
+    query = filter_orders(db.query(Order), status, start, end, user_id).order_by(*order_by_keys(ORDER_KEYS))
+
+    if limit is None and cursor is None:
+        return StreamingResponse(_stream_json_array(query), media_type="application/json")
+
+    limit = limit or DEFAULT_ORDER_PAGE_SIZE
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+            values[0] = datetime.fromisoformat(values[0])
+            query = query.filter(keyset_filter(ORDER_KEYS, values))
+        except (ValueError, TypeError, IndexError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+    orders = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor([orders[-1].created_at, orders[-1].id])
+    return json_response({"items": [order_summary_to_dict(order) for order in orders], "next_cursor": next_cursor})
 
 @router.get("/", response_model=list)
 def get_user_orders(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Get orders for the authenticated user."""
     orders = db.query(Order).filter(Order.user_id == current_user.id).order_by(Order.created_at.desc()).all()
-    return [{
-        "id": order.public_id or order.id,
-        "invoice_number": order.invoice_number or f"ORD-{order.id}",
-        "total_amount": order.total_amount,
-        "status": order.status,
-        "created_at": order.created_at,
-        "customer_json": order.customer_json,
-        "items_json": order.items_json
-    } for order in orders]
+    return json_response([order_summary_to_dict(order) for order in orders])
+
+@router.get("/stats/revenue")
+def get_revenue(start: Optional[datetime] = None, end: Optional[datetime] = None, by_day: bool = False,
+                db: Session = Depends(get_db), admin: User = Depends(get_current_admin)):
+    """Admin: revenue and order count for paid orders in [start, end)."""
+    return revenue_summary(db, start, end, by_day)
+
+@router.get("/stats/top-products")
+def get_top_products(limit: int = Query(10, ge=1, le=100), start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, db: Session = Depends(get_db),
+                     admin: User = Depends(get_current_admin)):
+    """Admin: best-selling products by units sold."""
+    return top_sellers(db, limit, start, end)
 
 @router.get("/{order_id}", response_model=OrderDetailResponse)
 def get_order(order_id: str, db: Session = Depends(get_db)):
@@ -96,13 +166,31 @@ def get_order(order_id: str, db: Session = Depends(get_db)):
     if not order_obj:
         raise HTTPException(status_code=404, detail="Order not found")
 
+    return json_response(order_to_dict(order_obj))
+
+@router.get("/{order_id}/invoice")
+def get_order_invoice(order_id: str, db: Session = Depends(get_db)):
+    """Invoice PDF for an order (by public id), rendered on first request and served from disk after."""
+    order_obj = fetch_order_by_public_id(db, order_id)
+    if not order_obj:
+        raise HTTPException(status_code=404, detail="Order not found")
+    try:
+        path = invoice_renderer.render(invoice_job(order_obj))
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="Invoice is still being generated", headers={"Retry-After": "5"})
+    return FileResponse(path, media_type="application/pdf", filename=os.path.basename(path))
+
+@router.get("/{order_id}/payment")
+def get_order_payment(order_id: str, db: Session = Depends(get_db)):
+    """Payment progress for an order placed through /checkout; clients poll this after checking out."""
+    order_obj = fetch_order_by_public_id(db, order_id)
+    if not order_obj:
+        raise HTTPException(status_code=404, detail="Order not found")
     return {
-        "id": order_obj.public_id,
-        "createdAt": order_obj.created_at,
-        "customer": order_obj.get_customer(),
-        "items": order_obj.get_items(),
-        "total": order_obj.total_amount,
-        "status": order_obj.status
+        "order_id": order_obj.public_id,
+        "status": order_obj.status,
+        "payment_status": order_obj.payment_status,
+        "payment_error": order_obj.payment_error,
     }
 
 @router.put("/{order_id}/status")
@@ -112,22 +200,42 @@ def update_order_status(order_id: int, payload: dict, db: Session = Depends(get_
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    old_status = order.status
     order.status = payload.get('status', order.status)
+    try:
+        changes = inventory.apply_status(db, order.id, order.status, old_status)
+    except inventory.InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    analytics.record_status_changes(db, [(order, old_status)])
     db.commit()
+    inventory.notify_stock_changes(changes)
     return {"message": "Order status updated", "status": order.status}
 
 @router.post("/checkout")
 def checkout(
     payload: CheckoutRequest,
-    background_tasks: BackgroundTasks, 
     db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    """
+    Place an order from the cart and send an M-Pesa STK push. With an
+    Idempotency-Key header a retried request replays the first response
+    instead of pushing (and charging) again.
+    """
+    return idempotent(
+        db, idempotency_key, f"orders:checkout:{current_user.id}", payload.model_dump(mode="json"),
+        lambda: _checkout(payload, db, current_user)
+    )
+
+
+def _checkout(payload, db, current_user):
     # 1. Get Phone Number from the Request
     user_phone = payload.phone_number 
 
     # 2. Try to get cart items from database first, then from payload
-    cart_items_db = db.query(CartItem).filter(CartItem.user_id == current_user.id).all()
+    # one join for every line's name/price instead of a lazy load per item
+    cart_items_db = load_cart(db, current_user.id)
     
     items_for_pdf = []
     total = 0
@@ -136,17 +244,19 @@ def checkout(
         # Use database cart
         for item in cart_items_db:
             items_for_pdf.append({
-                "name": item.product.name,
+                "id": item.product_id,
+                "name": item.name,
                 "quantity": item.quantity,
-                "price": item.product.price
+                "price": item.price
             })
-            total += item.product.price * item.quantity
+        total = cart_total(cart_items_db)
     elif payload.cart_items:
         # Use frontend cart from payload (items already have all details)
         for item in payload.cart_items:
             quantity = item.get('quantity', 1)
             price = float(item.get('price', 0))
             items_for_pdf.append({
+                "id": item.get('product_id') or item.get('id'),
                 "name": item.get('name'),
                 "quantity": quantity,
                 "price": price
@@ -157,9 +267,13 @@ def checkout(
     
     if not items_for_pdf:
         raise HTTPException(status_code=400, detail="Cart is empty")
+    try:
+        inventory.check_products(db, (item["id"] for item in items_for_pdf))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # 3. Generate invoice number
-    invoice_no = f"INV-{uuid.uuid4().hex[:6].upper()}"
+    # 3. Generate order and invoice numbers
+    public_id, invoice_no = new_order_ids()
     
     # 4. Save Order (don't clear database cart if using frontend cart)
     new_order = Order(
@@ -167,7 +281,8 @@ def checkout(
         total_amount=total,
         invoice_number=invoice_no,
         status="pending",
-        public_id=str(uuid.uuid4())
+        public_id=public_id,
+        payment_status="pending"
     )
     
     # Store customer and items data for order confirmation page
@@ -177,40 +292,42 @@ def checkout(
         "email": current_user.email,
         "address": "",
         "city": "",
-        "zip": ""
+        "zip": "",
+        "paymentMethod": "mpesa",
+        # normalized, so a callback for an unconfirmed push can be matched
+        "mpesaPhone": normalize_phone(user_phone) or user_phone
     }
     new_order.set_customer(customer_data)
     new_order.set_items(items_for_pdf)
     
     db.add(new_order)
+    db.flush()
+
+    # Hold the stock until the M-Pesa payment lands (or the hold expires)
+    try:
+        stock_changes = inventory.reserve(
+            db, new_order.id, inventory.basket((item["id"], item["quantity"]) for item in items_for_pdf)
+        )
+    except inventory.InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Only clear database cart if it was used
     if cart_items_db:
         db.query(CartItem).filter(CartItem.user_id == current_user.id).delete()
     
+    analytics.record_order(db, new_order)
     db.commit()
+    inventory.notify_stock_changes(stock_changes)
     db.refresh(new_order)
 
-    # 5. Generate PDF Invoice
-    pdf_path = generate_invoice_pdf(invoice_no, total, current_user.email, items_for_pdf)
+    # 5. Queue the M-Pesa STK push; its outcome is polled from /{order_id}/payment
+    payment_dispatcher.submit(new_order.id, user_phone, int(total), invoice_no)
 
-    # 6. M-Pesa Trigger using the dynamic phone number
-    try:
-        mpesa_response = initiate_stk_push(
-            phone=user_phone,
-            amount=int(total),
-            invoice_no=invoice_no
-        )
-    except Exception as e:
-        mpesa_response = {"error": "M-Pesa Service Unavailable", "details": str(e)}
-
-    # 7. Send Email in Background
-    background_tasks.add_task(
-        send_invoice_email, 
-        recipient_email=current_user.email, 
-        invoice_no=invoice_no, 
-        pdf_path=pdf_path
-    )
+    # 6. Render the invoice in the worker pool and email it when it's done
+    queue_invoice(new_order)
 
     return {
         "message": "Checkout initiated.",
@@ -220,111 +337,34 @@ def checkout(
             "total": total,
             "items": items_for_pdf
         },
-        "mpesa_status": mpesa_response
+        "status": "payment_pending",
+        "payment_url": f"/api/orders/{new_order.public_id}/payment"
     }
 
 
 @router.post("/mpesa-callback")
-async def mpesa_callback(request: Request, db: Session = Depends(get_db)):
-    """
-    M-Pesa callback endpoint - receives payment notifications from Safaricom.
-    This endpoint is called by Safaricom after customer completes/cancels payment.
-    """
-    try:
-        # Get the raw callback data from Safaricom
-        callback_data = await request.json()
-        logger.info(f"M-Pesa Callback received: {json.dumps(callback_data, indent=2)}")
-        
-        # Extract the callback body
-        result_code = callback_data.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-        result_desc = callback_data.get("Body", {}).get("stkCallback", {}).get("ResultDesc")
-        
-        # Get transaction details
-        callback_metadata = callback_data.get("Body", {}).get("stkCallback", {}).get("CallbackMetadata", {})
-        items = callback_metadata.get("Item", [])
-        
-        # Parse metadata
-        mpesa_receipt = None
-        phone_number = None
-        amount = None
-        
-        for item in items:
-            name = item.get("Name")
-            value = item.get("Value")
-            
-            if name == "MpesaReceiptNumber":
-                mpesa_receipt = value
-            elif name == "PhoneNumber":
-                phone_number = value
-            elif name == "Amount":
-                amount = value
-        
-        # Find order by invoice number from AccountReference
-        merchant_request_id = callback_data.get("Body", {}).get("stkCallback", {}).get("MerchantRequestID")
-        checkout_request_id = callback_data.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-        
-        if result_code == 0:
-            # Payment successful
-            logger.info(f"Payment SUCCESS - Receipt: {mpesa_receipt}, Phone: {phone_number}, Amount: {amount}")
-            
-            # TODO: Update order status in database
-            # You can store mpesa_receipt, update status to 'paid', etc.
-            # Example:
-            # order = db.query(Order).filter(Order.invoice_number == account_ref).first()
-            # if order:
-            #     order.status = "paid"
-            #     order.payment_reference = mpesa_receipt
-            #     db.commit()
-            
-            return {
-                "ResultCode": 0,
-                "ResultDesc": "Success"
-            }
-        else:
-            # Payment failed or cancelled
-            logger.warning(f"Payment FAILED - Code: {result_code}, Desc: {result_desc}")
-            
-            return {
-                "ResultCode": 0,
-                "ResultDesc": "Callback received"
-            }
-            
-    except Exception as e:
-        logger.error(f"Error processing M-Pesa callback: {e}")
-        # Always return success to Safaricom to avoid retries
-        return {
-            "ResultCode": 0,
-            "ResultDesc": "Callback received"
-        }
-
 @router.post("/mpesa/callback")
-async def mpesa_callback(payload: dict):
+def mpesa_callback(payload: dict, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """
-    M-Pesa callback endpoint.
-    Safaricom sends payment confirmation here.
+    M-Pesa callback endpoint - receives payment notifications from Safaricom
+    after the customer completes/cancels payment. Marks the order paid (or
+    the payment failed) with one indexed lookup and acknowledges straight
+    away; the receipt email goes out after the response.
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     try:
-        logger.info(f"M-Pesa Callback received: {json.dumps(payload, indent=2)}")
-        
-        # Extract callback data
-        result_code = payload.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-        result_desc = payload.get("Body", {}).get("stkCallback", {}).get("ResultDesc")
-        
-        if result_code == 0:
-            # Payment successful
-            logger.info(f"Payment successful: {result_desc}")
-            # TODO: Update order status in database
-            # merchant_request_id = payload.get("Body", {}).get("stkCallback", {}).get("MerchantRequestID")
-            # checkout_request_id = payload.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-        else:
-            # Payment failed or cancelled
-            logger.warning(f"Payment failed: {result_desc}")
-        
-        return {"ResultCode": 0, "ResultDesc": "Callback received successfully"}
-        
+        paid_order, callback = handle_callback(db, payload)
     except Exception as e:
+        db.rollback()
         logger.error(f"Error processing M-Pesa callback: {e}")
-        return {"ResultCode": 1, "ResultDesc": f"Error: {str(e)}"}
\ No newline at end of file
+        # Always acknowledge; reconciliation settles anything missed here
+        return MPESA_ACK
+
+    if paid_order is not None:
+        background_tasks.add_task(
+            send_payment_receipt_email,
+            recipient_email=paid_order.customer_email,
+            invoice_no=paid_order.invoice_number or paid_order.public_id,
+            receipt=callback["receipt"],
+            amount=paid_order.total_amount or 0,
+        )
+    return MPESA_ACK
@@ -1,62 +1,312 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional  # <--- Added Optional here
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import Session, load_only
+from typing import List, Optional, Union  # <--- Added Optional here
 from app.database import get_db
 from app.models import Product, Category
-from app.schemas import ProductSchema
+from app.schemas import ProductSchema, ProductPage
+from app.services.catalog_cache import catalog_cache
+from app.services.invalidation import bus
+from app.services.category_registry import category_registry
+from app.services.search import apply_search
+from app.services.suggest import suggest_index
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_filter, order_by_keys
+from app.utils.http_cache import make_etag, conditional_response
+from app.utils.serializers import PRODUCT_FIELDS, product_to_dict, dumps, json_response
+from app.utils.compression import cached_json_response
 
 router = APIRouter()
 
-@router.get("/", response_model=List[ProductSchema])
+# Keyset sort orders: list of (column, descending). Every order ends on id so
+# the cursor is unique even when prices tie. 'relevance' is built per request
+# from the search rank.
+SORT_KEYS = {
+    'id': [(Product.id, False)],
+    'price': [(Product.price, False), (Product.id, False)],
+    'price_desc': [(Product.price, True), (Product.id, False)],
+    'rating': [(func.coalesce(Product.rating, 0), True), (Product.id, False)],
+    'newest': [(Product.id, True)],
+}
+SORT_PATTERN = '^(' + '|'.join(list(SORT_KEYS) + ['relevance']) + ')$'
+
+# Upper bounds (KES) of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKETS = [1000, 2500, 5000, 10000]
+
+DEFAULT_PAGE_SIZE = 24
+
+
+class ProductFilters:
+    """Query-string filters shared by the listing and facet endpoints."""
+
+    def __init__(
+        self,
+        category_id: Optional[int] = None,
+        category: Optional[str] = None,
+        search: Optional[str] = None,
+        min_price: Optional[float] = Query(None, ge=0),
+        max_price: Optional[float] = Query(None, ge=0),
+        min_rating: Optional[float] = Query(None, ge=0, le=5),
+        is_new: Optional[bool] = None,
+        in_stock: Optional[bool] = None,
+    ):
+        self.category_id = category_id
+        self.category = category
+        self.search = search
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_rating = min_rating
+        self.is_new = is_new
+        self.in_stock = in_stock
+
+    def resolve_category(self):
+        """Turn ?category=<name> into an id; needs the category registry loaded."""
+        if self.category:
+            # unknown names match nothing rather than falling back to "all"
+            self.category_id = category_registry.id_for(self.category) or -1
+        return self.category_id or None
+
+    def key(self):
+        return (self.category_id, self.search, self.min_price, self.max_price,
+                self.min_rating, self.is_new, self.in_stock)
+
+    def price_clauses(self):
+        clauses = []
+        if self.min_price is not None:
+            clauses.append(Product.price >= self.min_price)
+        if self.max_price is not None:
+            clauses.append(Product.price <= self.max_price)
+        return clauses
+
+    def apply(self, db, query, skip_category=False, skip_price=False):
+        """Returns (query, search rank or None)."""
+        # Filter out products with NULL required fields
+        query = query.filter(
+            Product.name.isnot(None),
+            Product.price.isnot(None),
+            Product.category_id.isnot(None)
+        )
+        if self.category_id and not skip_category:
+            query = query.filter(Product.category_id == self.category_id)
+        if not skip_price:
+            query = query.filter(*self.price_clauses())
+        if self.min_rating is not None:
+            query = query.filter(Product.rating >= self.min_rating)
+        if self.is_new is not None:
+            query = query.filter(Product.is_new == self.is_new)
+        if self.in_stock is True:
+            query = query.filter(Product.stock_quantity > 0)
+        elif self.in_stock is False:
+            query = query.filter(Product.stock_quantity <= 0)
+        rank = None
+        if self.search:
+            query, rank = apply_search(db, query, self.search)
+        return query, rank
+
+
+def _serialize_product(p, fields=None):
+    return product_to_dict(p, category_registry.name_for(p.category_id), fields)
+
+
+def _catalog_version(db):
+    """(row count, newest updated_at) of products; cached until the next product write."""
+    version = catalog_cache.get_list(('version',))
+    if version is None:
+        version = tuple(db.query(func.count(Product.id), func.max(Product.updated_at)).one())
+        catalog_cache.set_list(('version',), None, version)
+    return version
+
+
+def _list_validators(db, cache_key, cached):
+    """ETag/Last-Modified for a list or facet response, without touching its rows."""
+    if cached is not None:
+        return cached["etag"], cached["last_modified"]
+    count, last_modified = _catalog_version(db)
+    return make_etag(cache_key, count, last_modified, category_registry.fingerprint), last_modified
+
+
+def _product_entry(prod):
+    # cached entries hold the encoded JSON so hits skip serialization entirely
+    return {
+        "body": dumps(_serialize_product(prod)),
+        "etag": make_etag('product', prod.id, prod.updated_at, category_registry.fingerprint),
+        "last_modified": prod.updated_at,
+    }
+
+
+def _parse_fields(fields: Optional[str]):
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+@router.get("/", response_model=Union[List[dict], ProductPage])
 def get_products(
-    category_id: Optional[int] = None, 
-    search: Optional[str] = None, 
+    request: Request,
+    filters: ProductFilters = Depends(),
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = Query(None, pattern=SORT_PATTERN),
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
+    """
+    List products.
+
+    Without `limit`/`cursor` the whole filtered catalog is returned as a list
+    (legacy behaviour). With them, a page of at most `limit` products is
+    returned as {"items": [...], "next_cursor": ...}; pass `next_cursor` back
+    as `cursor` to fetch the following page. `fields` is a comma-separated
+    projection (e.g. fields=id,name,price,image) and only those columns are
+    SELECTed. `category` filters by category name instead of id. `search`
+    results are ranked by relevance unless another sort is requested.
+
+    Responses carry an ETag/Last-Modified derived from the catalog version,
+    and If-None-Match/If-Modified-Since are answered with 304 before any
+    product row is read.
+    """
+    requested_fields = _parse_fields(fields)
+    sort = sort or ('relevance' if filters.search else 'id')
+    if sort == 'relevance' and not filters.search:
+        sort = 'id'
+
+    category_registry.ensure_loaded(db)
+    category_id = filters.resolve_category()
+
+    cache_key = ('list', filters.key(), cursor, limit, sort, fields)
+    cached = catalog_cache.get_list(cache_key)
+    etag, last_modified = _list_validators(db, cache_key, cached)
+    not_modified, headers = conditional_response(request, etag, last_modified)
+    if not_modified:
+        return not_modified
+    if cached is not None:
+        return cached_json_response(request, cached, headers)
+
     query = db.query(Product)
-    # Filter out products with NULL required fields
-    query = query.filter(
-        Product.name.isnot(None),
-        Product.price.isnot(None),
-        Product.category_id.isnot(None)
+    if requested_fields:
+        columns = {PRODUCT_FIELDS[f] for f in requested_fields}
+        query = query.options(load_only(*[getattr(Product, c) for c in sorted(columns)]))
+    query, rank = filters.apply(db, query)
+
+    sort_keys = [(rank, True), (Product.id, False)] if sort == 'relevance' else SORT_KEYS[sort]
+    # select the sort key alongside each row so next_cursor can be built
+    # even when it is an expression (the search rank) or projected away
+    query = query.add_columns(*[key.label(f"sort_{i}") for i, (key, _) in enumerate(sort_keys)])
+    query = query.order_by(*order_by_keys(sort_keys))
+
+    paginated = limit is not None or cursor is not None
+    if not paginated:
+        body = dumps([_serialize_product(row[0], requested_fields) for row in query.all()])
+        entry = {"body": body, "etag": etag, "last_modified": last_modified}
+        catalog_cache.set_list(cache_key, category_id, entry)
+        return cached_json_response(request, entry, headers)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    if cursor:
+        try:
+            query = query.filter(keyset_filter(sort_keys, decode_cursor(cursor)))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][1:]))
+
+    body = dumps({
+        "items": [_serialize_product(row[0], requested_fields) for row in rows],
+        "next_cursor": next_cursor
+    })
+    entry = {"body": body, "etag": etag, "last_modified": last_modified}
+    catalog_cache.set_list(cache_key, category_id, entry)
+    return cached_json_response(request, entry, headers)
+
+
+@router.get("/facets")
+def get_product_facets(
+    request: Request,
+    filters: ProductFilters = Depends(),
+    db: Session = Depends(get_db)
+):
+    """
+    Counts per category and per price bucket for the current filters.
+
+    Each facet ignores its own filter (so picking a category still shows how
+    many products the other categories have), and both come from a single
+    GROUP BY over (category, price bucket, inside the price filter).
+    """
+    category_registry.ensure_loaded(db)
+    category_id = filters.resolve_category()
+
+    cache_key = ('facets', filters.key())
+    cached = catalog_cache.get_list(cache_key)
+    etag, last_modified = _list_validators(db, cache_key, cached)
+    not_modified, headers = conditional_response(request, etag, last_modified)
+    if not_modified:
+        return not_modified
+    if cached is not None:
+        return cached_json_response(request, cached, headers)
+
+    bucket = case(
+        *[(Product.price < bound, i) for i, bound in enumerate(PRICE_BUCKETS)],
+        else_=len(PRICE_BUCKETS)
     )
-    if category_id:
-        query = query.filter(Product.category_id == category_id)
-    if search:
-        query = query.filter(Product.name.ilike(f"%{search}%"))
-    
-    products = query.all()
-    category_map = {1: 'Skincare', 2: 'Haircare', 3: 'Makeup'}
-    
-    result = []
-    for p in products:
-        product_dict = {
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price,
-            'category_id': p.category_id,
-            'category': category_map.get(p.category_id, 'Unknown'),
-            'stock_quantity': p.stock_quantity,
-            'stock': p.stock_quantity,
-            'image': p.image,
-            'rating': p.rating,
-            'is_new': p.is_new,
-            'isNew': p.is_new
-        }
-        result.append(product_dict)
-    
-    return result
+    price_clauses = filters.price_clauses()
+    in_price_range = case((and_(*price_clauses), 1), else_=0) if price_clauses else None
+
+    query = db.query(Product.category_id, bucket.label('bucket'))
+    if in_price_range is not None:
+        query = query.add_columns(in_price_range.label('in_range'))
+    query = query.add_columns(func.count(Product.id).label('n'))
+    query, _ = filters.apply(db, query, skip_category=True, skip_price=True)
+    query = query.group_by(*[c for c in (Product.category_id, bucket, in_price_range) if c is not None])
+
+    category_counts = {}
+    bucket_counts = [0] * (len(PRICE_BUCKETS) + 1)
+    total = 0
+    for row in query.all():
+        in_range = row.in_range if in_price_range is not None else 1
+        in_category = not category_id or row.category_id == category_id
+        if in_range:
+            category_counts[row.category_id] = category_counts.get(row.category_id, 0) + row.n
+        if in_category:
+            bucket_counts[row.bucket] += row.n
+        if in_range and in_category:
+            total += row.n
+
+    bounds = [0] + PRICE_BUCKETS + [None]
+    body = dumps({
+        "total": total,
+        "categories": [
+            {"id": cid, "name": category_registry.name_for(cid), "count": n}
+            for cid, n in sorted(category_counts.items())
+        ],
+        "price_buckets": [
+            {"min": bounds[i], "max": bounds[i + 1], "count": n}
+            for i, n in enumerate(bucket_counts)
+        ],
+    })
+    # unfiltered on category, so any product write should drop it
+    entry = {"body": body, "etag": etag, "last_modified": last_modified}
+    catalog_cache.set_list(cache_key, None, entry)
+    return cached_json_response(request, entry, headers)
 
 
 @router.post("/", response_model=ProductSchema)
 def create_product(payload: dict, db: Session = Depends(get_db)):
+    category_registry.ensure_loaded(db)
+    category_id = payload.get('category_id') or category_registry.id_for(payload.get('category'))
     new = Product(
         name=payload.get('name'),
         description=payload.get('description'),
         price=payload.get('price'),
         stock_quantity=payload.get('stock_quantity', 0),
-        category_id=payload.get('category_id'),
+        category_id=category_id,
         image=payload.get('image'),
         rating=payload.get('rating', 4.5),
         is_new=payload.get('is_new', False)
@@ -64,45 +314,41 @@ def create_product(payload: dict, db: Session = Depends(get_db)):
     db.add(new)
     db.commit()
     db.refresh(new)
-    
-    category_map = {1: 'Skincare', 2: 'Haircare', 3: 'Makeup'}
-    return {
-        'id': new.id,
-        'name': new.name,
-        'description': new.description,
-        'price': new.price,
-        'category_id': new.category_id,
-        'category': category_map.get(new.category_id, 'Unknown'),
-        'stock_quantity': new.stock_quantity,
-        'stock': new.stock_quantity,
-        'image': new.image,
-        'rating': new.rating,
-        'is_new': new.is_new,
-        'isNew': new.is_new
-    }
+
+    entry = _product_entry(new)
+    bus.publish("product", new.id, category_ids=[new.category_id], name=new.name)
+    catalog_cache.set_product(new.id, entry)
+    return json_response(entry["body"])
+
+
+@router.get("/suggest")
+def suggest_products(q: str = "", limit: int = Query(8, ge=1, le=20), db: Session = Depends(get_db)):
+    """Typeahead: product and category names with a word starting with `q`."""
+    suggest_index.ensure_built(db)
+    return suggest_index.suggest(q, limit)
 
 
 @router.get("/{product_id}", response_model=ProductSchema)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    prod = db.query(Product).filter(Product.id == product_id).first()
-    if not prod:
+def get_product(product_id: int, request: Request, db: Session = Depends(get_db)):
+    category_registry.ensure_loaded(db)
+    cached = catalog_cache.get_product(product_id)
+    if cached is not None:
+        not_modified, headers = conditional_response(request, cached["etag"], cached["last_modified"])
+        return not_modified or cached_json_response(request, cached, headers)
+
+    # check validators on the timestamp alone before loading the row
+    version = db.query(Product.updated_at).filter(Product.id == product_id).first()
+    if version is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    category_map = {1: 'Skincare', 2: 'Haircare', 3: 'Makeup'}
-    return {
-        'id': prod.id,
-        'name': prod.name,
-        'description': prod.description,
-        'price': prod.price,
-        'category_id': prod.category_id,
-        'category': category_map.get(prod.category_id, 'Unknown'),
-        'stock_quantity': prod.stock_quantity,
-        'stock': prod.stock_quantity,
-        'image': prod.image,
-        'rating': prod.rating,
-        'is_new': prod.is_new,
-        'isNew': prod.is_new
-    }
+    etag = make_etag('product', product_id, version.updated_at, category_registry.fingerprint)
+    not_modified, headers = conditional_response(request, etag, version.updated_at)
+    if not_modified:
+        return not_modified
+
+    prod = db.query(Product).filter(Product.id == product_id).first()
+    entry = _product_entry(prod)
+    catalog_cache.set_product(product_id, entry)
+    return cached_json_response(request, entry, headers)
 
 
 @router.put("/{product_id}", response_model=ProductSchema)
@@ -110,12 +356,23 @@ def update_product(product_id: int, payload: dict, db: Session = Depends(get_db)
     prod = db.query(Product).filter(Product.id == product_id).first()
     if not prod:
         raise HTTPException(status_code=404, detail="Product not found")
+    old_category_id = prod.category_id
+    category_registry.ensure_loaded(db)
+    payload = dict(payload)
+    # `category` is the display name in responses, not the relationship
+    category_name = payload.pop('category', None)
+    if category_name and not payload.get('category_id'):
+        payload['category_id'] = category_registry.id_for(category_name)
     for k, v in payload.items():
         if hasattr(prod, k) and v is not None:
             setattr(prod, k, v)
     db.commit()
     db.refresh(prod)
-    return prod
+
+    entry = _product_entry(prod)
+    bus.publish("product", prod.id, category_ids=[old_category_id, prod.category_id], name=prod.name)
+    catalog_cache.set_product(prod.id, entry)
+    return json_response(entry["body"])
 
 
 @router.delete("/{product_id}")
@@ -123,6 +380,8 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     prod = db.query(Product).filter(Product.id == product_id).first()
     if not prod:
         raise HTTPException(status_code=404, detail="Product not found")
+    category_id = prod.category_id
     db.delete(prod)
     db.commit()
+    bus.publish("product", product_id, category_ids=[category_id])
     return {"message": "Product deleted"}
\ No newline at end of file
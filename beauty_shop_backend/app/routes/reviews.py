@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Review
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+from app.utils.http_cache import make_etag, conditional_response
+from app.utils.serializers import json_response, review_to_dict
 
 router = APIRouter()
 
@@ -39,6 +42,14 @@ def create_review(review: ReviewCreate, db: Session = Depends(get_db)):
     return new_review
 
 @router.get("/product/{product_id}", response_model=List[ReviewResponse])
-def get_product_reviews(product_id: int, db: Session = Depends(get_db)):
+def get_product_reviews(product_id: int, request: Request, db: Session = Depends(get_db)):
+    count, last_modified = db.query(func.count(Review.id), func.max(Review.updated_at)).filter(
+        Review.product_id == product_id
+    ).one()
+    etag = make_etag('reviews', product_id, count, last_modified)
+    not_modified, headers = conditional_response(request, etag, last_modified)
+    if not_modified:
+        return not_modified
+
     reviews = db.query(Review).filter(Review.product_id == product_id).order_by(Review.created_at.desc()).all()
-    return reviews
+    return json_response([review_to_dict(r) for r in reviews], headers=headers)
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import User
+from app.services.invalidation import bus
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -60,6 +61,7 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db)):
     
     db.commit()
     db.refresh(db_user)
+    bus.publish("user", db_user.id)
     return {"id": db_user.id, "email": db_user.email, "is_admin": db_user.is_admin}
 
 @router.delete("/{user_id}")
@@ -70,4 +72,5 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_user)
     db.commit()
+    bus.publish("user", user_id)
     return {"message": "User deleted successfully"}
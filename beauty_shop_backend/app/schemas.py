@@ -34,6 +34,16 @@ class ProductSchema(BaseModel):
     isNew: Optional[bool] = None
     class Config: from_attributes = True
 
+class ProductPage(BaseModel):
+    # items may be projected down with ?fields=, so they are not ProductSchema
+    items: List[dict]
+    next_cursor: Optional[str] = None
+
+
+class OrderPage(BaseModel):
+    items: List[dict]
+    next_cursor: Optional[str] = None
+
 # Cart
 class CartItemCreate(BaseModel):
     product_id: int
@@ -57,6 +67,7 @@ class OrderResponse(BaseModel):
 
 # Frontend-shaped order models
 class OrderItem(BaseModel):
+    id: Optional[int] = None  # product id; stock is only reserved for items that carry one
     name: str
     quantity: int
     price: float
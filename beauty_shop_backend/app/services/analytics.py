@@ -0,0 +1,216 @@
+import os
+from collections import defaultdict
+from datetime import timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from sqlalchemy import func, delete
+from app.models import Order, OrderItem, Product, SalesRollup
+from app.services import inventory
+
+# Day buckets follow the shop's local calendar
+try:
+    ANALYTICS_TIMEZONE = ZoneInfo(os.getenv("ANALYTICS_TIMEZONE", "Africa/Nairobi"))
+except ZoneInfoNotFoundError:  # pragma: no cover - no tz database installed
+    ANALYTICS_TIMEZONE = timezone.utc
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("status", "category", "product")
+REBUILD_BATCH = 1000
+
+
+def is_sale(status) -> bool:
+    return (status or "").lower() in inventory.COMMIT_STATUSES
+
+
+def bucket_start(moment, granularity: str):
+    """Start of the local hour/day containing `moment`, as an aware UTC datetime."""
+    if moment.tzinfo is None:
+        # SQLite hands back naive datetimes; they were stored as UTC
+        moment = moment.replace(tzinfo=timezone.utc)
+    local = moment.astimezone(ANALYTICS_TIMEZONE)
+    local = local.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        local = local.replace(hour=0)
+    return local.astimezone(timezone.utc)
+
+
+class RollupDeltas:
+    """Increments to apply to sales_rollups, merged per row before hitting the database."""
+
+    def __init__(self):
+        self._rows = defaultdict(lambda: [0, 0, 0.0])
+
+    def add(self, created_at, dimension: str, key, orders=0, units=0, revenue=0.0):
+        for granularity in GRANULARITIES:
+            row = self._rows[(dimension, granularity, bucket_start(created_at, granularity), str(key))]
+            row[0] += orders
+            row[1] += units
+            row[2] += revenue
+
+    def add_status(self, order, status, sign: int):
+        self.add(order.created_at, "status", (status or "unknown").lower(), sign, 0, sign * (order.total_amount or 0))
+
+    def add_sales(self, db, orders, sign: int):
+        """Category and product contributions of `orders`' line items, read in one query."""
+        by_id = {order.id: order for order in orders}
+        if not by_id:
+            return
+        items = (
+            db.query(OrderItem.order_id, OrderItem.product_id, OrderItem.name, OrderItem.quantity,
+                     OrderItem.unit_price, Product.category_id)
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .filter(OrderItem.order_id.in_(list(by_id)))
+            .all()
+        )
+        seen = set()
+        for item in items:
+            created_at = by_id[item.order_id].created_at
+            units = sign * item.quantity
+            revenue = sign * item.quantity * item.unit_price
+            product_key = item.product_id if item.product_id is not None else f"name:{item.name}"
+            category_key = item.category_id if item.category_id is not None else "none"
+            # count each order once per product/category it touches
+            for dimension, key in (("product", product_key), ("category", category_key)):
+                first = (item.order_id, dimension, key) not in seen
+                seen.add((item.order_id, dimension, key))
+                self.add(created_at, dimension, key, sign if first else 0, units, revenue)
+
+    def flush(self, db):
+        """Upsert every merged increment with one INSERT ... ON CONFLICT DO UPDATE."""
+        if not self._rows:
+            return
+        # sorted so concurrent flushes touch rows in the same order
+        rows = [
+            {"dimension": d, "granularity": g, "bucket_start": b, "dimension_key": k,
+             "orders": v[0], "units": v[1], "revenue": v[2]}
+            for (d, g, b, k), v in sorted(self._rows.items())
+        ]
+        self._rows.clear()
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            return _update_or_insert(db, rows)
+        stmt = insert(SalesRollup).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["dimension", "granularity", "bucket_start", "dimension_key"],
+            set_={
+                "orders": SalesRollup.orders + stmt.excluded.orders,
+                "units": SalesRollup.units + stmt.excluded.units,
+                "revenue": SalesRollup.revenue + stmt.excluded.revenue,
+            },
+        )
+        db.execute(stmt)
+
+
+def _update_or_insert(db, rows):
+    for row in rows:
+        key = {k: row[k] for k in ("dimension", "granularity", "bucket_start", "dimension_key")}
+        updated = db.query(SalesRollup).filter_by(**key).update({
+            "orders": SalesRollup.orders + row["orders"],
+            "units": SalesRollup.units + row["units"],
+            "revenue": SalesRollup.revenue + row["revenue"],
+        }, synchronize_session=False)
+        if not updated:
+            db.add(SalesRollup(**row))
+    db.flush()
+
+
+def record_order(db, order):
+    """Add a newly placed order to the rollups (call inside its transaction)."""
+    deltas = RollupDeltas()
+    deltas.add_status(order, order.status, 1)
+    if is_sale(order.status):
+        deltas.add_sales(db, [order], 1)
+    deltas.flush(db)
+
+
+def record_status_changes(db, changes):
+    """Move orders between status buckets. `changes` is [(order, old_status)], order.status being the new one."""
+    deltas = RollupDeltas()
+    became_sale, stopped_being_sale = [], []
+    for order, old_status in changes:
+        if (old_status or "").lower() == (order.status or "").lower():
+            continue
+        deltas.add_status(order, old_status, -1)
+        deltas.add_status(order, order.status, 1)
+        if is_sale(order.status) and not is_sale(old_status):
+            became_sale.append(order)
+        elif is_sale(old_status) and not is_sale(order.status):
+            stopped_being_sale.append(order)
+    deltas.add_sales(db, became_sale, 1)
+    deltas.add_sales(db, stopped_being_sale, -1)
+    deltas.flush(db)
+
+
+def rebuild(db) -> int:
+    """Recompute every rollup from the orders table. Returns the number of orders read."""
+    db.execute(delete(SalesRollup))
+    count = 0
+    batch = []
+    for order in db.query(Order).order_by(Order.id).yield_per(REBUILD_BATCH):
+        batch.append(order)
+        if len(batch) >= REBUILD_BATCH:
+            count += _rebuild_batch(db, batch)
+            batch = []
+    if batch:
+        count += _rebuild_batch(db, batch)
+    db.commit()
+    return count
+
+
+def _rebuild_batch(db, orders):
+    deltas = RollupDeltas()
+    for order in orders:
+        deltas.add_status(order, order.status, 1)
+    deltas.add_sales(db, [o for o in orders if is_sale(o.status)], 1)
+    deltas.flush(db)
+    return len(orders)
+
+
+def rollup_rows(db, dimension: str, granularity: str = "day", start=None, end=None):
+    query = db.query(SalesRollup).filter(SalesRollup.dimension == dimension, SalesRollup.granularity == granularity)
+    if start is not None:
+        query = query.filter(SalesRollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        query = query.filter(SalesRollup.bucket_start < end)
+    return query.order_by(SalesRollup.bucket_start, SalesRollup.dimension_key)
+
+
+def sales_timeline(db, granularity: str = "day", start=None, end=None):
+    """Revenue and orders per bucket, sale statuses only."""
+    totals = defaultdict(lambda: {"orders": 0, "revenue": 0.0})
+    all_orders = defaultdict(int)
+    for row in rollup_rows(db, "status", granularity, start, end):
+        bucket = row.bucket_start
+        all_orders[bucket] += row.orders
+        if is_sale(row.dimension_key):
+            totals[bucket]["orders"] += row.orders
+            totals[bucket]["revenue"] += row.revenue
+    return [
+        {"bucket": bucket, "orders": totals[bucket]["orders"], "revenue": totals[bucket]["revenue"],
+         "all_orders": all_orders[bucket]}
+        for bucket in sorted(all_orders)
+    ]
+
+
+def totals_by_key(db, dimension: str, start=None, end=None, limit: int = None, order_by: str = "revenue"):
+    """Sum day rollups per dimension_key over [start, end)."""
+    orders = func.sum(SalesRollup.orders).label("orders")
+    units = func.sum(SalesRollup.units).label("units")
+    revenue = func.sum(SalesRollup.revenue).label("revenue")
+    query = db.query(SalesRollup.dimension_key, orders, units, revenue).filter(
+        SalesRollup.dimension == dimension, SalesRollup.granularity == "day"
+    )
+    if start is not None:
+        query = query.filter(SalesRollup.bucket_start >= bucket_start(start, "day"))
+    if end is not None:
+        query = query.filter(SalesRollup.bucket_start < end)
+    sort = {"revenue": revenue, "units": units, "orders": orders}[order_by]
+    # keys whose orders all moved out (cancelled, refunded) keep zeroed rows
+    query = query.group_by(SalesRollup.dimension_key).having(orders != 0)
+    query = query.order_by(sort.desc(), SalesRollup.dimension_key)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
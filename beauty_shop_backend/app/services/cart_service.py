@@ -0,0 +1,28 @@
+from app.models import CartItem, Product
+
+
+def load_cart(db, user_id: int):
+    """
+    The user's cart lines joined to the product columns checkout and the
+    cart view need (name, price, stock, image), in a single query.
+    Lines whose product has been deleted are dropped by the inner join.
+    """
+    return (
+        db.query(
+            CartItem.id,
+            CartItem.product_id,
+            CartItem.quantity,
+            Product.name,
+            Product.price,
+            Product.stock_quantity,
+            Product.image,
+        )
+        .join(Product, Product.id == CartItem.product_id)
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+
+
+def cart_total(lines) -> float:
+    return sum((line.price or 0) * line.quantity for line in lines)
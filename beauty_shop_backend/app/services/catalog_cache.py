@@ -0,0 +1,68 @@
+import os
+from app.utils.cache import TTLCache
+from app.services.invalidation import bus
+
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "2048"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+
+
+class CatalogCache:
+    """
+    Read-through cache for the product endpoints.
+
+    List pages are keyed by their full query (category_id, search, cursor, ...)
+    and remember which category they were filtered on, so a write only drops
+    the pages that could contain the product. Single products are keyed by id.
+    """
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL, enabled: bool = CATALOG_CACHE_ENABLED):
+        self.enabled = enabled
+        self.lists = TTLCache(maxsize, ttl)
+        self.products = TTLCache(maxsize, ttl)
+
+    def get_list(self, key):
+        if not self.enabled:
+            return None
+        entry = self.lists.get(key)
+        return entry[1] if entry is not None else None
+
+    def set_list(self, key, category_id, payload):
+        if self.enabled:
+            self.lists.set(key, (category_id, payload))
+
+    def get_product(self, product_id: int):
+        return self.products.get(product_id) if self.enabled else None
+
+    def set_product(self, product_id: int, payload):
+        if self.enabled:
+            self.products.set(product_id, payload)
+
+    def invalidate_product(self, product_id: int, *category_ids):
+        """
+        Forget a product and every list page it could appear on: pages filtered
+        on one of its (old or new) categories, and unfiltered pages.
+        """
+        self.products.pop(product_id)
+        affected = set(category_ids)
+        self.lists.pop_where(lambda key, value: value[0] is None or value[0] in affected)
+
+    def clear(self):
+        self.lists.clear()
+        self.products.clear()
+
+
+catalog_cache = CatalogCache()
+
+
+def _on_product_changed(product_id, data):
+    catalog_cache.invalidate_product(product_id, *data.get("category_ids", []))
+
+
+def _on_category_changed(category_id, data):
+    # category names are denormalised into every cached product
+    catalog_cache.clear()
+
+
+bus.subscribe("product", _on_product_changed)
+bus.subscribe("category", _on_category_changed)
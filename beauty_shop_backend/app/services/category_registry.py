@@ -0,0 +1,68 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from app.models import Category
+from app.services.invalidation import bus
+
+logger = logging.getLogger(__name__)
+
+# Safety net for rows inserted outside the API (seed scripts, psql)
+CATEGORY_REGISTRY_TTL = float(os.getenv("CATEGORY_REGISTRY_TTL", "300"))
+
+
+class CategoryRegistry:
+    """
+    In-memory copy of the categories table with O(1) id->name and name->id
+    lookups. Loaded once at startup, reloaded when a "category" event arrives
+    on the invalidation bus or the snapshot is older than the TTL.
+    """
+
+    def __init__(self, ttl: float = CATEGORY_REGISTRY_TTL):
+        self.ttl = ttl
+        self.version = 0
+        # content hash, identical in every worker holding the same rows
+        self.fingerprint = None
+        self._by_id = {}
+        self._by_name = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        rows = db.query(Category.id, Category.name).all()
+        by_id = {row.id: row.name for row in rows}
+        by_name = {row.name.lower(): row.id for row in rows if row.name}
+        with self._lock:
+            self._by_id, self._by_name = by_id, by_name
+            self.fingerprint = hashlib.sha1(repr(sorted(by_id.items())).encode()).hexdigest()[:16]
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+    def ensure_loaded(self, db):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self.load(db)
+
+    def name_for(self, category_id, default='Unknown'):
+        return self._by_id.get(category_id, default)
+
+    def id_for(self, name: str):
+        return self._by_name.get(name.lower()) if name else None
+
+    def all(self):
+        return [{"id": cid, "name": name} for cid, name in sorted(self._by_id.items())]
+
+    def invalidate(self):
+        """Force a reload on next use."""
+        self._loaded_at = None
+
+
+category_registry = CategoryRegistry()
+
+
+def _on_category_changed(category_id, data):
+    category_registry.invalidate()
+
+
+bus.subscribe("category", _on_category_changed)
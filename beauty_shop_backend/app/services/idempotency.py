@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+from datetime import timedelta, timezone
+from fastapi import HTTPException, Response
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from app.models import IdempotencyKey, utcnow
+from app.utils.serializers import dumps, json_response
+
+# How long a key (and the response it got) is remembered
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# An in-progress key older than this belonged to a request that died; let a retry take it over
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "120"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _utc(dt):
+    # SQLite hands back naive datetimes; they were stored as UTC
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def claim(db, scope: str, key: str, request_hash: str):
+    """
+    Record that `key` is being processed. Returns (record, None) when the
+    caller should run the request, or (None, record) holding the stored
+    response of an earlier completed attempt. Raises HTTPException 422 if
+    the key was used with a different request, 409 while the first attempt
+    is still running.
+    """
+    for _ in range(3):
+        now = utcnow()
+        record = IdempotencyKey(
+            scope=scope, key=key, request_hash=request_hash, status="in_progress",
+            created_at=now, expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+        )
+        db.add(record)
+        try:
+            db.commit()
+            return record, None
+        except IntegrityError:
+            db.rollback()
+
+        existing = db.query(IdempotencyKey).filter(IdempotencyKey.scope == scope, IdempotencyKey.key == key).first()
+        if existing is None:
+            continue
+        if _utc(existing.expires_at) < now:
+            db.delete(existing)
+            db.commit()
+            continue
+        if existing.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if existing.status == "completed":
+            return None, existing
+        stale_before = now - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        taken = db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.id == existing.id, IdempotencyKey.status == "in_progress",
+                   IdempotencyKey.created_at < stale_before)
+            .values(created_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if taken:
+            db.refresh(existing)
+            return existing, None
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still being processed",
+            headers={"Retry-After": "1"},
+        )
+    raise HTTPException(status_code=409, detail="Could not claim Idempotency-Key, please retry")
+
+
+def complete(db, record, status_code: int, body: bytes):
+    record.status = "completed"
+    record.response_status = status_code
+    record.response_body = body.decode()
+    db.commit()
+
+
+def release(db, record):
+    """Forget a claim whose request failed, so the client can retry it."""
+    db.rollback()
+    db.execute(delete(IdempotencyKey).where(IdempotencyKey.id == record.id))
+    db.commit()
+
+
+def idempotent(db, key, scope: str, request_data, handler):
+    """
+    Run handler() at most once per (scope, Idempotency-Key). Retries get
+    the first successful response replayed; failed attempts aren't stored.
+    Without a key the handler simply runs.
+    """
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    record, replay = claim(db, scope, key, request_fingerprint(request_data))
+    if replay is not None:
+        return json_response(
+            replay.response_body.encode(), status_code=replay.response_status,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    try:
+        result = handler()
+    except Exception:
+        release(db, record)
+        raise
+
+    if isinstance(result, Response):
+        status_code, body = result.status_code, bytes(result.body)
+    else:
+        status_code, body = 200, dumps(result)
+    if 200 <= status_code < 300:
+        complete(db, record, status_code, body)
+    else:
+        release(db, record)
+    if isinstance(result, Response):
+        return result
+    return json_response(body, status_code=status_code)
+
+
+def purge_expired(db) -> int:
+    deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < utcnow())).rowcount
+    db.commit()
+    return deleted
@@ -0,0 +1,192 @@
+import os
+import json
+import glob
+import uuid
+import socket
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# "local" (single process), "unix:/path/to/dir" or "redis://host:6379/0"
+CACHE_BUS_URL = os.getenv("CACHE_BUS_URL", "local")
+CACHE_BUS_CHANNEL = os.getenv("CACHE_BUS_CHANNEL", "beauty_shop:invalidate")
+
+
+class LocalBackend:
+    """Single-process deployments: nothing to broadcast to."""
+
+    def start(self, deliver):
+        pass
+
+    def publish(self, message: bytes):
+        pass
+
+    def stop(self):
+        pass
+
+
+class UnixSocketBackend:
+    """
+    Broadcast between workers on the same host. Every worker binds a datagram
+    socket in a shared directory and publishing sends to all the others.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._sock = None
+        self._thread = None
+
+    def start(self, deliver):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._thread = threading.Thread(target=self._listen, args=(deliver,), daemon=True)
+        self._thread.start()
+
+    def _listen(self, deliver):
+        while self._sock is not None:
+            try:
+                message = self._sock.recv(65536)
+            except OSError:
+                break
+            deliver(message)
+
+    def publish(self, message: bytes):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            for peer in glob.glob(os.path.join(self.directory, "*.sock")):
+                if peer == self.path:
+                    continue
+                try:
+                    sender.sendto(message, peer)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # worker died without cleaning up its socket
+                    try:
+                        os.unlink(peer)
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    logger.warning(f"Could not notify worker at {peer}: {e}")
+
+    def stop(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class RedisBackend:
+    """
+    Broadcast over Redis pub/sub. `client` only needs redis-py's
+    publish() and pubsub() methods, so tests can pass an in-memory stand-in.
+    """
+
+    def __init__(self, client, channel: str = CACHE_BUS_CHANNEL):
+        self.client = client
+        self.channel = channel
+        self._pubsub = None
+        self._thread = None
+
+    def start(self, deliver):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        self._thread = threading.Thread(target=self._listen, args=(deliver,), daemon=True)
+        self._thread.start()
+
+    def _listen(self, deliver):
+        try:
+            for item in self._pubsub.listen():
+                if item.get("type") == "message":
+                    deliver(item["data"])
+        except Exception as e:
+            if self._pubsub is not None:
+                logger.error(f"Invalidation bus listener stopped: {e}")
+
+    def publish(self, message: bytes):
+        try:
+            self.client.publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Could not publish invalidation event: {e}")
+
+    def stop(self):
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            pubsub.close()
+
+
+def backend_from_url(url: str):
+    if not url or url == "local":
+        return LocalBackend()
+    if url.startswith("unix:"):
+        return UnixSocketBackend(url[len("unix:"):])
+    if url.startswith(("redis://", "rediss://", "unix+redis://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BUS_URL points at Redis but the 'redis' package is not installed")
+        return RedisBackend(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported CACHE_BUS_URL: {url}")
+
+
+class InvalidationBus:
+    """
+    Fan change events ("product", "category", "user") out to the caches in
+    this process and, through the backend, to every other worker.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.origin = uuid.uuid4().hex
+        self._handlers = defaultdict(list)
+        self._started = False
+
+    def subscribe(self, kind: str, handler):
+        """Register handler(entity_id, data) for events of `kind`."""
+        self._handlers[kind].append(handler)
+
+    def publish(self, kind: str, entity_id=None, **data):
+        self._dispatch(kind, entity_id, data)
+        message = json.dumps({"origin": self.origin, "kind": kind, "id": entity_id, "data": data})
+        self.backend.publish(message.encode())
+
+    def _deliver(self, raw):
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            logger.warning("Dropping malformed invalidation message")
+            return
+        if message.get("origin") == self.origin:
+            return
+        self._dispatch(message.get("kind"), message.get("id"), message.get("data") or {})
+
+    def _dispatch(self, kind, entity_id, data):
+        for handler in self._handlers.get(kind, []):
+            try:
+                handler(entity_id, data)
+            except Exception as e:
+                logger.error(f"Invalidation handler for {kind} failed: {e}")
+
+    def start(self):
+        if not self._started:
+            self.backend.start(self._deliver)
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            self.backend.stop()
+            self._started = False
+
+    def use_backend(self, backend):
+        """Swap the transport (restarting it if the bus is running)."""
+        running = self._started
+        self.stop()
+        self.backend = backend
+        if running:
+            self.start()
+
+
+bus = InvalidationBus(backend_from_url(CACHE_BUS_URL))
@@ -0,0 +1,234 @@
+import os
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import update, select, insert, case
+from app.models import Product, Order, OrderItem, StockReservation, utcnow
+from app.services.invalidation import bus
+from app.services import analytics
+
+# How long an unpaid checkout keeps its stock
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", "900"))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "60"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+
+# Order statuses that make held stock permanent / give it back
+COMMIT_STATUSES = {"paid", "processing", "shipped", "delivered", "completed"}
+RELEASE_STATUSES = {"cancelled", "canceled", "failed", "expired", "refunded"}
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Insufficient stock for product(s): {', '.join(map(str, self.product_ids))}")
+
+
+class UnknownProducts(ValueError):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Unknown product(s): {', '.join(map(str, self.product_ids))}")
+
+
+def check_products(db, product_ids):
+    """
+    Raise UnknownProducts unless every id names a product. Run it before
+    flushing order items, whose product_id is a foreign key.
+    """
+    ids = {int(product_id) for product_id in product_ids if product_id is not None}
+    if not ids:
+        return
+    found = set(db.execute(select(Product.id).where(Product.id.in_(ids))).scalars())
+    if ids - found:
+        raise UnknownProducts(ids - found)
+
+
+def basket(pairs):
+    """{product_id: total quantity} from (product_id, quantity) pairs, skipping unknown products."""
+    quantities = defaultdict(int)
+    for product_id, quantity in pairs:
+        if product_id is None:
+            continue
+        if quantity is None or int(quantity) < 1:
+            raise ValueError("Quantities must be positive")
+        quantities[int(product_id)] += int(quantity)
+    return dict(quantities)
+
+
+def _locked_ids(db, ids):
+    # PostgreSQL: take the row locks in id order so two baskets sharing
+    # products can't deadlock each other
+    if db.get_bind().dialect.name == "postgresql":
+        return Product.id.in_(select(Product.id).where(Product.id.in_(ids)).order_by(Product.id).with_for_update())
+    return Product.id.in_(ids)
+
+
+def reserve(db, order_id, quantities: dict, ttl=RESERVATION_TTL):
+    """
+    Take every product in `quantities` out of stock with one conditional
+    UPDATE ... WHERE stock_quantity >= qty RETURNING, and record a
+    reservation per product. `ttl=None` commits the reservation straight
+    away (the order is already paid for).
+
+    All or nothing: if any product is short the caller's transaction is
+    rolled back and InsufficientStock raised. Runs inside the caller's
+    transaction otherwise; after committing, pass the return value to
+    notify_stock_changes().
+    """
+    if not quantities:
+        return []
+    qty = case(quantities, value=Product.id)
+    now = utcnow()
+    stmt = (
+        update(Product)
+        .where(_locked_ids(db, list(quantities)), Product.stock_quantity >= qty)
+        .values(
+            stock_quantity=Product.stock_quantity - qty,
+            # stock is part of the cached, ETagged product body
+            updated_at=now,
+        )
+        .returning(Product.id, Product.stock_quantity, Product.category_id, Product.name)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(stmt).all()
+    if len(rows) < len(quantities):
+        db.rollback()
+        raise InsufficientStock(set(quantities) - {row.id for row in rows})
+
+    expires_at = now + timedelta(seconds=ttl) if ttl is not None else None
+    db.execute(insert(StockReservation), [
+        {
+            "order_id": order_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "status": "held" if ttl is not None else "committed",
+            "expires_at": expires_at,
+            "created_at": now,
+        }
+        for product_id, quantity in quantities.items()
+    ])
+    return rows
+
+
+def commit_order(db, order_id) -> int:
+    """Make an order's held stock permanent (it was paid). Returns the rows committed."""
+    return commit_orders(db, [order_id])
+
+
+def commit_orders(db, order_ids) -> int:
+    """commit_order for many orders in one UPDATE."""
+    rows = db.execute(
+        update(StockReservation)
+        .where(StockReservation.order_id.in_(list(order_ids)), StockReservation.status == "held")
+        .values(status="committed")
+        .returning(StockReservation.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return len(rows)
+
+
+def release_order(db, order_id):
+    """
+    Put an order's stock back (cancelled, refunded...), whether it was
+    still held or already committed. Returns the products restocked.
+    """
+    changes, _ = _release(db, StockReservation.order_id == order_id, statuses=("held", "committed"))
+    return changes
+
+
+def restore_order(db, order_id):
+    """
+    Take an order's stock out again after it was released, e.g. a
+    cancelled order that is reinstated as paid. Reserves its line items,
+    committed; raises InsufficientStock if they are no longer in stock.
+    Returns the products whose stock changed.
+    """
+    active = db.query(StockReservation.id).filter(
+        StockReservation.order_id == order_id, StockReservation.status.in_(["held", "committed"])
+    ).first()
+    if active:
+        return []
+    items = db.query(OrderItem.product_id, OrderItem.quantity).filter(OrderItem.order_id == order_id)
+    return reserve(db, order_id, basket(items), ttl=None)
+
+
+def _release(db, condition, statuses=("held",)):
+    # flipping held/committed -> released with RETURNING means only the caller
+    # that actually flipped a row restocks it, even if the sweeper races a cancel
+    released = db.execute(
+        update(StockReservation)
+        .where(condition, StockReservation.status.in_(statuses))
+        .values(status="released")
+        .returning(StockReservation.order_id, StockReservation.product_id, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not released:
+        return [], set()
+    quantities = basket((row.product_id, row.quantity) for row in released)
+    return _restock(db, quantities), {row.order_id for row in released}
+
+
+def _restock(db, quantities: dict):
+    qty = case(quantities, value=Product.id)
+    return db.execute(
+        update(Product)
+        .where(_locked_ids(db, list(quantities)))
+        .values(stock_quantity=Product.stock_quantity + qty, updated_at=utcnow())
+        .returning(Product.id, Product.stock_quantity, Product.category_id, Product.name)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def release_expired(db, now=None, batch_size: int = RESERVATION_SWEEP_BATCH) -> int:
+    """
+    Release held reservations past their expiry, batch by batch, and mark
+    their still-pending orders expired. Returns the number of orders expired.
+    """
+    now = now or utcnow()
+    expired_orders = 0
+    while True:
+        batch = (
+            select(StockReservation.id)
+            .where(StockReservation.status == "held", StockReservation.expires_at < now)
+            .order_by(StockReservation.id)
+            .limit(batch_size)
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            # several workers may sweep at once; each takes different rows
+            batch = batch.with_for_update(skip_locked=True)
+        ids = db.execute(batch).scalars().all()
+        if not ids:
+            break
+        changes, order_ids = _release(db, StockReservation.id.in_(ids))
+        if order_ids:
+            orders = db.query(Order).filter(Order.id.in_(order_ids), Order.status == "pending").all()
+            for order in orders:
+                order.status = "expired"
+            analytics.record_status_changes(db, [(order, "pending") for order in orders])
+            expired_orders += len(orders)
+        db.commit()
+        notify_stock_changes(changes)
+        if len(ids) < batch_size:
+            break
+    return expired_orders
+
+
+def apply_status(db, order_id, status: str, old_status: str = None):
+    """
+    Commit or release an order's reservations to match a new order status,
+    re-reserving its stock if it comes back from a released status. Returns
+    products whose stock changed, for notify_stock_changes().
+    """
+    status = (status or "").lower()
+    if status in COMMIT_STATUSES:
+        if (old_status or "").lower() in RELEASE_STATUSES:
+            return restore_order(db, order_id)
+        commit_order(db, order_id)
+    elif status in RELEASE_STATUSES:
+        return release_order(db, order_id)
+    return []
+
+
+def notify_stock_changes(rows):
+    """Invalidate cached catalog entries for products whose stock changed."""
+    for row in rows:
+        bus.publish("product", row.id, category_ids=[row.category_id], name=row.name)
+
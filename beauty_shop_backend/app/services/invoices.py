@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from app.utils.invoice import generate_invoice_pdf, generate_invoice_pdfs, invoice_path
+from app.utils.email import send_invoice_email
+
+logger = logging.getLogger(__name__)
+
+# Processes rendering PDFs; 0 renders inline in the caller (tests, scripts)
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", "2"))
+# How long GET /api/orders/{id}/invoice waits for a render before giving up
+INVOICE_RENDER_TIMEOUT = float(os.getenv("INVOICE_RENDER_TIMEOUT", "30"))
+EMAIL_WORKERS = 2
+# invoices per worker task when rendering in bulk
+INVOICE_BATCH = 200
+
+
+def invoice_job(order) -> dict:
+    """Everything the renderer needs, as plain data that pickles into a worker process."""
+    return {
+        "invoice_number": order.invoice_number or order.public_id,
+        "amount": order.total_amount,
+        "email": order.customer_email,
+        "items": [
+            {"name": item.get("name"), "quantity": item.get("quantity", 1), "price": item.get("price", 0)}
+            for item in order.get_items()
+        ],
+        "date": order.created_at,
+    }
+
+
+class InvoiceRenderer:
+    """
+    Renders invoice PDFs in a small process pool, so ReportLab's CPU time
+    stays off request threads (and out of the GIL). Concurrent requests for
+    the same invoice share one render, and a finished invoice is served
+    from disk without rendering again.
+    """
+
+    def __init__(self, workers: int = INVOICE_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._emails = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            # spawn: forking a process that runs the bus and job threads can deadlock
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def submit(self, job: dict, then=None) -> Future:
+        """
+        Render `job` (see invoice_job) unless it's already on disk or being
+        rendered. `then(path)` runs once the PDF exists.
+        """
+        number = job["invoice_number"]
+        with self._lock:
+            future = self._pending.get(number)
+            if future is None:
+                path = invoice_path(number)
+                if os.path.exists(path):
+                    future = Future()
+                    future.set_result(path)
+                elif self.workers > 0:
+                    future = self._executor().submit(generate_invoice_pdf, **job)
+                    self._pending[number] = future
+                    future.add_done_callback(lambda f: self._forget(number))
+                else:
+                    future = Future()
+                    self._render_inline(future, job)
+        if then is not None:
+            future.add_done_callback(lambda f: self._chain(f, number, then))
+        return future
+
+    def _render_inline(self, future, job):
+        try:
+            future.set_result(generate_invoice_pdf(**job))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _forget(self, number):
+        with self._lock:
+            self._pending.pop(number, None)
+
+    def _chain(self, future, number, then):
+        if future.exception() is not None:
+            logger.error(f"Invoice {number} failed to render: {future.exception()}")
+            return
+        if self.workers > 0:
+            # done callbacks run on the pool's management thread; keep SMTP off it
+            with self._lock:
+                if self._emails is None:
+                    self._emails = ThreadPoolExecutor(EMAIL_WORKERS, thread_name_prefix="invoice-email")
+                emails = self._emails
+            emails.submit(self._run_then, then, number, future.result())
+        else:
+            self._run_then(then, number, future.result())
+
+    def _run_then(self, then, number, path):
+        try:
+            then(path)
+        except Exception as e:
+            logger.error(f"Invoice {number} follow-up failed: {e}")
+
+    def render(self, job: dict, timeout: float = INVOICE_RENDER_TIMEOUT) -> str:
+        """Path of the rendered invoice, waiting for it if need be."""
+        return self.submit(job).result(timeout=timeout)
+
+    def render_many(self, jobs: list, batch_size: int = INVOICE_BATCH) -> list:
+        """
+        Re-render many invoices (overwriting existing files), batch_size per
+        worker task so each process amortises its setup over many PDFs.
+        Returns the paths in the order of `jobs`.
+        """
+        batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+        if self.workers <= 0:
+            return [path for batch in batches for path in generate_invoice_pdfs(batch)]
+        futures = [self._executor().submit(generate_invoice_pdfs, batch) for batch in batches]
+        return [path for future in futures for path in future.result()]
+
+    def shutdown(self):
+        pool, self._pool = self._pool, None
+        emails, self._emails = self._emails, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        if emails is not None:
+            emails.shutdown(wait=True)
+
+
+invoice_renderer = InvoiceRenderer()
+
+
+def queue_invoice(order):
+    """Render an order's invoice in the background and email it when it's ready."""
+    job = invoice_job(order)
+    recipient, number = job["email"], job["invoice_number"]
+    return invoice_renderer.submit(
+        job, then=lambda path: send_invoice_email(recipient_email=recipient, invoice_no=number, pdf_path=path)
+    )
@@ -1,13 +1,18 @@
-import time
 import json
-from app.models import Order
+from sqlalchemy import func
+from app.models import Order, OrderItem
+from app.services import inventory, analytics
+from app.utils.ids import new_order_ids
 
 
 def create_order_record(db, payload):
     """Create and persist an Order from frontend-shaped payload.
-    Returns the Order ORM object.
+    Returns the Order ORM object. Raises inventory.InsufficientStock
+    (nothing is saved) if an item is out of stock, and
+    inventory.UnknownProducts (a ValueError) for ids that aren't products.
     """
-    public_id = f"ORD-{int(time.time() * 1000)}"
+    inventory.check_products(db, (it.id for it in payload.items))
+    public_id, invoice_number = new_order_ids()
 
     # Set status based on payment method
     status = 'Paid' if payload.paymentMethod == 'mpesa' else 'Processing'
@@ -16,7 +21,7 @@ def create_order_record(db, payload):
         public_id=public_id,
         total_amount=payload.total,
         status=status,
-        invoice_number=f"INV-{public_id[-8:]}"
+        invoice_number=invoice_number
     )
     # store customer json with payment info
     customer_data = payload.customer.dict()
@@ -38,10 +43,85 @@ def create_order_record(db, payload):
     new_order.set_items(items)
 
     db.add(new_order)
+    db.flush()
+    # the frontend has already taken payment (or it's pay on delivery), so
+    # the stock is committed rather than held
+    changes = inventory.reserve(db, new_order.id, inventory.basket((it.id, it.quantity) for it in payload.items), ttl=None)
+    analytics.record_order(db, new_order)
     db.commit()
+    inventory.notify_stock_changes(changes)
     db.refresh(new_order)
     return new_order
 
 
+def filter_orders(query, status=None, start=None, end=None, user_id=None):
+    """Admin listing filters; `status` may be comma-separated."""
+    if status:
+        query = query.filter(Order.status.in_([s.strip() for s in status.split(",") if s.strip()]))
+    if start is not None:
+        query = query.filter(Order.created_at >= start)
+    if end is not None:
+        query = query.filter(Order.created_at < end)
+    if user_id is not None:
+        query = query.filter(Order.user_id == user_id)
+    return query
+
+
 def fetch_order_by_public_id(db, public_id: str):
     return db.query(Order).filter(Order.public_id == public_id).first()
+
+
+# statuses whose orders count as sales
+SALE_STATUSES = sorted(inventory.COMMIT_STATUSES)
+
+
+def _sales(query, start=None, end=None):
+    # statuses are stored as typed by whoever set them ("Paid", "paid")
+    query = query.filter(func.lower(Order.status).in_(SALE_STATUSES))
+    if start is not None:
+        query = query.filter(Order.created_at >= start)
+    if end is not None:
+        query = query.filter(Order.created_at < end)
+    return query
+
+
+def _day(db, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("day", column)
+    return func.date(column)
+
+
+def revenue_summary(db, start=None, end=None, by_day: bool = False):
+    """Revenue, order count and average order value, aggregated in SQL."""
+    revenue, orders = _sales(
+        db.query(func.coalesce(func.sum(Order.total_amount), 0.0), func.count(Order.id)), start, end
+    ).one()
+    summary = {
+        "revenue": float(revenue),
+        "orders": orders,
+        "average_order_value": float(revenue) / orders if orders else 0.0,
+    }
+    if by_day:
+        day = _day(db, Order.created_at).label("day")
+        rows = _sales(
+            db.query(day, func.sum(Order.total_amount), func.count(Order.id)), start, end
+        ).group_by(day).order_by(day).all()
+        summary["by_day"] = [
+            {"day": str(row[0])[:10], "revenue": float(row[1] or 0), "orders": row[2]}
+            for row in rows
+        ]
+    return summary
+
+
+def top_sellers(db, limit: int = 10, start=None, end=None):
+    """Best-selling products by units sold."""
+    units = func.sum(OrderItem.quantity).label("units")
+    revenue = func.sum(OrderItem.unit_price * OrderItem.quantity).label("revenue")
+    rows = _sales(
+        db.query(OrderItem.product_id, OrderItem.name, units, revenue).join(Order, Order.id == OrderItem.order_id),
+        start, end
+    ).group_by(OrderItem.product_id, OrderItem.name).order_by(units.desc(), OrderItem.product_id).limit(limit).all()
+    return [
+        {"product_id": row.product_id, "name": row.name, "units": row.units, "revenue": float(row.revenue or 0)}
+        for row in rows
+    ]
@@ -0,0 +1,422 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update, or_, case
+from app.database import SessionLocal
+from app.models import Order
+from app.services import inventory, analytics
+from app.utils.mpesa import initiate_stk_push, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# STK pushes in flight at once; 0 sends them inline in the caller (tests, scripts)
+PAYMENT_CONCURRENCY = int(os.getenv("PAYMENT_CONCURRENCY", "8"))
+# Pushes waiting beyond this are failed straight away instead of queueing forever
+PAYMENT_QUEUE_LIMIT = int(os.getenv("PAYMENT_QUEUE_LIMIT", "1000"))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "4"))
+# Backoff before retry n is PAYMENT_RETRY_BASE * 2**n seconds (with jitter), capped
+PAYMENT_RETRY_BASE = float(os.getenv("PAYMENT_RETRY_BASE", "1"))
+PAYMENT_RETRY_MAX = float(os.getenv("PAYMENT_RETRY_MAX", "30"))
+# Consecutive failures that open the circuit, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv("PAYMENT_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.getenv("PAYMENT_BREAKER_RESET", "30"))
+
+UNAVAILABLE = {"errorCode": "503", "errorMessage": "M-Pesa is temporarily unavailable", "requestSent": False}
+UNCONFIRMED = "M-Pesa did not confirm the payment request; if a prompt arrives, completing it settles the order"
+# payment_status values a callback or reconciliation run must not touch again
+SETTLED = ["paid", "paid_no_stock"]
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider that keeps failing. After `threshold`
+    consecutive failures the circuit opens and calls are refused for
+    `reset_timeout` seconds; then one trial call is let through
+    (half-open), and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, reset_timeout: float = BREAKER_RESET, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._trial = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._opened_at is None or self._trial:
+                    logger.warning("M-Pesa circuit opened after repeated failures")
+                self._opened_at = self._clock()
+                self._trial = False
+
+
+def classify(result: dict) -> str:
+    """
+    "ok", "rejected" (retrying won't help), "retry" (the push provably never
+    left, so sending it again is safe) or "unconfirmed" (it may have reached
+    Safaricom: a timeout or error mid-request). An STK push isn't idempotent,
+    so unconfirmed pushes are never resent; the customer may already have
+    the prompt.
+    """
+    if str(result.get("ResponseCode")) == "0":
+        return "ok"
+    if "ResponseCode" in result or str(result.get("errorCode")) == "400":
+        return "rejected"
+    if result.get("requestSent") is False:
+        return "retry"
+    return "unconfirmed"
+
+
+def backoff(attempt: int) -> float:
+    return min(PAYMENT_RETRY_MAX, PAYMENT_RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class PaymentDispatcher:
+    """
+    Sends STK pushes from its own asyncio loop thread, PAYMENT_CONCURRENCY
+    at a time, so checkout returns as soon as the order is saved and a slow
+    Safaricom never ties up the API's request threads. Failed pushes are
+    retried with backoff behind a circuit breaker, but only when they never
+    reached Safaricom; the outcome lands on the order's payment_status for
+    the client to poll.
+    """
+
+    def __init__(self, session_factory=SessionLocal, concurrency: int = PAYMENT_CONCURRENCY, breaker: CircuitBreaker = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._semaphore = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None or self.concurrency <= 0:
+                return
+            self._loop = asyncio.new_event_loop()
+            # the blocking requests calls run here, not on the API's threadpool
+            self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="stk-push")
+            self._loop.set_default_executor(self._executor)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._thread = threading.Thread(target=self._loop.run_forever, name="payment dispatcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, order_id: int, phone: str, amount: int, invoice_no: str):
+        """Queue an STK push for order_id. Returns a concurrent.futures.Future, or None if it ran inline."""
+        if self.concurrency <= 0:
+            asyncio.run(self._dispatch(order_id, phone, amount, invoice_no))
+            return None
+        self.start()
+        with self._lock:
+            if self._pending >= PAYMENT_QUEUE_LIMIT:
+                full = True
+            else:
+                full = False
+                self._pending += 1
+        if full:
+            self._record(order_id, {"errorCode": "503", "errorMessage": "Too many payments in progress, please retry"})
+            return None
+        future = asyncio.run_coroutine_threadsafe(self._dispatch(order_id, phone, amount, invoice_no), self._loop)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Payment dispatch crashed: {future.exception()}")
+
+    async def _push(self, phone, amount, invoice_no):
+        loop = asyncio.get_running_loop()
+        call = lambda: initiate_stk_push(phone=phone, amount=amount, invoice_no=invoice_no)
+        if self._semaphore is None:
+            return await loop.run_in_executor(None, call)
+        # only the call itself takes a slot; pushes backing off don't block others
+        async with self._semaphore:
+            return await loop.run_in_executor(None, call)
+
+    async def _dispatch(self, order_id, phone, amount, invoice_no):
+        loop = asyncio.get_running_loop()
+        result = UNAVAILABLE
+        for attempt in range(PAYMENT_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(backoff(attempt - 1))
+            if not self.breaker.allow():
+                result = UNAVAILABLE
+                continue
+            result = await self._push(phone, amount, invoice_no)
+            outcome = classify(result)
+            if outcome == "retry":
+                self.breaker.record_failure()
+                logger.warning(f"STK push for order {order_id} failed (attempt {attempt + 1}): {result.get('errorMessage')}")
+                continue
+            if outcome == "unconfirmed":
+                self.breaker.record_failure()
+                logger.warning(f"STK push for order {order_id} unconfirmed, not resending: {result.get('errorMessage')}")
+                break
+            # Safaricom answered, even if it said no: the provider is up
+            self.breaker.record_success()
+            break
+        await loop.run_in_executor(None, self._record, order_id, result)
+        return result
+
+    def _record(self, order_id: int, result: dict):
+        """Save a push outcome on the order, unless something already moved it on."""
+        outcome = classify(result)
+        ok = outcome == "ok"
+        if ok:
+            values = {"payment_status": "requested", "payment_error": None}
+        elif outcome == "unconfirmed":
+            values = {"payment_status": "unconfirmed", "payment_error": UNCONFIRMED}
+        else:
+            values = {"payment_status": "failed",
+                      "payment_error": result.get("errorMessage") or result.get("ResponseDescription") or "STK push failed"}
+        db = self.session_factory()
+        try:
+            if ok:
+                db.execute(
+                    update(Order)
+                    .where(Order.id == order_id)
+                    .values(checkout_request_id=result.get("CheckoutRequestID"),
+                            merchant_request_id=result.get("MerchantRequestID"))
+                    .execution_options(synchronize_session=False)
+                )
+            db.execute(
+                update(Order)
+                .where(Order.id == order_id, Order.payment_status == "pending")
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Could not record payment result for order {order_id}: {e}")
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 5):
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+            self._semaphore = None
+        if loop is None:
+            return
+        # let pushes already on the wire finish, then stop the loop
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=timeout)
+        executor.shutdown(wait=False)
+        loop.close()
+
+
+payment_dispatcher = PaymentDispatcher()
+
+
+def parse_callback(payload: dict) -> dict:
+    """The fields we use from a Daraja STK callback body."""
+    callback = (payload or {}).get("Body", {}).get("stkCallback", {}) or {}
+    metadata = {
+        item.get("Name"): item.get("Value")
+        for item in (callback.get("CallbackMetadata") or {}).get("Item", [])
+    }
+    return {
+        "checkout_request_id": callback.get("CheckoutRequestID"),
+        "merchant_request_id": callback.get("MerchantRequestID"),
+        "result_code": callback.get("ResultCode"),
+        "result_desc": callback.get("ResultDesc"),
+        "receipt": metadata.get("MpesaReceiptNumber"),
+        "amount": metadata.get("Amount"),
+        "phone": metadata.get("PhoneNumber"),
+    }
+
+
+def find_order(db, checkout_request_id=None, merchant_request_id=None, phone=None, amount=None):
+    """
+    Order for a Daraja request, by the (uniquely indexed) CheckoutRequestID
+    first. A push that went unconfirmed has no ids stored, so a paid
+    callback for it is matched on the phone and amount it was sent for.
+    """
+    if checkout_request_id:
+        order = db.query(Order).filter(Order.checkout_request_id == checkout_request_id).first()
+        if order is not None:
+            return order
+    if merchant_request_id:
+        order = db.query(Order).filter(Order.merchant_request_id == merchant_request_id).first()
+        if order is not None:
+            return order
+    phone = normalize_phone(phone)
+    if phone and amount is not None:
+        # pushes are sent for int(total_amount)
+        return (
+            db.query(Order)
+            .filter(Order.payment_status == "unconfirmed", Order.mpesa_phone == phone,
+                    Order.total_amount >= float(amount), Order.total_amount < float(amount) + 1)
+            .order_by(Order.created_at.desc())
+            .first()
+        )
+    return None
+
+
+def mark_paid(db, order, receipt=None) -> bool:
+    """
+    Settle `order` as paid, commit its stock and update the rollups.
+    Idempotent: the conditional UPDATE only matches an order that isn't
+    paid yet, so of several deliveries of the same callback exactly one
+    returns True. Commits.
+    """
+    return bool(mark_paid_many(db, [order], {order.id: str(receipt)} if receipt else None))
+
+
+def mark_paid_many(db, orders, receipts: dict = None) -> set:
+    """
+    mark_paid for a batch of orders in one UPDATE, with optional
+    {order_id: receipt}. Orders whose stock was already released (an
+    expired hold) reserve it again, or are marked paid_no_stock if it has
+    sold out. Returns the set of ids of the orders this call flipped to paid.
+    Commits.
+    """
+    receipts = receipts or {}
+    old_statuses = {order.id: order.status for order in orders}
+    # e.g. expired by the reservation sweep before the callback came in
+    released = {
+        order.id: order.public_id for order in orders
+        if (old_statuses[order.id] or "").lower() in inventory.RELEASE_STATUSES
+    }
+    flipped = _flip_paid(db, [order_id for order_id in old_statuses if order_id not in released], receipts)
+    if flipped:
+        inventory.commit_orders(db, flipped)
+        paid = db.query(Order).filter(Order.id.in_(flipped)).populate_existing().all()
+        analytics.record_status_changes(db, [(order, old_statuses[order.id]) for order in paid])
+        db.commit()
+    else:
+        db.rollback()
+    for order_id, public_id in released.items():
+        if _settle_released(db, order_id, public_id, old_statuses[order_id], receipts.get(order_id)):
+            flipped.add(order_id)
+    return flipped
+
+
+def _flip_paid(db, order_ids, receipts: dict) -> set:
+    if not order_ids:
+        return set()
+    values = {"status": "paid", "payment_status": "paid", "payment_error": None}
+    if receipts:
+        values["transaction_id"] = case(receipts, value=Order.id, else_=Order.transaction_id)
+    return set(db.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids), or_(Order.payment_status.is_(None), Order.payment_status.notin_(SETTLED)))
+        .values(**values)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all())
+
+
+def _settle_released(db, order_id, public_id, old_status, receipt=None) -> bool:
+    """
+    Settle an order paid after its stock was released by taking the stock
+    out again. If it has sold out meanwhile the order keeps its status and
+    is marked paid_no_stock for someone to refund or restock by hand.
+    Each order commits on its own, since a short reserve rolls back.
+    """
+    if not _flip_paid(db, [order_id], {order_id: receipt} if receipt else {}):
+        db.rollback()
+        return False
+    try:
+        changes = inventory.restore_order(db, order_id)
+    except inventory.InsufficientStock as e:
+        # reserve() rolled the flip back; record the payment without the stock
+        values = {"payment_status": "paid_no_stock", "payment_error": f"Paid after the order was {old_status}; {e}"}
+        if receipt:
+            values["transaction_id"] = receipt
+        db.execute(
+            update(Order)
+            .where(Order.id == order_id, or_(Order.payment_status.is_(None), Order.payment_status.notin_(SETTLED)))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        logger.error(f"Order {public_id} was paid after it was {old_status} but its stock is gone; needs manual handling")
+        return False
+    order = db.query(Order).filter(Order.id == order_id).populate_existing().one()
+    analytics.record_status_changes(db, [(order, old_status)])
+    db.commit()
+    inventory.notify_stock_changes(changes)
+    return True
+
+
+def mark_failed(db, order, reason: str) -> bool:
+    """Record a declined/cancelled STK push, unless the order has been settled meanwhile. Commits."""
+    return bool(mark_failed_many(db, {order.id: reason}))
+
+
+def mark_failed_many(db, reasons: dict) -> set:
+    """mark_failed for {order_id: reason} in one UPDATE. Returns the set of ids of the orders marked. Commits."""
+    failed = set(db.execute(
+        update(Order)
+        .where(Order.id.in_(list(reasons)), Order.payment_status.in_(["pending", "requested"]))
+        .values(payment_status="failed", payment_error=case(reasons, value=Order.id))
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all())
+    db.commit()
+    return failed
+
+
+def handle_callback(db, payload: dict):
+    """
+    Apply a Daraja STK callback. Returns (order, callback) where order is
+    set only if this delivery is the one that marked it paid, so the
+    caller can follow up (receipt email) exactly once.
+    """
+    callback = parse_callback(payload)
+    logger.info(
+        f"M-Pesa callback {callback['checkout_request_id']}: "
+        f"{callback['result_code']} {callback['result_desc']} receipt={callback['receipt']}"
+    )
+    order = find_order(db, callback["checkout_request_id"], callback["merchant_request_id"],
+                       callback["phone"], callback["amount"])
+    if order is None:
+        # the push result may not be recorded yet; reconciliation picks these up
+        logger.warning(f"M-Pesa callback for unknown request {callback['checkout_request_id']}")
+        return None, callback
+    if str(callback["result_code"]) == "0":
+        return (order if mark_paid(db, order, callback["receipt"]) else None), callback
+    mark_failed(db, order, callback["result_desc"] or f"M-Pesa result {callback['result_code']}")
+    return None, callback
+
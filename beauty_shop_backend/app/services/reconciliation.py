@@ -0,0 +1,133 @@
+import os
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from app.models import Order, utcnow
+from app.services import payments
+from app.utils import mpesa
+from app.utils.pagination import keyset_filter, order_by_keys
+
+logger = logging.getLogger(__name__)
+
+# Ask Daraja about pushes still unsettled this many seconds after checkout
+RECONCILE_AFTER = float(os.getenv("RECONCILE_AFTER", "600"))
+# Daraja only answers status queries for recent pushes; older ones are left alone
+RECONCILE_MAX_AGE = float(os.getenv("RECONCILE_MAX_AGE", "172800"))
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "200"))
+# Status queries in flight at once, over mpesa's shared connection pool
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "4"))
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+
+# Pending orders can be expired by the reservation sweep before the
+# customer's payment is known, so both are looked at
+UNSETTLED_STATUSES = ["pending", "expired"]
+BATCH_KEYS = [(Order.created_at, False), (Order.id, False)]
+# Daraja's answers meaning the customer hasn't finished yet
+STILL_PROCESSING = {"500.001.1001", "4999"}
+
+
+def outcome(result: dict) -> str:
+    """"paid", "failed", "pending" (ask again later) or "error" for a status query result."""
+    if "ResultCode" in result:
+        code = str(result["ResultCode"])
+        if code == "0":
+            return "paid"
+        return "pending" if code in STILL_PROCESSING else "failed"
+    if str(result.get("errorCode")) in STILL_PROCESSING:
+        return "pending"
+    return "error"
+
+
+def stale_orders(db, now=None, older_than: float = RECONCILE_AFTER, max_age: float = RECONCILE_MAX_AGE,
+                 batch_size: int = RECONCILE_BATCH):
+    """
+    Yield lists of orders whose STK push went out but was never settled,
+    oldest first, batch_size at a time. Walks ix_orders_status_created_at
+    with a (created_at, id) keyset so each batch is an index range scan.
+    """
+    now = now or utcnow()
+    query = (
+        db.query(Order)
+        .filter(
+            Order.status.in_(UNSETTLED_STATUSES),
+            Order.created_at >= now - timedelta(seconds=max_age),
+            Order.created_at < now - timedelta(seconds=older_than),
+            Order.payment_status.in_(["pending", "requested"]),
+            Order.checkout_request_id.isnot(None),
+        )
+        .order_by(*order_by_keys(BATCH_KEYS))
+    )
+    last = None
+    while True:
+        page = query if last is None else query.filter(keyset_filter(BATCH_KEYS, last))
+        batch = page.limit(batch_size).all()
+        if not batch:
+            return
+        last = [batch[-1].created_at, batch[-1].id]
+        yield batch
+        if len(batch) < batch_size:
+            return
+
+
+def query_statuses(orders, concurrency: int = RECONCILE_CONCURRENCY) -> dict:
+    """{order_id: Daraja status query result}, concurrency queries at a time."""
+    if not orders:
+        return {}
+    ids = [order.checkout_request_id for order in orders]
+    with ThreadPoolExecutor(min(concurrency, len(orders)), thread_name_prefix="stk-query") as pool:
+        results = pool.map(mpesa.query_stk_status, ids)
+        return {order.id: result for order, result in zip(orders, results)}
+
+
+def reconcile(db, now=None, dry_run: bool = False, older_than: float = RECONCILE_AFTER,
+              max_age: float = RECONCILE_MAX_AGE, batch_size: int = RECONCILE_BATCH,
+              concurrency: int = RECONCILE_CONCURRENCY) -> dict:
+    """
+    Settle orders whose M-Pesa callback never arrived by asking Daraja
+    how each push ended. Paid orders are settled in one UPDATE per batch
+    (stock committed, rollups updated), declined/cancelled ones marked
+    failed in another; pushes still in progress are left for the next run.
+    With dry_run nothing is written and the report says what would change.
+
+    Returns {"checked", "paid", "failed", "pending", "errors"} where paid
+    and failed list the orders' public ids.
+    """
+    report = {"checked": 0, "paid": [], "failed": [], "pending": 0, "errors": 0}
+    for batch in stale_orders(db, now, older_than, max_age, batch_size):
+        if payments.payment_dispatcher.breaker.state == "open":
+            logger.warning("Payment reconciliation stopped: M-Pesa circuit is open")
+            break
+        results = query_statuses(batch, concurrency)
+        paid, failed = [], {}
+        for order in batch:
+            result = results[order.id]
+            status = outcome(result)
+            if status == "paid":
+                paid.append(order)
+            elif status == "failed":
+                failed[order.id] = result.get("ResultDesc") or f"M-Pesa result {result['ResultCode']}"
+            elif status == "pending":
+                report["pending"] += 1
+            else:
+                report["errors"] += 1
+                logger.warning(f"Status query for order {order.public_id} failed: {result.get('errorMessage')}")
+        report["checked"] += len(batch)
+
+        if dry_run:
+            report["paid"] += [order.public_id for order in paid]
+            report["failed"] += [order.public_id for order in batch if order.id in failed]
+            continue
+        public_ids = {order.id: order.public_id for order in batch}
+        if paid:
+            report["paid"] += [public_ids[order_id] for order_id in sorted(payments.mark_paid_many(db, paid))]
+        if failed:
+            report["failed"] += [public_ids[order_id] for order_id in sorted(payments.mark_failed_many(db, failed))]
+        # settled orders drop out of the query; don't keep them around either
+        db.expunge_all()
+    return report
+
+
+def reconcile_pending(db):
+    """PeriodicJob entry point: reconcile, and report only runs that found something."""
+    report = reconcile(db)
+    return report if report["checked"] else None
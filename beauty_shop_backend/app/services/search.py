@@ -0,0 +1,140 @@
+import re
+import logging
+import threading
+import weakref
+from sqlalchemy import event, func, literal, literal_column, or_, select, table, column, text
+from sqlalchemy.exc import OperationalError
+from app.models import Product
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL: products.search_vector is a generated tsvector column (see the
+# "add product search index" migration); it is deliberately not mapped on the
+# model so SQLite test databases can still be created with create_all().
+SEARCH_VECTOR = literal_column("products.search_vector")
+SEARCH_CONFIG = "english"
+
+# SQLite: external-content FTS5 table kept in sync with products by triggers
+_FTS_TABLE = table("products_fts", column("rowid"))
+_FTS_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, description, content='products', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# engine -> whether its FTS5 index is usable, so the check runs once per
+# engine instead of on every search
+_fts_ready = weakref.WeakKeyDictionary()
+_fts_lock = threading.Lock()
+
+
+def apply_search(db, query, term: str):
+    """
+    Restrict `query` (over Product) to rows matching `term`.
+
+    Returns (query, rank) where rank is a SQL expression, higher = better
+    match, usable in ORDER BY and in keyset cursors.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return _postgres_search(query, term)
+    if dialect == "sqlite":
+        fts_query = _fts5_query(term)
+        if fts_query and prepare_search(db):
+            return _sqlite_search(query, fts_query)
+    return _substring_search(query, term)
+
+
+def _postgres_search(query, term):
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, term)
+    # full-text hits on name/description (GIN on search_vector), plus
+    # substring/fuzzy hits on name for partial words and typos (GIN trigram)
+    query = query.filter(or_(
+        SEARCH_VECTOR.op("@@")(ts_query),
+        Product.name.ilike(f"%{term}%"),
+        Product.name.op("%")(term),
+    ))
+    rank = func.ts_rank(SEARCH_VECTOR, ts_query) + func.similarity(Product.name, term)
+    return query, rank
+
+
+def _sqlite_search(query, fts_query):
+    matches = (
+        select(_FTS_TABLE.c.rowid.label("id"), literal_column("bm25(products_fts)").label("score"))
+        .select_from(_FTS_TABLE)
+        .where(literal_column("products_fts").op("MATCH")(fts_query))
+        .subquery()
+    )
+    query = query.join(matches, Product.id == matches.c.id)
+    # bm25 is lower-is-better
+    return query, -matches.c.score
+
+
+def _substring_search(query, term):
+    query = query.filter(or_(Product.name.ilike(f"%{term}%"), Product.description.ilike(f"%{term}%")))
+    return query, literal(0.0)
+
+
+def _fts5_query(term: str):
+    # every word must match, each as a prefix so "fac" finds "Face"
+    words = _WORD.findall(term or "")
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def prepare_search(db) -> bool:
+    """
+    Make sure full-text search is set up for db's engine; call at startup.
+    Only SQLite needs work here. The answer is cached per engine.
+    """
+    engine = db.get_bind()
+    if engine.dialect.name != "sqlite":
+        return True
+    ready = _fts_ready.get(engine)
+    if ready is None:
+        with _fts_lock:
+            ready = _fts_ready.get(engine)
+            if ready is None:
+                ready = _fts_ready[engine] = _ensure_sqlite_fts(db)
+    return ready
+
+
+@event.listens_for(Product.__table__, "after_create")
+def _create_sqlite_fts(target, connection, **kw):
+    # a freshly created products table (create_all) gets its triggers too
+    if connection.dialect.name != "sqlite":
+        return
+    try:
+        for statement in _FTS_SETUP:
+            connection.execute(text(statement))
+    except OperationalError as e:
+        logger.warning(f"FTS5 unavailable, falling back to LIKE search: {e}")
+        _fts_ready[connection.engine] = False
+
+
+def _ensure_sqlite_fts(db) -> bool:
+    """Create the FTS5 index and its triggers if the products table lacks them."""
+    try:
+        exists = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'products_fts_ai'"
+        )).first()
+        if not exists:
+            for statement in _FTS_SETUP:
+                db.execute(text(statement))
+            db.commit()
+        return True
+    except OperationalError as e:
+        # SQLite built without FTS5
+        logger.warning(f"FTS5 unavailable, falling back to LIKE search: {e}")
+        db.rollback()
+        return False
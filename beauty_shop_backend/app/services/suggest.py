@@ -0,0 +1,114 @@
+import bisect
+import re
+import threading
+from app.models import Product, Category
+from app.services.invalidation import bus
+
+_WORD_START = re.compile(r"\b\w", re.UNICODE)
+
+
+class PrefixIndex:
+    """
+    Sorted array of (key, kind, id, label) searched with bisect. Every word
+    of a label is indexed as its own suffix ("vitamin c serum", "c serum",
+    "serum") so typing any word of a name finds it.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._labels = {}
+        self._lock = threading.Lock()
+        self.built = False
+
+    @staticmethod
+    def _keys(label: str):
+        text = label.lower()
+        return {text[m.start():] for m in _WORD_START.finditer(text)}
+
+    def build(self, db):
+        entries = []
+        labels = {}
+        sources = [
+            ("category", db.query(Category.id, Category.name)),
+            ("product", db.query(Product.id, Product.name)),
+        ]
+        for kind, rows in sources:
+            for row in rows:
+                if row.name:
+                    labels[(kind, row.id)] = row.name
+                    entries.extend((key, kind, row.id, row.name) for key in self._keys(row.name))
+        entries.sort()
+        with self._lock:
+            self._entries, self._labels = entries, labels
+            self.built = True
+
+    def ensure_built(self, db):
+        if not self.built:
+            self.build(db)
+
+    def add(self, kind: str, item_id: int, label: str):
+        with self._lock:
+            self._remove_locked(kind, item_id)
+            if not label:
+                return
+            self._labels[(kind, item_id)] = label
+            for key in self._keys(label):
+                bisect.insort(self._entries, (key, kind, item_id, label))
+
+    def remove(self, kind: str, item_id: int):
+        with self._lock:
+            self._remove_locked(kind, item_id)
+
+    def _remove_locked(self, kind, item_id):
+        label = self._labels.pop((kind, item_id), None)
+        if label is None:
+            return
+        for key in self._keys(label):
+            i = bisect.bisect_left(self._entries, (key, kind, item_id))
+            if i < len(self._entries) and self._entries[i][:3] == (key, kind, item_id):
+                del self._entries[i]
+
+    def suggest(self, prefix: str, limit: int = 8):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._entries, (prefix,))
+            while i < len(self._entries) and len(results) < limit:
+                key, kind, item_id, label = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                if (kind, item_id) not in seen:
+                    seen.add((kind, item_id))
+                    results.append({"type": kind, "id": item_id, "label": label})
+                i += 1
+        return results
+
+    def reset(self):
+        with self._lock:
+            self._entries, self._labels = [], {}
+            self.built = False
+
+
+suggest_index = PrefixIndex()
+
+
+def _on_product_changed(product_id, data):
+    # events carry the new name, or none when the product was deleted
+    if data.get("name"):
+        suggest_index.add("product", product_id, data["name"])
+    else:
+        suggest_index.remove("product", product_id)
+
+
+def _on_category_changed(category_id, data):
+    if data.get("name"):
+        suggest_index.add("category", category_id, data["name"])
+    else:
+        suggest_index.remove("category", category_id)
+
+
+bus.subscribe("product", _on_product_changed)
+bus.subscribe("category", _on_category_changed)
@@ -1,18 +1,14 @@
-import smtplib
 import os
 from email.message import EmailMessage
-from dotenv import load_dotenv
 import logging
-
-# Load .env to get your Gmail credentials
-load_dotenv()
+from app.utils import smtp
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
 def send_invoice_email(recipient_email: str, invoice_no: str, pdf_path: str):
     """
-    Send invoice email with PDF attachment.
+    Queue the invoice email with its PDF attached.
     
     Args:
         recipient_email: Recipient's email address
@@ -20,7 +16,7 @@ def send_invoice_email(recipient_email: str, invoice_no: str, pdf_path: str):
         pdf_path: Path to the PDF invoice file
         
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if the email was queued, False otherwise
     """
     # Validate inputs
     if not recipient_email:
@@ -31,21 +27,9 @@ def send_invoice_email(recipient_email: str, invoice_no: str, pdf_path: str):
         logger.error(f"PDF file not found at: {pdf_path}")
         return False
     
-    # Get email configuration from environment
-    mail_from = os.getenv("MAIL_FROM")
-    mail_server = os.getenv("MAIL_SERVER")
-    mail_port = os.getenv("MAIL_PORT")
-    mail_username = os.getenv("MAIL_USERNAME")
-    mail_password = os.getenv("MAIL_PASSWORD")
-    
-    # Validate email configuration
-    if not all([mail_from, mail_server, mail_port, mail_username, mail_password]):
-        logger.error("Email configuration is incomplete. Please check environment variables.")
-        return False
-    
     msg = EmailMessage()
     msg['Subject'] = f"Your Beauty Shop Invoice - {invoice_no}"
-    msg['From'] = mail_from
+    msg['From'] = smtp.MAIL_FROM
     msg['To'] = recipient_email
     
     # Simple HTML Body
@@ -74,35 +58,48 @@ def send_invoice_email(recipient_email: str, invoice_no: str, pdf_path: str):
                 filename=f"Invoice_{invoice_no}.pdf"
             )
 
-        # Login and Send
-        with smtplib.SMTP(mail_server, int(mail_port)) as smtp:
-            smtp.starttls()
-            smtp.login(mail_username, mail_password)
-            smtp.send_message(msg)
-            
-        logger.info(f"Successfully sent email to {recipient_email}")
-        return True
-        
-    except smtplib.SMTPAuthenticationError as e:
-        logger.error(f"SMTP Authentication failed: {e}")
-        logger.error("Please check MAIL_USERNAME and MAIL_PASSWORD in .env file")
-        return False
-        
-    except smtplib.SMTPException as e:
-        logger.error(f"SMTP error occurred: {e}")
-        return False
-        
     except FileNotFoundError as e:
         logger.error(f"PDF file not found: {e}")
         return False
-        
-    except TypeError as e:
-        if 'usedforsecurity' in str(e):
-            logger.warning(f"Email sending skipped due to Python version compatibility issue: {e}")
-        else:
-            logger.error(f"Type error in email sending: {e}")
+
+    return _deliver(msg, recipient_email)
+
+
+def send_payment_receipt_email(recipient_email: str, invoice_no: str, receipt: str, amount: float):
+    """
+    Confirm a completed M-Pesa payment.
+    
+    Returns:
+        bool: True if the email was queued, False otherwise
+    """
+    if not recipient_email:
+        logger.error("Recipient email is None or empty")
         return False
-        
-    except Exception as e:
-        logger.error(f"Unexpected error sending email: {e}")
-        return False
\ No newline at end of file
+
+    msg = EmailMessage()
+    msg['Subject'] = f"Payment received - {invoice_no}"
+    msg['From'] = smtp.MAIL_FROM
+    msg['To'] = recipient_email
+
+    html_content = f"""
+    <html>
+        <body>
+            <h2 style="color: #d63384;">Payment received</h2>
+            <p>We have received your M-Pesa payment of <strong>KES {amount:,.2f}</strong> for invoice <strong>{invoice_no}</strong>.</p>
+            <p>M-Pesa receipt: <strong>{receipt or '-'}</strong></p>
+            <br>
+            <p>Best Regards,<br><strong>Beauty Shop Team</strong></p>
+        </body>
+    </html>
+    """
+    msg.set_content(f"Payment of KES {amount:,.2f} received for invoice {invoice_no}. M-Pesa receipt: {receipt or '-'}")
+    msg.add_alternative(html_content, subtype='html')
+    return _deliver(msg, recipient_email)
+
+
+def _deliver(msg: EmailMessage, recipient_email: str):
+    """Hand `msg` to the outbound mail queue. Returns True once it is queued."""
+    if not smtp.configured():
+        logger.error("Email configuration is incomplete. Please check environment variables.")
+        return False
+    return smtp.mail_queue.send(msg)
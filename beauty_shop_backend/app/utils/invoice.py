@@ -4,33 +4,45 @@ from reportlab.lib import colors
 from datetime import datetime
 import os
 
-def generate_invoice_pdf(invoice_number: str, amount: float, email: str, items: list):
-    os.makedirs("invoices", exist_ok=True)
-    
-    file_name = f"invoice_{invoice_number}.pdf"
-    file_path = os.path.join("invoices", file_name)
-    
-    c = canvas.Canvas(file_path, pagesize=letter)
-    width, height = letter
-    brand_color = colors.HexColor("#d63384") 
+# Where rendered invoices are kept; GET /api/orders/{id}/invoice serves them from here
+INVOICE_DIR = os.getenv("INVOICE_DIR", "invoices")
+
+WIDTH, HEIGHT = letter
+BRAND_COLOR = colors.HexColor("#d63384")
+TOTAL_BOX_COLOR = colors.HexColor("#fdf2f8")
+# name of the form XObject holding everything that is the same on every invoice
+CHROME_FORM = "invoice_chrome"
+
+
+def invoice_path(invoice_number: str) -> str:
+    return os.path.join(INVOICE_DIR, f"invoice_{invoice_number}.pdf")
+
+
+def _define_chrome(c):
+    """
+    Draw the static page chrome (header bar, labels, table header, footer)
+    into a form XObject, once per document. Each invoice page then places
+    it with a single doForm() instead of redrawing it.
+    """
+    if getattr(c, "_invoice_chrome", False):
+        return
+    width, height = WIDTH, HEIGHT
+    c.beginForm(CHROME_FORM)
 
     # Header Bar
-    c.setFillColor(brand_color)
+    c.setFillColor(BRAND_COLOR)
     c.rect(0, height - 80, width, 80, fill=True, stroke=False)
     c.setFillColor(colors.white)
     c.setFont("Helvetica-Bold", 24)
     c.drawString(50, height - 50, "BEAUTY SHOP LTD")
-    
+
     # Body Info
     c.setFillColor(colors.black)
     c.setFont("Helvetica-Bold", 12)
     c.drawString(50, height - 120, "BILL TO:")
-    c.setFont("Helvetica", 11)
-    c.drawString(50, height - 135, f"{email}")
-    c.drawRightString(width - 50, height - 120, datetime.now().strftime('%Y-%m-%d'))
 
     # Table Header
-    c.setStrokeColor(brand_color)
+    c.setStrokeColor(BRAND_COLOR)
     c.line(50, height - 160, width - 50, height - 160)
     c.setFont("Helvetica-Bold", 11)
     c.drawString(60, height - 180, "Item Description")
@@ -38,15 +50,38 @@ def generate_invoice_pdf(invoice_number: str, amount: float, email: str, items:
     c.drawRightString(width - 60, height - 180, "Subtotal (KES)")
     c.line(50, height - 190, width - 50, height - 190)
 
-    # DYNAMIC ITEMS LOOP
+    # Footer
+    footer_y = 30
+    c.setFillColor(BRAND_COLOR)
+    c.setFont("Helvetica", 9)
+    c.drawString(50, footer_y + 10, "Thank you for shopping with Beauty Shop Ltd!")
+    c.drawString(50, footer_y - 5, "If you have any questions, please contact muiathomas.mt@gmail.com")
+
+    c.endForm()
+    c._invoice_chrome = True
+
+
+def _draw_invoice(c, amount: float, email: str, items: list, date: datetime = None):
+    """Draw one invoice onto `c`, starting on the current page and ending with showPage()."""
+    _define_chrome(c)
+    width, height = WIDTH, HEIGHT
+    c.doForm(CHROME_FORM)
+
+    # Body Info
+    c.setFillColor(colors.black)
     c.setFont("Helvetica", 11)
+    c.drawString(50, height - 135, f"{email}")
+    c.drawRightString(width - 50, height - 120, (date or datetime.now()).strftime('%Y-%m-%d'))
+
+    # DYNAMIC ITEMS LOOP
     y_position = height - 215
-    
+
     for item in items:
         if y_position < 100: # Simple page break check
             c.showPage()
+            c.setFont("Helvetica", 11)
             y_position = height - 50
-            
+
         c.drawString(60, y_position, f"{item['name']}")
         c.drawCentredString(width - 180, y_position, f"{item['quantity']}")
         subtotal = item['price'] * item['quantity']
@@ -55,19 +90,46 @@ def generate_invoice_pdf(invoice_number: str, amount: float, email: str, items:
 
     # Grand Total Box
     total_y = y_position - 40
-    c.setFillColor(colors.HexColor("#fdf2f8"))
+    c.setFillColor(TOTAL_BOX_COLOR)
     c.rect(width - 250, total_y - 15, 200, 40, fill=True, stroke=False)
-    c.setFillColor(brand_color)
+    c.setFillColor(BRAND_COLOR)
     c.setFont("Helvetica-Bold", 12)
     c.drawString(width - 240, total_y, "GRAND TOTAL")
     c.drawRightString(width - 60, total_y, f"KES {amount:,.2f}")
 
-    # Footer
-    footer_y = 30
-    c.setFillColor(brand_color)
-    c.setFont("Helvetica", 9)
-    c.drawString(50, footer_y + 10, "Thank you for shopping with Beauty Shop Ltd!")
-    c.drawString(50, footer_y - 5, "If you have any questions, please contact muiathomas.mt@gmail.com")
+    c.showPage()
+
+
+def generate_invoice_pdf(invoice_number: str, amount: float, email: str, items: list, date: datetime = None):
+    os.makedirs(INVOICE_DIR, exist_ok=True)
+
+    file_path = invoice_path(invoice_number)
+    # render to a temporary name and rename, so a reader never sees half a file
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+
+    c = canvas.Canvas(tmp_path, pagesize=letter)
+    _draw_invoice(c, amount, email, items, date)
+    c.save()
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def generate_invoice_pdfs(jobs: list, combined_path: str = None):
+    """
+    Render many invoices in one call, e.g. the month-end reprint. `jobs`
+    are dicts of generate_invoice_pdf's arguments. By default each invoice
+    is written to its own file and the paths are returned in order; with
+    `combined_path` they all go into that one PDF, one after another,
+    sharing a single copy of the page chrome.
+    """
+    if combined_path is None:
+        return [generate_invoice_pdf(**job) for job in jobs]
 
+    os.makedirs(os.path.dirname(combined_path) or ".", exist_ok=True)
+    tmp_path = f"{combined_path}.{os.getpid()}.tmp"
+    c = canvas.Canvas(tmp_path, pagesize=letter)
+    for job in jobs:
+        _draw_invoice(c, job["amount"], job["email"], job["items"], job.get("date"))
     c.save()
-    return file_path
\ No newline at end of file
+    os.replace(tmp_path, combined_path)
+    return [combined_path]
\ No newline at end of file
@@ -1,5 +1,9 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import base64
+import threading
+import time
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -17,13 +21,69 @@ CONSUMER_SECRET = os.getenv("MPESA_CONSUMER_SECRET")
 BUSINESS_SHORTCODE = os.getenv("MPESA_SHORTCODE")
 PASSKEY = os.getenv("MPESA_PASSKEY")
 CALLBACK_URL = os.getenv("MPESA_CALLBACK_URL")
+# Daraja host; point it at a local stand-in for tests
+MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke").rstrip("/")
+# Refresh the cached token this many seconds before Safaricom expires it
+TOKEN_REFRESH_MARGIN = float(os.getenv("MPESA_TOKEN_REFRESH_MARGIN", "60"))
+MPESA_POOL_SIZE = int(os.getenv("MPESA_POOL_SIZE", "10"))
 
-def get_access_token():
+
+def _new_session():
+    """Keep-alive connections to Daraja, shared by the token and STK push calls."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MPESA_POOL_SIZE)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+session = _new_session()
+
+
+class TokenManager:
+    """
+    Caches the OAuth token (valid about an hour) and fetches a new one
+    TOKEN_REFRESH_MARGIN seconds before it runs out. Only one thread
+    fetches at a time; the others wait and reuse its token.
+    """
+
+    def __init__(self, fetch, clock=time.monotonic):
+        self._fetch = fetch
+        self._clock = clock
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        return self._token is not None and self._clock() < self._expires_at - TOKEN_REFRESH_MARGIN
+
+    def get(self):
+        """(access_token, error_dict), like get_access_token"""
+        if self._fresh():
+            return self._token, None
+        with self._lock:
+            if self._fresh():
+                return self._token, None
+            started = self._clock()
+            token, expires_in, error = self._fetch()
+            if error:
+                return None, error
+            self._token, self._expires_at = token, started + expires_in
+            return token, None
+
+    def invalidate(self, token=None):
+        """Drop the cached token (only if it is still `token`, when given), e.g. after a 401."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token, self._expires_at = None, 0.0
+
+
+def _fetch_access_token():
     """
-    Get M-Pesa access token for API authentication.
+    Ask Daraja for a new access token.
     
     Returns:
-        tuple: (access_token, error_dict) - One will be None if there's an error
+        tuple: (access_token, expires_in_seconds, error_dict) - token is None if there's an error
     """
     # Validate credentials
     if not all([CONSUMER_KEY, CONSUMER_SECRET]):
@@ -32,39 +92,112 @@ def get_access_token():
             "errorMessage": "M-Pesa credentials not configured. Check MPESA_CONSUMER_KEY and MPESA_CONSUMER_SECRET in .env"
         }
         logger.error(error["errorMessage"])
-        return None, error
+        return None, 0, error
     
-    url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    url = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
     
     try:
-        response = requests.get(url, auth=(CONSUMER_KEY, CONSUMER_SECRET), timeout=10)
+        response = session.get(url, auth=(CONSUMER_KEY, CONSUMER_SECRET), timeout=10)
         response.raise_for_status()
         
-        access_token = response.json().get("access_token")
+        data = response.json()
+        access_token = data.get("access_token")
         if not access_token:
             error = {"errorCode": "500", "errorMessage": "No access token in M-Pesa response"}
             logger.error(error["errorMessage"])
-            return None, error
+            return None, 0, error
             
         logger.info("Successfully obtained M-Pesa access token")
-        return access_token, None
+        return access_token, float(data.get("expires_in") or 3599), None
         
     except requests.exceptions.Timeout:
         error = {"errorCode": "504", "errorMessage": "M-Pesa authentication request timed out"}
         logger.error(error["errorMessage"])
-        return None, error
+        return None, 0, error
     except requests.exceptions.ConnectionError as e:
         error = {"errorCode": "500", "errorMessage": f"Cannot connect to M-Pesa service: {str(e)}"}
         logger.error(error["errorMessage"])
-        return None, error
+        return None, 0, error
     except requests.exceptions.HTTPError as e:
         error = {"errorCode": "500", "errorMessage": f"M-Pesa authentication failed: {str(e)}"}
         logger.error(error["errorMessage"])
-        return None, error
+        return None, 0, error
     except Exception as e:
         error = {"errorCode": "500", "errorMessage": f"Unexpected error getting M-Pesa token: {str(e)}"}
         logger.error(error["errorMessage"])
-        return None, error
+        return None, 0, error
+
+
+token_manager = TokenManager(_fetch_access_token)
+
+
+def get_access_token():
+    """
+    Get M-Pesa access token for API authentication, from the cache while it
+    is still valid.
+    
+    Returns:
+        tuple: (access_token, error_dict) - One will be None if there's an error
+    """
+    return token_manager.get()
+
+def _post(path: str, payload: dict, access_token: str):
+    return session.post(
+        f"{MPESA_BASE_URL}{path}",
+        json=payload,
+        headers={"Authorization": f"Bearer {access_token}"},
+        timeout=30
+    )
+
+
+def _post_authorized(path: str, payload: dict):
+    """
+    POST to Daraja with the cached token. Returns (response, error_dict).
+    """
+    access_token, token_error = get_access_token()
+    if token_error:
+        return None, token_error
+    response = _post(path, payload, access_token)
+    if response.status_code == 401:
+        # token revoked or expired early: drop it and retry once with a new one
+        token_manager.invalidate(access_token)
+        access_token, token_error = get_access_token()
+        if token_error:
+            return None, token_error
+        response = _post(path, payload, access_token)
+    return response, None
+
+
+def _never_sent(error) -> bool:
+    """
+    True if a requests error shows the request never reached Daraja
+    (refused, or timed out connecting), so sending it again can't cause a
+    second payment prompt.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = error.args[0] if error.args else None
+        # requests wraps urllib3's MaxRetryError, which wraps the cause
+        return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+    return False
+
+
+def normalize_phone(phone):
+    """254XXXXXXXXX form of a 07.../+254... number, or None if it isn't one."""
+    if not phone:
+        return None
+    clean_phone = str(phone).strip().replace("+", "")
+    if clean_phone.startswith("0"):
+        clean_phone = "254" + clean_phone[1:]
+    if not clean_phone.startswith("254") or len(clean_phone) != 12:
+        return None
+    return clean_phone
+
+
+def _password(timestamp: str) -> str:
+    password_str = BUSINESS_SHORTCODE + PASSKEY + timestamp
+    return base64.b64encode(password_str.encode()).decode('utf-8')
 
 def initiate_stk_push(phone: str, amount: int, invoice_no: str):
     """
@@ -76,7 +209,8 @@ def initiate_stk_push(phone: str, amount: int, invoice_no: str):
         invoice_no: Invoice/order reference number
         
     Returns:
-        dict: Response from M-Pesa API
+        dict: Response from M-Pesa API. Errors carry "requestSent": False
+        when the push provably never reached Safaricom and can be retried.
     """
     # Validate required configuration
     if not all([BUSINESS_SHORTCODE, PASSKEY, CALLBACK_URL]):
@@ -88,27 +222,21 @@ def initiate_stk_push(phone: str, amount: int, invoice_no: str):
         logger.error(error_msg)
         return {
             "errorCode": "500",
-            "errorMessage": error_msg
+            "errorMessage": error_msg,
+            "requestSent": False
         }
     
-    # 1. Get Access Token
-    access_token, token_error = get_access_token()
-    if token_error:
-        return token_error
-    
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     
-    # 2. Format Phone Number (Handle None, 07..., +254...)
+    # 1. Format Phone Number (Handle None, 07..., +254...)
     if not phone:
         logger.error("Phone number is None or empty")
         return {"errorCode": "400", "errorMessage": "PhoneNumber is None"}
         
-    clean_phone = str(phone).strip().replace("+", "")
-    if clean_phone.startswith("0"):
-        clean_phone = "254" + clean_phone[1:]
+    clean_phone = normalize_phone(phone)
     
     # Validate phone number format
-    if not clean_phone.startswith("254") or len(clean_phone) != 12:
+    if clean_phone is None:
         logger.error(f"Invalid phone number format: {phone}")
         return {
             "errorCode": "400",
@@ -117,15 +245,9 @@ def initiate_stk_push(phone: str, amount: int, invoice_no: str):
     
     logger.info(f"Initiating STK push for phone: {clean_phone}, amount: {amount}, invoice: {invoice_no}")
     
-    # 3. Security Credentials
-    password_str = BUSINESS_SHORTCODE + PASSKEY + timestamp
-    password = base64.b64encode(password_str.encode()).decode('utf-8')
-    
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
     payload = {
         "BusinessShortCode": BUSINESS_SHORTCODE,
-        "Password": password,
+        "Password": _password(timestamp),
         "Timestamp": timestamp,
         "TransactionType": "CustomerPayBillOnline",
         "Amount": int(amount),
@@ -138,33 +260,83 @@ def initiate_stk_push(phone: str, amount: int, invoice_no: str):
     }
 
     try:
-        response = requests.post(
-            "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        # 2. Send it, authenticated with the cached token
+        response, token_error = _post_authorized("/mpesa/stkpush/v1/processrequest", payload)
+        if token_error:
+            # no token, so the push itself was never sent
+            return {**token_error, "requestSent": False}
         response.raise_for_status()
         
         result = response.json()
         logger.info(f"STK Push response: {result}")
         return result
         
-    except requests.exceptions.Timeout:
+    except requests.exceptions.Timeout as e:
         logger.error("M-Pesa API request timed out")
         return {
             "errorCode": "504",
-            "errorMessage": "Request timed out. Please try again."
+            "errorMessage": "Request timed out. Please try again.",
+            "requestSent": not _never_sent(e)
         }
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error during STK push: {e}")
         return {
             "errorCode": "500",
-            "errorMessage": f"Network error: {str(e)}"
+            "errorMessage": f"Network error: {str(e)}",
+            "requestSent": not _never_sent(e)
         }
     except Exception as e:
         logger.error(f"Unexpected error during STK push: {e}")
         return {
             "errorCode": "500",
             "errorMessage": f"Unexpected error: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+
+def query_stk_status(checkout_request_id: str):
+    """
+    Ask Daraja how an STK push ended (the STK Push Query API), for pushes
+    whose callback never arrived.
+    
+    Args:
+        checkout_request_id: CheckoutRequestID returned by initiate_stk_push
+        
+    Returns:
+        dict: Daraja's answer - ResultCode/ResultDesc once the customer has
+        acted, errorCode/errorMessage while it is still processing or if
+        the request failed
+    """
+    if not all([BUSINESS_SHORTCODE, PASSKEY]):
+        return {"errorCode": "500", "errorMessage": "M-Pesa configuration incomplete"}
+    
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    payload = {
+        "BusinessShortCode": BUSINESS_SHORTCODE,
+        "Password": _password(timestamp),
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    
+    try:
+        response, token_error = _post_authorized("/mpesa/stkpushquery/v1/query", payload)
+        if token_error:
+            return token_error
+        if response.status_code >= 500:
+            # Daraja reports "still processing" as a 500 with an errorCode body
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            if body.get("errorCode"):
+                return body
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.Timeout:
+        logger.error(f"M-Pesa status query for {checkout_request_id} timed out")
+        return {"errorCode": "504", "errorMessage": "Request timed out. Please try again."}
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Network error during STK status query: {e}")
+        return {"errorCode": "500", "errorMessage": f"Network error: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Unexpected error during STK status query: {e}")
+        return {"errorCode": "500", "errorMessage": f"Unexpected error: {str(e)}"}
@@ -0,0 +1,48 @@
+import base64
+import json
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values: list) -> str:
+    """Pack the sort key of the last row on a page into an opaque token."""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    """Reverse of encode_cursor. Raises ValueError for tampered/garbled tokens."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_filter(keys: list, values: list):
+    """
+    Build the WHERE clause that seeks past `values` for an ORDER BY over `keys`.
+
+    Args:
+        keys: list of (column_expression, descending) pairs, in ORDER BY order
+        values: sort key of the last row already returned
+
+    Returns:
+        SQLAlchemy boolean expression, e.g. for (price ASC, id ASC):
+        price > :p OR (price = :p AND id > :id)
+    """
+    if len(keys) != len(values):
+        raise ValueError("Cursor does not match the requested sort")
+
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal_prefix = [keys[j][0] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def order_by_keys(keys: list) -> list:
+    return [column.desc() if descending else column.asc() for column, descending in keys]
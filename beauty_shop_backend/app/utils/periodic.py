@@ -0,0 +1,47 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """
+    Background thread calling job(db) every `interval` seconds with a fresh
+    session. An interval of 0 disables it.
+    """
+
+    def __init__(self, name: str, job, session_factory, interval: float):
+        self.name = name
+        self.job = job
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        db = self.session_factory()
+        try:
+            result = self.job(db)
+            if result:
+                logger.info(f"{self.name}: {result}")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"{self.name} failed: {e}")
+        finally:
+            db.close()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
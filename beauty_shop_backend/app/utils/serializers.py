@@ -0,0 +1,125 @@
+import json
+from datetime import date, datetime
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data) -> bytes:
+    """Encode plain dicts/lists/datetimes straight to JSON bytes."""
+    if orjson is not None:
+        # OPT_UTC_Z matches the "...Z" Pydantic emits for UTC datetimes
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """App-wide default response class: orjson when available."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(body, status_code: int = 200, headers: dict = None) -> Response:
+    """
+    Response for data the route built itself (or bytes it already encoded).
+    Returning a Response skips response_model validation, so list endpoints
+    don't pay a second full pass over every row.
+    """
+    if not isinstance(body, (bytes, bytearray)):
+        body = dumps(body)
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+# Response field -> Product column it is read from. Order here is the order
+# fields appear in the response.
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'price': 'price',
+    'category_id': 'category_id',
+    'category': 'category_id',
+    'stock_quantity': 'stock_quantity',
+    'stock': 'stock_quantity',
+    'image': 'image',
+    'rating': 'rating',
+    'is_new': 'is_new',
+    'isNew': 'is_new',
+}
+
+
+def product_to_dict(p, category_name: str, fields=None) -> dict:
+    fields = fields or PRODUCT_FIELDS
+    product_dict = {}
+    for field in fields:
+        if field == 'category':
+            product_dict[field] = category_name
+        else:
+            product_dict[field] = getattr(p, PRODUCT_FIELDS[field])
+    return product_dict
+
+
+def cart_line_to_dict(line, user_id: int) -> dict:
+    """A row from cart_service.load_cart: the CartItem columns plus its product."""
+    return {
+        "id": line.id,
+        "user_id": user_id,
+        "product_id": line.product_id,
+        "quantity": line.quantity,
+        "product": {
+            "id": line.product_id,
+            "name": line.name,
+            "price": line.price,
+            "stock_quantity": line.stock_quantity,
+            "image": line.image,
+        },
+        "subtotal": (line.price or 0) * line.quantity,
+    }
+
+
+def order_summary_to_dict(order) -> dict:
+    """Row shape of the order list endpoints."""
+    return {
+        "id": order.public_id or order.id,
+        "invoice_number": order.invoice_number or f"ORD-{order.id}",
+        "total_amount": order.total_amount,
+        "status": order.status,
+        "created_at": order.created_at,
+        # the admin frontend still JSON.parse()s these two
+        "customer_json": dumps(order.get_customer()).decode(),
+        "items_json": dumps(order.get_items()).decode()
+    }
+
+
+def order_to_dict(order) -> dict:
+    """Frontend-shaped order (OrderDetailResponse)."""
+    return {
+        "id": order.public_id,
+        "createdAt": order.created_at,
+        "customer": order.get_customer(),
+        "items": order.get_items(),
+        "total": order.total_amount,
+        "status": order.status
+    }
+
+
+def review_to_dict(review) -> dict:
+    return {
+        "id": review.id,
+        "product_id": review.product_id,
+        "user_name": review.user_name,
+        "rating": review.rating,
+        "comment": review.comment,
+        "created_at": review.created_at,
+    }
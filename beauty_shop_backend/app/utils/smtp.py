@@ -0,0 +1,357 @@
+import os
+import time
+import queue
+import random
+import smtplib
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# SMTP settings, read once at import
+MAIL_FROM = os.getenv("MAIL_FROM")
+MAIL_SERVER = os.getenv("MAIL_SERVER")
+MAIL_PORT = int(os.getenv("MAIL_PORT") or "587")
+MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "true").lower() not in ("0", "false", "no")
+MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", "30"))
+# Open connections kept to the server; also the number of sending threads.
+# 0 sends inline in the caller (tests, scripts)
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "2"))
+# Idle connections older than this are replaced rather than reused
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", "60"))
+# Messages a worker sends over one connection before handing it back
+MAIL_BATCH = int(os.getenv("MAIL_BATCH", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+# Backoff before retry n is MAIL_RETRY_BASE * 2**n seconds (with jitter), capped
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "2"))
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "120"))
+# Messages per second (and burst) per SMTP host, e.g. "smtp.gmail.com=1:10,smtp.sendgrid.net=20"
+MAIL_RATE = float(os.getenv("MAIL_RATE", "2"))
+MAIL_BURST = int(os.getenv("MAIL_BURST", "5"))
+MAIL_RATE_LIMITS = os.getenv("MAIL_RATE_LIMITS", "")
+
+
+def configured() -> bool:
+    return all([MAIL_FROM, MAIL_SERVER, MAIL_USERNAME, MAIL_PASSWORD])
+
+
+class RateLimiter:
+    """Token bucket: `rate` sends per second on average, up to `burst` at once. rate <= 0 is unlimited."""
+
+    def __init__(self, rate: float, burst: int = 1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # take the token now, even if it goes negative, so waiters queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+
+def _parse_rate_limits(spec: str) -> dict:
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        host, _, value = entry.partition("=")
+        rate, _, burst = value.partition(":")
+        limits[host.strip().lower()] = (float(rate), int(burst or MAIL_BURST))
+    return limits
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(host: str) -> RateLimiter:
+    """The RateLimiter shared by everything sending through `host`."""
+    host = (host or "").lower()
+    with _limiters_lock:
+        if host not in _limiters:
+            rate, burst = _parse_rate_limits(MAIL_RATE_LIMITS).get(host, (MAIL_RATE, MAIL_BURST))
+            _limiters[host] = RateLimiter(rate, burst)
+        return _limiters[host]
+
+
+class SMTPPool:
+    """
+    Logged-in SMTP connections kept open between sends, at most `size` at
+    a time. A connection idle for longer than `idle_timeout` is closed and
+    replaced on the next acquire, since servers drop quiet clients.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls: bool = MAIL_STARTTLS,
+                 size: int = MAIL_POOL_SIZE, idle_timeout: float = MAIL_IDLE_TIMEOUT, timeout: float = MAIL_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connects = 0
+        self._idle = []  # (connection, last used)
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.connects += 1
+        return smtp
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn, used = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    return self._connect()
+                if time.monotonic() - used < self.idle_timeout:
+                    return conn
+                self._close(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        """Hand a connection back; broken ones (dropped mid-send) are closed instead."""
+        if broken:
+            self._close(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+class OutgoingMail:
+    def __init__(self, msg):
+        self.msg = msg
+        self.attempts = 0
+        self.delivered = False
+
+
+def backoff(attempt: int) -> float:
+    return min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class MailQueue:
+    """
+    Sends queued messages from `pool.size` worker threads. Each worker
+    takes up to `batch_size` messages and sends them over one pooled
+    connection, paced by the SMTP host's rate limiter. A connection that
+    drops mid-batch is replaced straight away; temporary (4xx) failures
+    are retried with backoff up to `max_attempts`, permanent ones logged
+    and dropped.
+    """
+
+    def __init__(self, pool: SMTPPool, batch_size: int = MAIL_BATCH, limiter: RateLimiter = None,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.limiter = limiter or limiter_for(pool.host)
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._timers = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def start(self):
+        with self._lock:
+            if self._threads or self.pool.size <= 0:
+                return
+            self._threads = [
+                threading.Thread(target=self._work, name=f"mail-{i}", daemon=True) for i in range(self.pool.size)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def send(self, msg) -> bool:
+        """
+        Queue `msg` for delivery. Returns True once queued, or, when the
+        pool size is 0, whether it was delivered.
+        """
+        item = OutgoingMail(msg)
+        with self._lock:
+            self._pending += 1
+        if self.pool.size <= 0:
+            return self._send_inline(item)
+        self.start()
+        self._queue.put(item)
+        return True
+
+    def _send_inline(self, item):
+        while True:
+            retry = self._send_batch([item])
+            if not retry:
+                return item.delivered
+            if not self._schedule_retry(item, retry[0][1], inline=True):
+                return False
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # leave the stop signal for this thread's next loop
+                    break
+                batch.append(item)
+            try:
+                for item, error in self._send_batch(batch):
+                    self._schedule_retry(item, error)
+            except Exception as e:
+                logger.error(f"Mail worker error: {e}")
+
+    def _send_batch(self, batch) -> list:
+        """Send `batch` over one connection. Returns [(item, error)] worth retrying."""
+        retry = []
+        conn = None
+        for item in batch:
+            self.limiter.acquire()
+            for reconnect in (True, False):
+                try:
+                    if conn is None:
+                        conn = self.pool.acquire()
+                    conn.send_message(item.msg)
+                    item.delivered = True
+                    self._finish(item, sent=True)
+                    break
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code == 421 and conn is not None:
+                        # the server is closing this connection
+                        self.pool.release(conn, broken=True)
+                        conn = None
+                    if 400 <= e.smtp_code < 500:
+                        retry.append((item, e))
+                    else:
+                        self._give_up(item, e)
+                    break
+                except OSError as e:  # smtplib's errors are OSErrors too
+                    if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                        # e.g. SMTPRecipientsRefused: the address itself is bad
+                        self._give_up(item, e)
+                        break
+                    # idle connections go stale; one fresh connection before backing off
+                    if conn is not None:
+                        self.pool.release(conn, broken=True)
+                        conn = None
+                    if not reconnect:
+                        retry.append((item, e))
+                except Exception as e:
+                    self._give_up(item, e)
+                    break
+        if conn is not None:
+            self.pool.release(conn)
+        return retry
+
+    def _schedule_retry(self, item, error, inline: bool = False) -> bool:
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            self._give_up(item, error)
+            return False
+        delay = backoff(item.attempts - 1)
+        logger.warning(f"Email to {item.msg['To']} failed (attempt {item.attempts}), retrying in {delay:.1f}s: {error}")
+        if inline:
+            time.sleep(delay)
+            return True
+        timer = threading.Timer(delay, lambda: self._requeue(timer, item))
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+        return True
+
+    def _requeue(self, timer, item):
+        with self._lock:
+            self._timers.discard(timer)
+        self._queue.put(item)
+
+    def _give_up(self, item, error):
+        logger.error(f"Could not send email to {item.msg['To']}: {error}")
+        if isinstance(error, smtplib.SMTPAuthenticationError):
+            logger.error("Please check MAIL_USERNAME and MAIL_PASSWORD in .env file")
+        self._finish(item, sent=False)
+
+    def _finish(self, item, sent: bool):
+        with self._idle:
+            if sent:
+                self.sent += 1
+                logger.info(f"Successfully sent email to {item.msg['To']}")
+            else:
+                self.failed += 1
+            self._pending -= 1
+            self._idle.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued message is sent or given up on. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stop(self, timeout: float = 10):
+        """Send what's queued (up to `timeout`), then stop the workers and close the connections."""
+        self.flush(timeout)
+        with self._lock:
+            threads, self._threads = self._threads, []
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=5)
+        self.pool.close()
+        if self._pending:
+            logger.warning(f"{self._pending} email(s) were not sent before shutdown")
+
+
+mail_queue = MailQueue(SMTPPool(MAIL_SERVER, MAIL_PORT, MAIL_USERNAME, MAIL_PASSWORD))
@@ -0,0 +1,55 @@
+import io
+import csv
+import zlib
+from datetime import date, datetime
+from app.utils.serializers import dumps
+
+# rows encoded per chunk handed to the response
+CHUNK_ROWS = 500
+
+
+def _cell(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(columns, rows, chunk_rows: int = None):
+    """Header line, then `rows` (tuples in `columns` order) as CSV, chunk_rows at a time."""
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([_cell(value) for value in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(columns, rows, chunk_rows: int = None):
+    """One JSON object per line, keyed by `columns`."""
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    batch = []
+    for row in rows:
+        batch.append(dumps(dict(zip(columns, row))))
+        if len(batch) >= chunk_rows:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def gzip_chunks(chunks, level: int = 6):
+    """Gzip a stream of byte chunks without holding more than one in memory."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,21 @@
+"""Recompute the sales_rollups table from the orders table.
+
+Run once after applying the migration that adds it, or any time the
+rollups are suspected to have drifted:
+
+    python rebuild_analytics.py
+"""
+from app.database import SessionLocal
+from app.services import analytics
+
+db = SessionLocal()
+
+try:
+    count = analytics.rebuild(db)
+    print(f"✓ Rebuilt sales rollups from {count} orders")
+except Exception as e:
+    db.rollback()
+    print(f"❌ Error: {e}")
+    raise
+finally:
+    db.close()
@@ -0,0 +1,41 @@
+"""Settle M-Pesa orders whose payment callback never arrived.
+
+The API does this every RECONCILE_INTERVAL seconds; run it by hand after
+an outage, or with --dry-run to see what it would change:
+
+    python reconcile_payments.py --dry-run
+    python reconcile_payments.py --older-than 5
+"""
+import argparse
+
+from app.database import SessionLocal
+from app.services import reconciliation
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+parser.add_argument("--older-than", type=float, default=reconciliation.RECONCILE_AFTER / 60,
+                    help="minutes since checkout before an order is checked")
+parser.add_argument("--batch-size", type=int, default=reconciliation.RECONCILE_BATCH)
+parser.add_argument("--concurrency", type=int, default=reconciliation.RECONCILE_CONCURRENCY)
+args = parser.parse_args()
+
+db = SessionLocal()
+
+try:
+    report = reconciliation.reconcile(
+        db,
+        dry_run=args.dry_run,
+        older_than=args.older_than * 60,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    verb = "Would settle" if args.dry_run else "Settled"
+    print(f"✓ Checked {report['checked']} orders: {report['pending']} still pending, {report['errors']} errors")
+    print(f"  {verb} {len(report['paid'])} as paid: {', '.join(report['paid']) or '-'}")
+    print(f"  {verb} {len(report['failed'])} as failed: {', '.join(report['failed']) or '-'}")
+except Exception as e:
+    db.rollback()
+    print(f"❌ Error: {e}")
+    raise
+finally:
+    db.close()
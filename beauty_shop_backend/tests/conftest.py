@@ -0,0 +1,30 @@
+import pytest
+
+from tests.mock_daraja import MockDaraja
+
+
+@pytest.fixture
+def daraja(monkeypatch):
+    """A running MockDaraja with app.utils.mpesa pointed at it (fresh token cache and session)."""
+    from app.utils import mpesa
+    server = MockDaraja().start()
+    monkeypatch.setattr(mpesa, "MPESA_BASE_URL", server.url)
+    monkeypatch.setattr(mpesa, "CONSUMER_KEY", server.consumer_key)
+    monkeypatch.setattr(mpesa, "CONSUMER_SECRET", server.consumer_secret)
+    monkeypatch.setattr(mpesa, "BUSINESS_SHORTCODE", "174379")
+    monkeypatch.setattr(mpesa, "PASSKEY", "test-passkey")
+    monkeypatch.setattr(mpesa, "CALLBACK_URL", "https://example.com/api/orders/mpesa-callback")
+    monkeypatch.setattr(mpesa, "session", mpesa._new_session())
+    monkeypatch.setattr(mpesa, "token_manager", mpesa.TokenManager(mpesa._fetch_access_token))
+    yield server
+    mpesa.session.close()
+    server.stop()
+
+
+@pytest.fixture
+def smtp_server():
+    """A running MockSMTP."""
+    from tests.mock_smtp import MockSMTP
+    server = MockSMTP().start()
+    yield server
+    server.stop()
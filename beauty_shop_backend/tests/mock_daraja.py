@@ -0,0 +1,142 @@
+"""A local stand-in for Safaricom's Daraja API, for tests that exercise app/utils/mpesa.py."""
+import base64
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockDaraja:
+    """
+    Serves the OAuth, STK push and STK push query endpoints on 127.0.0.1.
+    Records what it was sent, and counts token requests and client
+    connections so tests can check caching and keep-alive.
+    """
+
+    def __init__(self, consumer_key="test-key", consumer_secret="test-secret", expires_in=3599):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.expires_in = expires_in
+        self.token_delay = 0.0
+        self.stk_delay = 0.0
+        self.token_requests = 0
+        self.stk_requests = []
+        self.stk_failures = 0  # answer this many STK pushes with a 503
+        self.token_failures = 0  # and this many token requests
+        # STK push query: {CheckoutRequestID: (ResultCode, ResultDesc)}; others are still processing
+        self.stk_results = {}
+        self.query_delay = 0.0
+        self.query_requests = []
+        self.max_concurrent_queries = 0
+        self._queries_in_flight = 0
+        self.connections = set()
+        self.valid_tokens = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.valid_tokens.clear()
+
+    def start(self):
+        daraja = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _bearer_ok(self):
+                token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+                with daraja._lock:
+                    return token in daraja.valid_tokens
+
+            def do_GET(self):
+                daraja.connections.add(self.client_address)
+                if not self.path.startswith("/oauth/v1/generate"):
+                    return self._send(404, {"errorMessage": "not found"})
+                expected = base64.b64encode(f"{daraja.consumer_key}:{daraja.consumer_secret}".encode()).decode()
+                if self.headers.get("Authorization") != f"Basic {expected}":
+                    return self._send(400, {"errorMessage": "Invalid credentials"})
+                time.sleep(daraja.token_delay)
+                with daraja._lock:
+                    if daraja.token_failures > 0:
+                        daraja.token_failures -= 1
+                        return self._send(503, {"errorMessage": "Service Unavailable"})
+                    daraja.token_requests += 1
+                    token = f"token-{next(daraja._ids)}"
+                    daraja.valid_tokens.add(token)
+                self._send(200, {"access_token": token, "expires_in": str(daraja.expires_in)})
+
+            def do_POST(self):
+                daraja.connections.add(self.client_address)
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self._bearer_ok():
+                    return self._send(401, {"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+                if self.path == "/mpesa/stkpush/v1/processrequest":
+                    time.sleep(daraja.stk_delay)
+                    with daraja._lock:
+                        daraja.stk_requests.append(body)
+                        if daraja.stk_failures > 0:
+                            daraja.stk_failures -= 1
+                            return self._send(503, {"errorMessage": "Service Unavailable"})
+                        n = next(daraja._ids)
+                    return self._send(200, {
+                        "MerchantRequestID": f"merchant-{n}",
+                        "CheckoutRequestID": f"ws_CO_{n}",
+                        "ResponseCode": "0",
+                        "ResponseDescription": "Success. Request accepted for processing",
+                        "CustomerMessage": "Success. Request accepted for processing",
+                    })
+                if self.path == "/mpesa/stkpushquery/v1/query":
+                    return self._query(body)
+                self._send(404, {"errorMessage": "not found"})
+
+            def _query(self, body):
+                with daraja._lock:
+                    daraja.query_requests.append(body)
+                    daraja._queries_in_flight += 1
+                    daraja.max_concurrent_queries = max(daraja.max_concurrent_queries, daraja._queries_in_flight)
+                try:
+                    time.sleep(daraja.query_delay)
+                finally:
+                    with daraja._lock:
+                        daraja._queries_in_flight -= 1
+                checkout_request_id = body.get("CheckoutRequestID")
+                if checkout_request_id not in daraja.stk_results:
+                    return self._send(500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"})
+                code, desc = daraja.stk_results[checkout_request_id]
+                self._send(200, {
+                    "ResponseCode": "0",
+                    "ResponseDescription": "The service request has been accepted successsfully",
+                    "MerchantRequestID": "merchant-query",
+                    "CheckoutRequestID": checkout_request_id,
+                    "ResultCode": str(code),
+                    "ResultDesc": desc,
+                })
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,105 @@
+"""A local stand-in SMTP server, for tests that exercise app/utils/smtp.py."""
+import base64
+import socketserver
+import threading
+from email import message_from_bytes
+
+
+class MockSMTP:
+    """
+    Speaks enough ESMTP (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET,
+    NOOP, QUIT) on 127.0.0.1 for smtplib. Keeps the messages it accepts
+    and counts connections and logins so tests can check reuse.
+    """
+
+    def __init__(self, username="mailer", password="secret"):
+        self.username = username
+        self.password = password
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self.temp_failures = 0         # answer this many DATA commands with a 451
+        self.drop_after = None         # hang up on a connection after this many messages
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        smtp = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                with smtp._lock:
+                    smtp.connections += 1
+                sent = 0
+                self.reply("220 mock ESMTP ready")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command, _, arg = line.decode().strip().partition(" ")
+                    command = command.upper()
+                    if command in ("EHLO", "HELO"):
+                        self.reply("250-mock")
+                        self.reply("250 AUTH PLAIN LOGIN")
+                    elif command == "AUTH":
+                        self.auth(arg)
+                    elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = self.read_data()
+                        with smtp._lock:
+                            if smtp.temp_failures > 0:
+                                smtp.temp_failures -= 1
+                                self.reply("451 Try again later")
+                                continue
+                            smtp.messages.append(message_from_bytes(data))
+                        sent += 1
+                        self.reply("250 Queued")
+                        if smtp.drop_after is not None and sent >= smtp.drop_after:
+                            return
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+            def auth(self, arg):
+                mechanism, _, initial = arg.partition(" ")
+                if mechanism.upper() == "PLAIN":
+                    _, user, password = base64.b64decode(initial).decode().split("\0")
+                else:
+                    self.reply("334 VXNlcm5hbWU6")
+                    user = base64.b64decode(self.rfile.readline().strip()).decode()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    password = base64.b64decode(self.rfile.readline().strip()).decode()
+                if (user, password) != (smtp.username, smtp.password):
+                    return self.reply("535 Authentication credentials invalid")
+                with smtp._lock:
+                    smtp.logins += 1
+                self.reply("235 Authentication successful")
+
+            def read_data(self):
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b".\r\n", b""):
+                        return b"".join(lines)
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
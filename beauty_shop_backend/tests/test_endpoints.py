@@ -1,15 +1,35 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
 import os
+import tempfile
 from dotenv import load_dotenv
 
+# render invoices inline, and not into the tracked invoices/ directory
+os.environ.setdefault("INVOICE_WORKERS", "0")
+os.environ.setdefault("INVOICE_DIR", tempfile.mkdtemp(prefix="invoices-"))
+# send STK pushes inline, without backoff, and never to the real Safaricom sandbox
+os.environ.setdefault("PAYMENT_CONCURRENCY", "0")
+os.environ.setdefault("PAYMENT_RETRY_BASE", "0")
+os.environ.setdefault("MPESA_BASE_URL", "http://127.0.0.1:9")
+# send mail inline, once, and never to the real SMTP server
+os.environ.setdefault("MAIL_POOL_SIZE", "0")
+os.environ.setdefault("MAIL_MAX_ATTEMPTS", "1")
+os.environ.setdefault("MAIL_SERVER", "127.0.0.1")
+os.environ.setdefault("MAIL_PORT", "9")
+
 from app.main import app
 from app.database import Base, get_db
 from app.models import User, Product, Category, CartItem, Order
 from app.services.auth_service import hash_password, create_access_token
+from app.services.catalog_cache import catalog_cache
+from app.services.payments import payment_dispatcher
+from app.routes.auth import user_cache
+from app.services.category_registry import category_registry
+from app.services.suggest import PrefixIndex, suggest_index
+from app.utils.cache import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -36,6 +56,7 @@ def override_get_db():
 # Create test client
 Base.metadata.create_all(bind=engine)
 app.dependency_overrides[get_db] = override_get_db
+payment_dispatcher.session_factory = TestingSessionLocal
 client = TestClient(app)
 
 
@@ -45,6 +66,10 @@ def setup_database():
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
+    catalog_cache.clear()
+    user_cache.clear()
+    category_registry.invalidate()
+    suggest_index.reset()
 
 
 @pytest.fixture
@@ -61,6 +86,14 @@ def db_session():
     connection.close()
 
 
+@pytest.fixture
+def committed_session():
+    """Session whose commits survive across requests (db_session is rolled back by the first request)"""
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+
+
 @pytest.fixture
 def test_category(db_session):
     """Create a test category"""
@@ -128,6 +161,15 @@ def auth_headers(test_token):
     return {"Authorization": f"Bearer {test_token}"}
 
 
+@pytest.fixture
+def admin_headers(committed_session):
+    """Auth headers for an admin user"""
+    admin = User(email="admin@example.com", password=hash_password("Admin123!"), is_admin=True)
+    committed_session.add(admin)
+    committed_session.commit()
+    return {"Authorization": f"Bearer {create_access_token(data={'sub': admin.email})}"}
+
+
 # ====== AUTH ENDPOINTS TESTS ======
 
 class TestAuthEndpoints:
@@ -198,6 +240,29 @@ class TestAuthEndpoints:
         assert "Invalid credentials" in response.json()["detail"]
 
 
+    def test_profile_update_refreshes_cached_user(self, committed_session):
+        """Test that the cached current user is dropped when the profile changes"""
+        user = User(email="cached@example.com", password=hash_password("Test123!"))
+        committed_session.add(user)
+        committed_session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(data={'sub': user.email})}"}
+
+        assert client.get("/api/auth/me", headers=headers).json()["phone_number"] is None
+        client.put("/api/auth/me", headers=headers, json={"phone_number": "0700000000"})
+        assert client.get("/api/auth/me", headers=headers).json()["phone_number"] == "0700000000"
+
+    def test_deleted_user_is_not_served_from_cache(self, committed_session):
+        """Test that deleting a user evicts them from the auth cache"""
+        user = User(email="gone@example.com", password=hash_password("Test123!"))
+        committed_session.add(user)
+        committed_session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(data={'sub': user.email})}"}
+
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+        client.delete(f"/api/users/{user.id}")
+        assert client.get("/api/auth/me", headers=headers).status_code == 401
+
+
 # ====== PRODUCT ENDPOINTS TESTS ======
 
 class TestProductEndpoints:
@@ -241,6 +306,19 @@ class TestProductEndpoints:
         assert len(data) == 1
         assert "Face" in data[0]["name"]
     
+    def test_search_setup_is_checked_once(self, test_product):
+        """Test that searches don't re-check the FTS setup on every request"""
+        client.get("/api/products/?search=Face")
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            response = client.get("/api/products/?search=Cream")
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert response.status_code == 200
+        assert statements and not any("sqlite_master" in s for s in statements)
+
     def test_get_products_by_search_no_match(self):
         """Test search with no matching product"""
         response = client.get("/api/products/?search=Nonexistent")
@@ -254,6 +332,347 @@ class TestProductEndpoints:
         data = response.json()
         assert len(data) == 1
 
+    def test_search_matches_description(self, test_product):
+        """Test that search looks at descriptions, not only names"""
+        response = client.get("/api/products/?search=premium")
+        assert [p["name"] for p in response.json()] == ["Face Cream"]
+
+    def test_search_ranks_best_match_first(self, committed_session):
+        """Test that search results are ordered by relevance"""
+        category = Category(name="Ranked")
+        committed_session.add(category)
+        committed_session.commit()
+        committed_session.add_all([
+            Product(name="Body Lotion", description="Pairs well with our rose oil", price=900.0, stock_quantity=1, category_id=category.id),
+            Product(name="Rose Oil", description="Pure rose oil", price=1200.0, stock_quantity=1, category_id=category.id),
+        ])
+        committed_session.commit()
+
+        response = client.get("/api/products/?search=rose oil")
+        assert [p["name"] for p in response.json()] == ["Rose Oil", "Body Lotion"]
+
+        page = client.get("/api/products/?search=rose oil&limit=1").json()
+        assert [p["name"] for p in page["items"]] == ["Rose Oil"]
+        page = client.get(f"/api/products/?search=rose oil&limit=1&cursor={page['next_cursor']}").json()
+        assert [p["name"] for p in page["items"]] == ["Body Lotion"]
+        assert page["next_cursor"] is None
+
+    def test_get_products_paginated(self, committed_session):
+        """Test keyset pagination walks every product exactly once"""
+        category = Category(name="Serums")
+        committed_session.add(category)
+        committed_session.commit()
+        for i in range(5):
+            committed_session.add(Product(name=f"Serum {i}", price=100.0 * (5 - i), stock_quantity=1, category_id=category.id))
+        committed_session.commit()
+
+        seen = []
+        cursor = None
+        for _ in range(3):
+            url = "/api/products/?limit=2&sort=price" + (f"&cursor={cursor}" if cursor else "")
+            response = client.get(url)
+            assert response.status_code == 200
+            page = response.json()
+            seen.extend(p["price"] for p in page["items"])
+            cursor = page["next_cursor"]
+        assert seen == [100.0, 200.0, 300.0, 400.0, 500.0]
+        assert cursor is None
+
+    def test_get_products_invalid_cursor(self):
+        """Test that a garbled cursor is rejected"""
+        response = client.get("/api/products/?limit=2&cursor=not-a-cursor")
+        assert response.status_code == 400
+
+    def test_get_products_field_projection(self, test_product):
+        """Test that ?fields= only returns the requested fields"""
+        response = client.get("/api/products/?limit=24&fields=id,name,price")
+        assert response.status_code == 200
+        assert response.json()["items"] == [{"id": test_product.id, "name": "Face Cream", "price": 1500.0}]
+
+    def test_get_products_unknown_field(self):
+        """Test that unknown projection fields are rejected"""
+        response = client.get("/api/products/?fields=id,secret")
+        assert response.status_code == 400
+
+
+# ====== FILTER & FACET TESTS ======
+
+@pytest.fixture
+def facet_catalog(committed_session):
+    """Two categories with a spread of prices, ratings and stock"""
+    skincare = Category(name="Skincare")
+    makeup = Category(name="Makeup")
+    committed_session.add_all([skincare, makeup])
+    committed_session.commit()
+    committed_session.add_all([
+        Product(name="Cleanser", price=800.0, rating=4.2, stock_quantity=10, is_new=False, category_id=skincare.id),
+        Product(name="Serum", price=4500.0, rating=4.8, stock_quantity=0, is_new=True, category_id=skincare.id),
+        Product(name="Night Cream", price=5200.0, rating=4.6, stock_quantity=3, is_new=False, category_id=skincare.id),
+        Product(name="Lipstick", price=1500.0, rating=4.4, stock_quantity=7, is_new=True, category_id=makeup.id),
+    ])
+    committed_session.commit()
+    return {"skincare": skincare.id, "makeup": makeup.id}
+
+
+class TestProductFilters:
+    """Test server-side filtering, sorting and facet counts"""
+
+    def test_filters_combine(self, facet_catalog):
+        """Test price, rating, is_new and in_stock filters together"""
+        response = client.get("/api/products/?min_price=1000&max_price=5000&min_rating=4.3")
+        assert sorted(p["name"] for p in response.json()) == ["Lipstick", "Serum"]
+
+        response = client.get("/api/products/?is_new=true&in_stock=true")
+        assert [p["name"] for p in response.json()] == ["Lipstick"]
+
+    def test_sort_options(self, facet_catalog):
+        """Test the extra sort orders"""
+        names = lambda sort: [p["name"] for p in client.get(f"/api/products/?sort={sort}").json()]
+        assert names("price_desc") == ["Night Cream", "Serum", "Lipstick", "Cleanser"]
+        assert names("rating") == ["Serum", "Night Cream", "Lipstick", "Cleanser"]
+
+        page = client.get("/api/products/?sort=rating&limit=3").json()
+        page = client.get(f"/api/products/?sort=rating&limit=3&cursor={page['next_cursor']}").json()
+        assert [p["name"] for p in page["items"]] == ["Cleanser"]
+
+    def test_facet_counts(self, facet_catalog):
+        """Test that each facet ignores its own filter"""
+        response = client.get(f"/api/products/facets?category_id={facet_catalog['skincare']}&max_price=5000")
+        assert response.status_code == 200
+        facets = response.json()
+        assert facets["total"] == 2
+        assert {c["name"]: c["count"] for c in facets["categories"]} == {"Skincare": 2, "Makeup": 1}
+        assert [b["count"] for b in facets["price_buckets"]] == [1, 0, 1, 1, 0]
+
+
+# ====== SUGGEST ENDPOINT TESTS ======
+
+class TestSuggestEndpoint:
+    """Test product typeahead suggestions"""
+
+    def test_prefix_index_matches_any_word(self):
+        """Test that a prefix of any word in a name matches"""
+        index = PrefixIndex()
+        index.add("product", 1, "Vitamin C Serum")
+        index.add("product", 2, "Serum Primer")
+        index.add("category", 1, "Skincare")
+        assert [s["id"] for s in index.suggest("ser")] == [1, 2]
+        assert index.suggest("ski") == [{"type": "category", "id": 1, "label": "Skincare"}]
+
+        index.add("product", 2, "Glow Primer")
+        index.remove("product", 1)
+        assert index.suggest("ser") == []
+
+    def test_suggest_endpoint(self, test_product):
+        """Test suggestions are built from the products and categories tables"""
+        response = client.get("/api/products/suggest?q=fa")
+        assert response.status_code == 200
+        assert response.json() == [{"type": "product", "id": test_product.id, "label": "Face Cream"}]
+        assert client.get("/api/products/suggest?q=beau").json()[0]["type"] == "category"
+
+    def test_suggest_follows_product_writes(self, test_category):
+        """Test that product CRUD updates the index without a rebuild"""
+        assert client.get("/api/products/suggest?q=lip").json() == []
+        created = client.post("/api/products/", json={"name": "Lip Gloss", "price": 600.0, "category_id": test_category.id}).json()
+        assert [s["label"] for s in client.get("/api/products/suggest?q=lip").json()] == ["Lip Gloss"]
+
+        client.delete(f"/api/products/{created['id']}")
+        assert client.get("/api/products/suggest?q=lip").json() == []
+
+
+# ====== CONDITIONAL GET TESTS ======
+
+class TestConditionalGet:
+    """Test ETag / Last-Modified handling on catalog and review reads"""
+
+    def test_product_list_not_modified(self, committed_session):
+        """Test that an unchanged catalog answers If-None-Match with 304"""
+        category = Category(name="Etag")
+        committed_session.add(category)
+        committed_session.commit()
+        committed_session.add(Product(name="Mask", price=1200.0, stock_quantity=2, category_id=category.id))
+        committed_session.commit()
+
+        first = client.get("/api/products/")
+        etag = first.headers["etag"]
+        assert "max-age" in first.headers["cache-control"]
+        assert "last-modified" in first.headers
+
+        second = client.get("/api/products/", headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.content == b""
+
+        product_id = first.json()[0]["id"]
+        client.put(f"/api/products/{product_id}", json={"price": 1100.0})
+        third = client.get("/api/products/", headers={"If-None-Match": etag})
+        assert third.status_code == 200
+        assert third.headers["etag"] != etag
+
+    def test_product_detail_not_modified(self, test_product):
+        """Test validators on a single product"""
+        first = client.get(f"/api/products/{test_product.id}")
+        assert client.get(f"/api/products/{test_product.id}", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+        assert client.get(
+            f"/api/products/{test_product.id}", headers={"If-Modified-Since": first.headers["last-modified"]}
+        ).status_code == 304
+
+    def test_orders_change_product_validators(self, committed_session, auth_headers):
+        """Test that stock taken by an order (not just a sell-out) changes the ETags and cached bodies"""
+        category = Category(name="Stocked")
+        committed_session.add(category)
+        committed_session.commit()
+        product = Product(name="Toner", price=800.0, stock_quantity=10, category_id=category.id)
+        committed_session.add(product)
+        committed_session.commit()
+
+        detail = client.get(f"/api/products/{product.id}")
+        listing = client.get("/api/products/")
+        assert detail.json()["stock_quantity"] == 10
+
+        response = client.post("/api/orders/", headers=auth_headers, json={
+            "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                         "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+            "items": [{"id": product.id, "name": "Toner", "quantity": 3, "price": 800.0}],
+            "total": 2400.0,
+            "paymentMethod": "cash",
+        })
+        assert response.status_code == 200
+
+        after = client.get(f"/api/products/{product.id}", headers={"If-None-Match": detail.headers["etag"]})
+        assert after.status_code == 200
+        assert after.headers["etag"] != detail.headers["etag"]
+        assert after.json()["stock_quantity"] == 7
+        after = client.get("/api/products/", headers={"If-None-Match": listing.headers["etag"]})
+        assert after.status_code == 200
+        assert after.json()[0]["stock_quantity"] == 7
+
+        # cancelling puts the stock back, which is another change
+        etag = client.get(f"/api/products/{product.id}").headers["etag"]
+        order = committed_session.query(Order).filter(Order.public_id == response.json()["id"]).one()
+        assert client.put(f"/api/orders/{order.id}/status", json={"status": "cancelled"}).status_code == 200
+        restocked = client.get(f"/api/products/{product.id}", headers={"If-None-Match": etag})
+        assert restocked.status_code == 200
+        assert restocked.json()["stock_quantity"] == 10
+
+    def test_reviews_not_modified_until_new_review(self, committed_session):
+        """Test that a new review changes the reviews ETag"""
+        category = Category(name="Reviews")
+        committed_session.add(category)
+        committed_session.commit()
+        product = Product(name="Scrub", price=700.0, stock_quantity=2, category_id=category.id)
+        committed_session.add(product)
+        committed_session.commit()
+
+        first = client.get(f"/api/reviews/product/{product.id}")
+        etag = first.headers["etag"]
+        assert client.get(f"/api/reviews/product/{product.id}", headers={"If-None-Match": etag}).status_code == 304
+
+        client.post("/api/reviews/", json={"product_id": product.id, "rating": 5, "comment": "Lovely"})
+        after = client.get(f"/api/reviews/product/{product.id}", headers={"If-None-Match": etag})
+        assert after.status_code == 200
+        assert len(after.json()) == 1
+
+
+# ====== CATEGORY ENDPOINTS TESTS ======
+
+class TestCategoryEndpoints:
+    """Test the category registry and endpoints"""
+
+    def test_product_category_name_comes_from_table(self, test_product):
+        """Test that products are labelled with their category row's name"""
+        response = client.get(f"/api/products/{test_product.id}")
+        assert response.json()["category"] == "Beauty Products"
+
+    def test_new_category_is_usable_without_restart(self):
+        """Test that a category created through the API is immediately resolvable"""
+        client.get("/api/categories/")  # warm the registry
+        created = client.post("/api/categories/", json={"name": "Fragrance"}).json()
+        product = client.post("/api/products/", json={"name": "Eau de Rose", "price": 4200.0, "category": "Fragrance"}).json()
+        assert product["category_id"] == created["id"]
+        assert product["category"] == "Fragrance"
+
+        response = client.get("/api/products/?category=fragrance")
+        assert [p["name"] for p in response.json()] == ["Eau de Rose"]
+
+    def test_rename_category_refreshes_cached_products(self, committed_session):
+        """Test that renaming a category is reflected in cached product responses"""
+        category = Category(name="Nails")
+        committed_session.add(category)
+        committed_session.commit()
+        committed_session.add(Product(name="Polish", price=300.0, stock_quantity=5, category_id=category.id))
+        committed_session.commit()
+
+        assert client.get("/api/products/").json()[0]["category"] == "Nails"
+        client.put(f"/api/categories/{category.id}", json={"name": "Nail Care"})
+        assert client.get("/api/products/").json()[0]["category"] == "Nail Care"
+
+    def test_rename_category_to_existing_name(self, test_category):
+        """Test that renaming onto another category's name is rejected"""
+        other = client.post("/api/categories/", json={"name": "Fragrance"}).json()
+        response = client.put(f"/api/categories/{other['id']}", json={"name": test_category.name})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Category already exists"
+
+    def test_filter_by_unknown_category_name(self, test_product):
+        """Test that an unknown category name matches nothing"""
+        response = client.get("/api/products/?category=Nonexistent")
+        assert response.json() == []
+
+
+# ====== CATALOG CACHE TESTS ======
+
+class TestCatalogCache:
+    """Test the product catalog cache"""
+
+    def test_ttl_cache_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry goes first when full"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_ttl_cache_expires_entries(self):
+        """Test that entries are dropped after their TTL"""
+        cache = TTLCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+    def test_product_list_is_served_from_cache(self, committed_session):
+        """Test that a repeated listing does not see rows written behind the cache's back"""
+        category = Category(name="Cached")
+        committed_session.add(category)
+        committed_session.commit()
+        committed_session.add(Product(name="Toner", price=900.0, stock_quantity=5, category_id=category.id))
+        committed_session.commit()
+
+        assert len(client.get("/api/products/").json()) == 1
+        committed_session.add(Product(name="Mist", price=700.0, stock_quantity=5, category_id=category.id))
+        committed_session.commit()
+        assert len(client.get("/api/products/").json()) == 1
+
+    def test_writes_invalidate_affected_entries(self, committed_session):
+        """Test that create/update/delete through the API refresh cached pages"""
+        skincare = Category(name="Skin")
+        haircare = Category(name="Hair")
+        committed_session.add_all([skincare, haircare])
+        committed_session.commit()
+
+        created = client.post("/api/products/", json={"name": "Balm", "price": 500.0, "category_id": skincare.id}).json()
+        assert [p["name"] for p in client.get(f"/api/products/?category_id={haircare.id}").json()] == []
+        assert [p["name"] for p in client.get("/api/products/").json()] == ["Balm"]
+
+        client.put(f"/api/products/{created['id']}", json={"name": "Hair Balm", "category_id": haircare.id})
+        assert [p["name"] for p in client.get(f"/api/products/?category_id={haircare.id}").json()] == ["Hair Balm"]
+        assert client.get(f"/api/products/{created['id']}").json()["name"] == "Hair Balm"
+
+        client.delete(f"/api/products/{created['id']}")
+        assert client.get("/api/products/").json() == []
+        assert client.get(f"/api/products/{created['id']}").status_code == 404
+
 
 # ====== CART ENDPOINTS TESTS ======
 
@@ -387,6 +806,37 @@ class TestCartEndpoints:
         assert len(data) == 1
         assert data[0]["quantity"] == 1
 
+    def test_view_cart_embeds_products_in_one_query(self, committed_session, auth_headers):
+        """Test that cart lines carry their product and are loaded with a single join"""
+        from sqlalchemy import event
+        user = committed_session.query(User).filter(User.email == "testuser@example.com").first()
+        category = Category(name="Skincare")
+        committed_session.add(category)
+        committed_session.commit()
+        for i in range(5):
+            product = Product(name=f"Serum {i}", price=100.0 * (i + 1), stock_quantity=10, category_id=category.id)
+            committed_session.add(product)
+            committed_session.flush()
+            committed_session.add(CartItem(user_id=user.id, product_id=product.id, quantity=2))
+        committed_session.commit()
+
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if "cart_items" in statement or "products" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.get("/api/cart/", headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) == 5
+        assert data[0]["product"]["name"] == "Serum 0"
+        assert data[4]["subtotal"] == 1000.0
+        assert len(statements) == 1
+
 
 # ====== ORDER/CHECKOUT ENDPOINTS TESTS ======
 
@@ -479,6 +929,93 @@ class TestOrderEndpoints:
         assert order.total_amount == 1500.0
         assert order.status == "pending"
     
+    def test_create_order_reserves_stock(self, committed_session, auth_headers):
+        """Test that placing an order takes its items out of stock, and overselling is refused"""
+        category = Category(name="Skincare")
+        committed_session.add(category)
+        committed_session.commit()
+        product = Product(name="Serum", price=1000.0, stock_quantity=3, category_id=category.id)
+        committed_session.add(product)
+        committed_session.commit()
+
+        def place(quantity):
+            return client.post("/api/orders/", headers=auth_headers, json={
+                "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                             "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+                "items": [{"id": product.id, "name": "Serum", "quantity": quantity, "price": 1000.0}],
+                "total": 1000.0 * quantity,
+                "paymentMethod": "cash",
+            })
+
+        assert place(2).status_code == 200
+        response = place(2)
+        assert response.status_code == 409
+        committed_session.expire_all()
+        assert committed_session.get(Product, product.id).stock_quantity == 1
+        assert committed_session.query(Order).count() == 1
+
+    def test_create_order_idempotency_key_replays(self, committed_session, auth_headers):
+        """Test that retrying with the same Idempotency-Key returns the first order"""
+        payload = {
+            "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                         "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+            "items": [{"name": "Serum", "quantity": 1, "price": 1000.0}],
+            "total": 1000.0,
+            "paymentMethod": "cash",
+        }
+        headers = {**auth_headers, "Idempotency-Key": "retry-1"}
+
+        first = client.post("/api/orders/", headers=headers, json=payload)
+        second = client.post("/api/orders/", headers=headers, json=payload)
+        assert first.status_code == second.status_code == 200
+        assert second.headers["idempotent-replayed"] == "true"
+        assert second.json()["id"] == first.json()["id"]
+        assert committed_session.query(Order).count() == 1
+
+        reused = client.post("/api/orders/", headers=headers, json={**payload, "total": 2000.0})
+        assert reused.status_code == 422
+
+    def test_checkout_idempotency_key_skips_side_effects(self, committed_session, auth_headers, monkeypatch):
+        """Test that a replayed checkout doesn't regenerate the invoice or push M-Pesa again"""
+        import sys
+        from app.services import payments
+        # app.routes re-exports the router under the module's name
+        orders_route = sys.modules["app.routes.orders"]
+        calls = {"pdf": 0, "stk": 0}
+
+        def fake_invoice(order):
+            calls["pdf"] += 1
+
+        def fake_stk(**kwargs):
+            calls["stk"] += 1
+            return {"ResponseCode": "0"}
+
+        monkeypatch.setattr(orders_route, "queue_invoice", fake_invoice)
+        monkeypatch.setattr(payments, "initiate_stk_push", fake_stk)
+
+        payload = {"phone_number": "254712345678", "cart_items": [{"name": "Serum", "quantity": 1, "price": 1000}]}
+        headers = {**auth_headers, "Idempotency-Key": "checkout-1"}
+        first = client.post("/api/orders/checkout", headers=headers, json=payload)
+        second = client.post("/api/orders/checkout", headers=headers, json=payload)
+
+        assert first.status_code == second.status_code == 200
+        assert second.json()["order_id"] == first.json()["order_id"]
+        assert calls == {"pdf": 1, "stk": 1}
+        assert committed_session.query(Order).count() == 1
+
+    def test_checkout_returns_before_payment_and_can_be_polled(self, committed_session, auth_headers, daraja):
+        """Test that checkout answers payment_pending and the push outcome shows up on the poll endpoint"""
+        payload = {"phone_number": "0712345678", "cart_items": [{"name": "Serum", "quantity": 2, "price": 500}]}
+        response = client.post("/api/orders/checkout", headers=auth_headers, json=payload)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["status"] == "payment_pending"
+
+        payment = client.get(body["payment_url"]).json()
+        assert payment["payment_status"] == "requested"
+        assert daraja.stk_requests[0]["Amount"] == 1000
+        assert client.get("/api/orders/ORD-missing/payment").status_code == 404
+
     def test_checkout_multiple_products(self, test_product, test_user, auth_headers, db_session, test_category):
         """Test checkout with multiple different products"""
         # Create another product
@@ -517,6 +1054,484 @@ class TestOrderEndpoints:
         assert response.json()["order_details"]["total"] == 5400.0
 
 
+class TestMpesaCallback:
+    """Test that Daraja callbacks settle the order they belong to"""
+
+    @pytest.fixture
+    def checked_out(self, committed_session, auth_headers, daraja):
+        return self._checkout(committed_session, auth_headers)
+
+    def _checkout(self, committed_session, auth_headers):
+        category = Category(name="Skincare")
+        committed_session.add(category)
+        committed_session.commit()
+        product = Product(name="Serum", price=500.0, stock_quantity=5, category_id=category.id)
+        committed_session.add(product)
+        committed_session.commit()
+        response = client.post("/api/orders/checkout", headers=auth_headers, json={
+            "phone_number": "0712345678",
+            "cart_items": [{"product_id": product.id, "name": "Serum", "quantity": 2, "price": 500.0}],
+        })
+        order = committed_session.query(Order).filter(Order.public_id == response.json()["order_id"]).one()
+        return order
+
+    def _callback(self, path, order, result_code=0, desc="The service request is processed successfully."):
+        body = {"Body": {"stkCallback": {
+            "MerchantRequestID": order.merchant_request_id,
+            "CheckoutRequestID": order.checkout_request_id,
+            "ResultCode": result_code,
+            "ResultDesc": desc,
+        }}}
+        if result_code == 0:
+            body["Body"]["stkCallback"]["CallbackMetadata"] = {"Item": [
+                {"Name": "Amount", "Value": 1000.0},
+                {"Name": "MpesaReceiptNumber", "Value": "NLJ7RT61SV"},
+                {"Name": "PhoneNumber", "Value": 254712345678},
+            ]}
+        response = client.post(path, json=body)
+        assert response.status_code == 200
+        assert response.json()["ResultCode"] == 0
+        return response
+
+    def test_success_marks_paid_once(self, committed_session, checked_out, monkeypatch):
+        """Test that a paid callback settles the order, and a duplicate changes nothing"""
+        import sys
+        from app.models import StockReservation
+        orders_route = sys.modules["app.routes.orders"]
+        receipts = []
+        monkeypatch.setattr(orders_route, "send_payment_receipt_email", lambda **kwargs: receipts.append(kwargs))
+        assert checked_out.checkout_request_id.startswith("ws_CO_")
+
+        self._callback("/api/orders/mpesa-callback", checked_out)
+        self._callback("/api/orders/mpesa/callback", checked_out)
+
+        committed_session.expire_all()
+        order = committed_session.get(Order, checked_out.id)
+        assert (order.status, order.payment_status, order.transaction_id) == ("paid", "paid", "NLJ7RT61SV")
+        held = committed_session.query(StockReservation).filter(StockReservation.order_id == order.id).one()
+        assert held.status == "committed"
+        assert len(receipts) == 1
+        assert receipts[0]["receipt"] == "NLJ7RT61SV"
+
+    def test_cancelled_payment_is_recorded(self, committed_session, checked_out):
+        """Test that a declined push shows up on the payment poll"""
+        self._callback("/api/orders/mpesa-callback", checked_out, result_code=1032, desc="Request cancelled by user")
+        payment = client.get(f"/api/orders/{checked_out.public_id}/payment").json()
+        assert payment["status"] == "pending"
+        assert (payment["payment_status"], payment["payment_error"]) == ("failed", "Request cancelled by user")
+
+    def test_unconfirmed_push_is_settled_by_phone_and_amount(self, committed_session, auth_headers, daraja):
+        """Test that a paid callback for a push we never got ids for still finds its order"""
+        from types import SimpleNamespace
+        daraja.stk_failures = 1
+        order = self._checkout(committed_session, auth_headers)
+        assert len(daraja.stk_requests) == 1
+        assert (order.payment_status, order.checkout_request_id) == ("unconfirmed", None)
+
+        self._callback("/api/orders/mpesa-callback", SimpleNamespace(merchant_request_id="m-lost", checkout_request_id="ws_CO_lost"))
+
+        committed_session.expire_all()
+        order = committed_session.get(Order, order.id)
+        assert (order.status, order.payment_status, order.transaction_id) == ("paid", "paid", "NLJ7RT61SV")
+
+    def test_unknown_request_is_acknowledged(self):
+        """Test that callbacks we can't match (or parse) are still acknowledged"""
+        assert client.post("/api/orders/mpesa-callback", json={"Body": {"stkCallback": {
+            "CheckoutRequestID": "ws_CO_unknown", "ResultCode": 0}}}).json()["ResultCode"] == 0
+        assert client.post("/api/orders/mpesa-callback", json={"Body": "garbage"}).json()["ResultCode"] == 0
+
+
+# ====== SERIALIZATION TESTS ======
+
+class TestSerialization:
+    """Test the direct ORM-row to JSON encoders"""
+
+    def test_dumps_handles_datetimes(self):
+        """Test that UTC datetimes encode like Pydantic does"""
+        from datetime import datetime, timezone
+        from app.utils.serializers import dumps
+        assert dumps({"at": datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}) == b'{"at":"2026-01-02T03:04:05Z"}'
+
+    def test_order_list_shape(self, committed_session):
+        """Test that the admin order list keeps its frontend-facing shape"""
+        order = Order(public_id="ORD-1", total_amount=1500.0, status="pending", invoice_number="INV-1")
+        order.set_customer({"email": "a@example.com"})
+        order.set_items([{"name": "Face Cream", "quantity": 1, "price": 1500.0}])
+        committed_session.add(order)
+        committed_session.commit()
+
+        response = client.get("/api/orders/all")
+        assert response.headers["content-type"] == "application/json"
+        row = response.json()[0]
+        assert set(row) == {"id", "invoice_number", "total_amount", "status", "created_at", "customer_json", "items_json"}
+        assert row["id"] == "ORD-1"
+
+
+class TestCompression:
+    """Test gzip/brotli negotiation and precompressed cache entries"""
+
+    def _catalog(self, session, count=30):
+        category = Category(name="Skincare")
+        session.add(category)
+        session.commit()
+        for i in range(count):
+            session.add(Product(
+                name=f"Hydrating Serum {i}", price=1000.0 + i, stock_quantity=5, category_id=category.id,
+                image=f"https://images.unsplash.com/photo-{i}?w=800&q=80&auto=format&fit=crop"
+            ))
+        session.commit()
+
+    def test_negotiate_honours_q_values(self):
+        """Test that refused codings are skipped and br is preferred on ties"""
+        from app.utils.compression import negotiate
+        assert negotiate(None) is None
+        assert negotiate("identity") is None
+        assert negotiate("gzip;q=0, br;q=0") is None
+        assert negotiate("gzip, deflate") == "gzip"
+        assert negotiate("gzip, br") == "br"
+        assert negotiate("br;q=0.5, gzip") == "gzip"
+
+    def test_cached_list_is_compressed_once(self, committed_session, monkeypatch):
+        """Test that a catalog hit serves the memoized gzip bytes"""
+        from app.utils import compression
+        calls = []
+        compress = compression.compress
+        monkeypatch.setattr(compression, "compress", lambda body, encoding, cached=False: (
+            calls.append((encoding, cached)) or compress(body, encoding, cached)))
+        self._catalog(committed_session)
+        headers = {"Accept-Encoding": "gzip"}
+
+        first = client.get("/api/products/", headers=headers)
+        assert first.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in first.headers["vary"]
+        assert len(first.json()) == 30
+        assert calls == [("gzip", True)]
+
+        second = client.get("/api/products/", headers=headers)
+        assert second.content == first.content
+        assert calls == [("gzip", True)]
+
+    def test_identity_when_not_accepted(self, committed_session):
+        """Test that clients without Accept-Encoding get the plain body"""
+        self._catalog(committed_session)
+        response = client.get("/api/products/", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert len(response.json()) == 30
+
+    def test_small_responses_are_not_compressed(self):
+        """Test that bodies under the threshold go out as-is"""
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+    def test_middleware_compresses_uncached_routes(self, committed_session):
+        """Test that large non-catalog responses are compressed by the middleware"""
+        for i in range(20):
+            order = Order(public_id=f"ORD-{i}", total_amount=1500.0, status="pending", invoice_number=f"INV-{i}")
+            order.set_customer({"email": "customer@example.com", "address": "Ngong Road, Nairobi"})
+            order.set_items([{"name": "Face Cream", "quantity": 1, "price": 1500.0}])
+            committed_session.add(order)
+        committed_session.commit()
+
+        response = client.get("/api/orders/all", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()) == 20
+
+
+class TestOrderItems:
+    """Test structured order items/customer columns and the SQL sales queries"""
+
+    def _order(self, session, status, items, total, email="a@example.com"):
+        order = Order(public_id=f"ORD-{status}-{total}", total_amount=total, status=status, invoice_number=f"INV-{status}-{total}")
+        order.set_customer({"firstName": "Akinyi", "lastName": "O", "email": email, "address": "Moi Avenue",
+                            "city": "Nairobi", "zip": "00100", "paymentMethod": "mpesa"})
+        order.set_items(items)
+        session.add(order)
+        session.commit()
+        return order
+
+    def test_items_and_customer_are_stored_in_columns(self, committed_session):
+        """Test that set_items/set_customer write rows and columns, not JSON"""
+        order = self._order(committed_session, "Paid", [{"name": "Serum", "quantity": 2, "price": 500.0}], 1000.0)
+        assert order.items_json is None and order.customer_json is None
+        assert order.customer_email == "a@example.com"
+        assert order.get_items() == [{"id": None, "name": "Serum", "quantity": 2, "price": 500.0, "totalPrice": 1000.0}]
+        assert order.get_customer()["paymentMethod"] == "mpesa"
+
+        response = client.get(f"/api/orders/{order.public_id}")
+        assert response.json()["customer"]["city"] == "Nairobi"
+
+    def test_legacy_json_orders_still_read(self, committed_session):
+        """Test that orders the backfill left alone fall back to their JSON"""
+        order = Order(public_id="ORD-legacy", total_amount=10.0, status="Paid",
+                      customer_json='{"email": "old@example.com"}', items_json='[{"name": "Toner", "quantity": 1, "price": 10.0}]')
+        committed_session.add(order)
+        committed_session.commit()
+        assert order.get_customer() == {"email": "old@example.com"}
+        assert order.get_items()[0]["name"] == "Toner"
+
+    def test_stats_require_admin(self, auth_headers):
+        """Test that customers can't read sales stats"""
+        for path in ("/api/orders/stats/revenue", "/api/orders/stats/top-products"):
+            assert client.get(path).status_code == 401
+            assert client.get(path, headers=auth_headers).status_code == 403
+
+    def test_unknown_products_are_rejected(self, committed_session, auth_headers):
+        """Test that an item naming no product is a 400, not a foreign key error"""
+        response = client.post("/api/orders/", headers=auth_headers, json={
+            "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                         "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+            "items": [{"id": 424242, "name": "Ghost", "quantity": 1, "price": 10.0}],
+            "total": 10.0,
+            "paymentMethod": "cash",
+        })
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Unknown product(s): 424242"
+        assert committed_session.query(Order).count() == 0
+
+    def test_revenue_and_top_sellers(self, committed_session, admin_headers):
+        """Test that sales stats count paid orders only"""
+        self._order(committed_session, "Paid", [{"name": "Serum", "quantity": 3, "price": 500.0}], 1500.0)
+        self._order(committed_session, "processing", [{"name": "Toner", "quantity": 1, "price": 800.0},
+                                                      {"name": "Serum", "quantity": 1, "price": 500.0}], 1300.0)
+        self._order(committed_session, "cancelled", [{"name": "Toner", "quantity": 9, "price": 800.0}], 7200.0)
+
+        revenue = client.get("/api/orders/stats/revenue", params={"by_day": True}, headers=admin_headers).json()
+        assert revenue["revenue"] == 2800.0
+        assert revenue["orders"] == 2
+        assert sum(day["orders"] for day in revenue["by_day"]) == 2
+
+        top = client.get("/api/orders/stats/top-products", headers=admin_headers).json()
+        assert [(row["name"], row["units"]) for row in top] == [("Serum", 4), ("Toner", 1)]
+
+class TestInvoices:
+    """Test background invoice rendering and the invoice download"""
+
+    def test_order_invoice_is_rendered_and_emailed(self, committed_session, auth_headers, monkeypatch):
+        """Test that placing an order renders its invoice and then emails it"""
+        from app.services import invoices
+        sent = []
+        monkeypatch.setattr(invoices, "send_invoice_email", lambda **kwargs: sent.append(kwargs))
+        response = client.post("/api/orders/", headers=auth_headers, json={
+            "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                         "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+            "items": [{"name": "Serum", "quantity": 2, "price": 1000.0}],
+            "total": 2000.0,
+            "paymentMethod": "cash",
+        })
+        assert response.status_code == 200
+
+        assert len(sent) == 1
+        assert sent[0]["recipient_email"] == "w@example.com"
+        assert os.path.exists(sent[0]["pdf_path"])
+
+    def test_invoice_download_renders_once(self, committed_session, monkeypatch):
+        """Test that the invoice is rendered on first download and served from disk after"""
+        from app.services import invoices
+        order = Order(public_id="ORD-dl", invoice_number="INV-dl", total_amount=500.0, status="Paid")
+        order.set_customer({"email": "dl@example.com"})
+        order.set_items([{"name": "Toner", "quantity": 1, "price": 500.0}])
+        committed_session.add(order)
+        committed_session.commit()
+        renders = []
+        real = invoices.generate_invoice_pdf
+        monkeypatch.setattr(invoices, "generate_invoice_pdf", lambda **job: renders.append(job) or real(**job))
+
+        first = client.get("/api/orders/ORD-dl/invoice")
+        second = client.get("/api/orders/ORD-dl/invoice")
+        assert first.status_code == second.status_code == 200
+        assert first.headers["content-type"] == "application/pdf"
+        assert first.content.startswith(b"%PDF") and second.content == first.content
+        assert len(renders) == 1
+        assert client.get("/api/orders/ORD-missing/invoice").status_code == 404
+
+class TestAdminOrderListing:
+    """Test keyset pagination, filters and streaming of /api/orders/all"""
+
+    @pytest.fixture
+    def orders(self, committed_session):
+        from datetime import datetime, timedelta, timezone
+        base = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        for i in range(12):
+            order = Order(public_id=f"ORD-{i:02d}", total_amount=100.0 * i, invoice_number=f"INV-{i:02d}",
+                          status="Paid" if i % 3 else "pending", user_id=1 if i < 6 else 2,
+                          # pairs of orders share a timestamp so ties are broken by id
+                          created_at=base + timedelta(hours=i // 2))
+            order.set_items([{"name": "Serum", "quantity": 1, "price": 100.0}])
+            committed_session.add(order)
+        committed_session.commit()
+
+    def test_pages_cover_every_order_once(self, orders):
+        """Test that following next_cursor walks all orders newest first"""
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 5, **({"cursor": cursor} if cursor else {})}
+            page = client.get("/api/orders/all", params=params).json()
+            seen += [row["id"] for row in page["items"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert seen == [f"ORD-{i:02d}" for i in reversed(range(12))]
+
+    def test_filters(self, orders):
+        """Test status, date range and user filters"""
+        rows = client.get("/api/orders/all", params={"status": "pending", "limit": 50}).json()["items"]
+        assert [row["id"] for row in rows] == ["ORD-09", "ORD-06", "ORD-03", "ORD-00"]
+
+        rows = client.get("/api/orders/all", params={
+            "user_id": 2, "start": "2026-03-01T04:00:00Z", "end": "2026-03-01T05:00:00Z", "limit": 50
+        }).json()["items"]
+        assert [row["id"] for row in rows] == ["ORD-09", "ORD-08"]
+
+    def test_unpaginated_list_is_streamed(self, orders, monkeypatch):
+        """Test that the legacy full list still comes back as one JSON array"""
+        import sys
+        monkeypatch.setattr(sys.modules["app.routes.orders"], "STREAM_BATCH", 5)
+        response = client.get("/api/orders/all", params={"status": "Paid"})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) == 8
+        assert data[0]["id"] == "ORD-11"
+
+    def test_bad_cursor(self):
+        """Test that a garbled cursor is a 400"""
+        assert client.get("/api/orders/all", params={"cursor": "nope"}).status_code == 400
+
+class TestExports:
+    """Test the streaming CSV/NDJSON exports"""
+
+    def test_exports_require_admin(self, auth_headers):
+        """Test that customers can't export"""
+        assert client.get("/api/exports/users").status_code == 401
+        assert client.get("/api/exports/users", headers=auth_headers).status_code == 403
+
+    def test_order_csv(self, committed_session, admin_headers, monkeypatch):
+        """Test that orders export as CSV with line/unit counts, across several chunks"""
+        import csv
+        import io
+        from app.utils import streaming
+        monkeypatch.setattr(streaming, "CHUNK_ROWS", 2)
+        for i in range(5):
+            order = Order(public_id=f"ORD-{i}", invoice_number=f"INV-{i}", total_amount=100.0, status="Paid")
+            order.set_customer({"firstName": "Njeri", "email": f"n{i}@example.com", "city": "Mombasa, Nyali"})
+            order.set_items([{"name": "Serum", "quantity": 2, "price": 25.0}, {"name": "Toner", "quantity": 1, "price": 50.0}])
+            committed_session.add(order)
+        committed_session.commit()
+
+        response = client.get("/api/exports/orders", headers=admin_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["id"] for row in rows] == [f"ORD-{i}" for i in range(5)]
+        assert rows[0]["city"] == "Mombasa, Nyali"
+        assert (rows[0]["lines"], rows[0]["units"]) == ("2", "3")
+
+    def test_users_ndjson_gzip(self, admin_headers, test_user):
+        """Test NDJSON export, gzipped on the fly, without password hashes"""
+        import gzip
+        import json
+        response = client.get("/api/exports/users", params={"format": "ndjson", "gzip": True}, headers=admin_headers)
+        assert response.headers["content-type"] == "application/gzip"
+        lines = gzip.decompress(response.content).decode().splitlines()
+        users = [json.loads(line) for line in lines]
+        assert {u["email"] for u in users} == {"admin@example.com", "testuser@example.com"}
+        assert all("password" not in u for u in users)
+
+    def test_products_export(self, admin_headers, test_product):
+        """Test that products export with their category name"""
+        response = client.get("/api/exports/products", params={"format": "ndjson"}, headers=admin_headers)
+        import json
+        product = json.loads(response.text.splitlines()[0])
+        assert (product["name"], product["category"]) == ("Face Cream", "Beauty Products")
+
+
+class TestAnalytics:
+    """Test the pre-aggregated sales rollups"""
+
+    @pytest.fixture
+    def catalog(self, committed_session):
+        category = Category(name="Skincare")
+        committed_session.add(category)
+        committed_session.commit()
+        serum = Product(name="Serum", price=1000.0, stock_quantity=50, category_id=category.id)
+        toner = Product(name="Toner", price=500.0, stock_quantity=50, category_id=category.id)
+        committed_session.add_all([serum, toner])
+        committed_session.commit()
+        return category, serum, toner
+
+    def _place(self, auth_headers, items, payment_method="cash"):
+        response = client.post("/api/orders/", headers=auth_headers, json={
+            "customer": {"firstName": "Wanjiru", "lastName": "K", "email": "w@example.com",
+                         "address": "Ngong Road", "city": "Nairobi", "zip": "00100"},
+            "items": [{"id": p.id, "name": p.name, "quantity": q, "price": p.price} for p, q in items],
+            "total": sum(p.price * q for p, q in items),
+            "paymentMethod": payment_method,
+        })
+        assert response.status_code == 200
+        return response
+
+    def test_analytics_require_admin(self, auth_headers):
+        """Test that customers can't read the dashboard"""
+        assert client.get("/api/analytics/sales").status_code == 401
+        assert client.get("/api/analytics/sales", headers=auth_headers).status_code == 403
+
+    def test_rollups_follow_orders_and_status_changes(self, committed_session, catalog, auth_headers, admin_headers):
+        """Test that placing orders and changing their status updates every dimension"""
+        category, serum, toner = catalog
+        self._place(auth_headers, [(serum, 2), (toner, 1)])
+        self._place(auth_headers, [(serum, 1)])
+
+        sales = client.get("/api/analytics/sales", headers=admin_headers).json()
+        assert (sales["orders"], sales["revenue"]) == (2, 3500.0)
+        assert len(sales["points"]) == 1
+        hourly = client.get("/api/analytics/sales", params={"granularity": "hour"}, headers=admin_headers).json()
+        assert hourly["revenue"] == 3500.0
+
+        products = client.get("/api/analytics/products", headers=admin_headers).json()
+        assert [(p["name"], p["units"], p["orders"]) for p in products] == [("Serum", 3, 2), ("Toner", 1, 1)]
+        categories = client.get("/api/analytics/categories", headers=admin_headers).json()
+        assert [(c["name"], c["orders"], c["revenue"]) for c in categories] == [("Skincare", 2, 3500.0)]
+
+        order = committed_session.query(Order).order_by(Order.id).first()
+        response = client.put(f"/api/orders/{order.id}/status", json={"status": "cancelled"})
+        assert response.status_code == 200
+
+        sales = client.get("/api/analytics/sales", headers=admin_headers).json()
+        assert (sales["orders"], sales["revenue"]) == (1, 1000.0)
+        assert sales["points"][0]["all_orders"] == 2
+        statuses = client.get("/api/analytics/statuses", headers=admin_headers).json()
+        assert {s["key"]: s["orders"] for s in statuses} == {"processing": 1, "cancelled": 1}
+        products = client.get("/api/analytics/products", headers=admin_headers).json()
+        assert [(p["name"], p["units"]) for p in products] == [("Serum", 1)]
+
+    def test_cancelling_a_paid_order_restocks(self, committed_session, catalog, auth_headers):
+        """Test that cancelling an order placed through POST /api/orders puts its stock back"""
+        category, serum, toner = catalog
+        order_id = self._place(auth_headers, [(serum, 4)], payment_method="mpesa").json()["id"]
+
+        def stock():
+            committed_session.expire_all()
+            return committed_session.get(Product, serum.id).stock_quantity
+
+        assert stock() == 46
+        order = committed_session.query(Order).filter(Order.public_id == order_id).one()
+        assert client.put(f"/api/orders/{order.id}/status", json={"status": "cancelled"}).status_code == 200
+        assert stock() == 50
+        assert client.put(f"/api/orders/{order.id}/status", json={"status": "paid"}).status_code == 200
+        assert stock() == 46
+
+    def test_rebuild_matches_incremental_rollups(self, committed_session, catalog, auth_headers, admin_headers):
+        """Test that rebuilding from the orders table gives the same numbers"""
+        from app.services import analytics
+        _, serum, toner = catalog
+        self._place(auth_headers, [(serum, 1), (toner, 4)])
+        self._place(auth_headers, [(toner, 2)])
+        before = client.get("/api/analytics/products", headers=admin_headers).json()
+
+        assert analytics.rebuild(committed_session) == 2
+        assert client.get("/api/analytics/products", headers=admin_headers).json() == before
+
 # ====== ROOT ENDPOINT TEST ======
 
 class TestRootEndpoint:
@@ -0,0 +1,66 @@
+import threading
+
+from app.utils.ids import IdGenerator, new_order_ids, ID_LENGTH
+
+
+class FakeClock:
+    def __init__(self, now=1_760_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_ids_increase_within_a_millisecond_and_across_clock_steps():
+    clock = FakeClock()
+    gen = IdGenerator(worker_id=7, clock=clock)
+    ids = [gen.next_id() for _ in range(5)]
+    clock.now -= 5  # NTP stepped the clock back
+    ids += [gen.next_id() for _ in range(5)]
+    clock.now += 10
+    ids.append(gen.next_id())
+
+    assert all(len(i) == ID_LENGTH for i in ids)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_sequence_overflow_borrows_next_millisecond():
+    gen = IdGenerator(worker_id=1, clock=FakeClock())
+    ids = [gen.next_int() for _ in range(70_000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_workers_never_collide_and_sort_by_time():
+    clock = FakeClock()
+    a, b = IdGenerator(worker_id=1, clock=clock), IdGenerator(worker_id=2, clock=clock)
+    first = {a.next_id(), b.next_id()}
+    clock.now += 0.001
+    later = {a.next_id(), b.next_id()}
+    assert len(first | later) == 4
+    assert max(first) < min(later)
+
+
+def test_concurrent_threads_get_unique_ids():
+    gen = IdGenerator()
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        batch = [gen.next_id() for _ in range(2000)]
+        with lock:
+            results.extend(batch)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results)) == len(results) == 16000
+
+
+def test_invoice_number_shares_the_full_id():
+    public_id, invoice = new_order_ids()
+    assert public_id.startswith("ORD-") and invoice.startswith("INV-")
+    assert public_id[4:] == invoice[4:]
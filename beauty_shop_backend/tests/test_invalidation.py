@@ -0,0 +1,105 @@
+import queue
+import socket
+import threading
+from collections import defaultdict
+
+from app.services.invalidation import InvalidationBus, UnixSocketBackend, RedisBackend
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used by RedisBackend"""
+
+    def __init__(self):
+        self.channels = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self.lock:
+            for inbox in self.channels[channel]:
+                inbox.put(message)
+
+    def pubsub(self, ignore_subscribe_messages=True):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.inbox = queue.Queue()
+
+    def subscribe(self, channel):
+        with self.redis.lock:
+            self.redis.channels[channel].append(self.inbox)
+
+    def listen(self):
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            yield {"type": "message", "data": message}
+
+    def close(self):
+        self.inbox.put(None)
+
+
+def _recorder(bus, kind):
+    received = []
+    event = threading.Event()
+
+    def handler(entity_id, data):
+        received.append((entity_id, data))
+        event.set()
+
+    bus.subscribe(kind, handler)
+    return received, event
+
+
+def _assert_broadcast(publisher, subscriber):
+    local, _ = _recorder(publisher, "product")
+    remote, delivered = _recorder(subscriber, "product")
+
+    publisher.publish("product", 7, category_ids=[1, 2])
+
+    assert delivered.wait(2)
+    assert remote == [(7, {"category_ids": [1, 2]})]
+    assert local == [(7, {"category_ids": [1, 2]})]
+
+
+def test_unix_socket_backend_broadcasts_to_other_workers(tmp_path):
+    worker_a = InvalidationBus(UnixSocketBackend(str(tmp_path)))
+    worker_b = InvalidationBus(UnixSocketBackend(str(tmp_path)))
+    worker_a.start()
+    worker_b.start()
+    try:
+        _assert_broadcast(worker_a, worker_b)
+    finally:
+        worker_a.stop()
+        worker_b.stop()
+
+
+def test_unix_socket_backend_skips_dead_workers(tmp_path):
+    # a worker that was killed leaves its socket file behind
+    stale = tmp_path / "999-dead.sock"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(str(stale))
+
+    worker_a = InvalidationBus(UnixSocketBackend(str(tmp_path)))
+    worker_a.start()
+    try:
+        worker_a.publish("category", 1)
+        assert not stale.exists()
+    finally:
+        worker_a.stop()
+
+
+def test_redis_backend_broadcasts_and_ignores_own_messages():
+    redis = FakeRedis()
+    worker_a = InvalidationBus(RedisBackend(redis))
+    worker_b = InvalidationBus(RedisBackend(redis))
+    worker_a.start()
+    worker_b.start()
+    try:
+        _assert_broadcast(worker_a, worker_b)
+    finally:
+        worker_a.stop()
+        worker_b.stop()
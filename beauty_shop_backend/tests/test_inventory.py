@@ -0,0 +1,203 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Product, Category, Order, OrderItem, StockReservation, utcnow
+from app.services import inventory
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """File-backed SQLite so several threads can check out at once"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'inventory.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+
+    # take the write lock at BEGIN, like a row lock would, instead of
+    # failing on lock upgrade
+    @event.listens_for(engine, "connect")
+    def _no_autobegin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, autoflush=False)
+    engine.dispose()
+
+
+@pytest.fixture
+def stocked(session_factory):
+    db = session_factory()
+    category = Category(name="Skincare")
+    db.add(category)
+    db.flush()
+    products = [
+        Product(name="Serum", price=1000.0, stock_quantity=10, category_id=category.id),
+        Product(name="Toner", price=800.0, stock_quantity=3, category_id=category.id),
+    ]
+    db.add_all(products)
+    db.commit()
+    ids = [p.id for p in products]
+    db.close()
+    return ids
+
+
+def _new_order(db, status="pending"):
+    order = Order(total_amount=0, status=status)
+    db.add(order)
+    db.flush()
+    return order
+
+
+def _stock(session_factory, product_id):
+    db = session_factory()
+    try:
+        return db.get(Product, product_id).stock_quantity
+    finally:
+        db.close()
+
+
+def test_basket_merges_duplicate_lines():
+    assert inventory.basket([(1, 2), (2, 1), (1, 3), (None, 5)]) == {1: 5, 2: 1}
+    with pytest.raises(ValueError):
+        inventory.basket([(1, 0)])
+
+
+def test_reserve_decrements_whole_basket(session_factory, stocked):
+    serum, toner = stocked
+    db = session_factory()
+    order = _new_order(db)
+    changed = inventory.reserve(db, order.id, {serum: 4, toner: 3})
+    db.commit()
+
+    # every product whose stock moved, not only the one that sold out
+    assert sorted(row.id for row in changed) == sorted([serum, toner])
+    assert _stock(session_factory, serum) == 6
+    assert _stock(session_factory, toner) == 0
+    held = db.query(StockReservation).filter(StockReservation.order_id == order.id).all()
+    assert {(r.product_id, r.quantity, r.status) for r in held} == {(serum, 4, "held"), (toner, 3, "held")}
+    db.close()
+
+
+def test_short_item_fails_the_whole_basket(session_factory, stocked):
+    serum, toner = stocked
+    db = session_factory()
+    order = _new_order(db)
+    with pytest.raises(inventory.InsufficientStock) as exc:
+        inventory.reserve(db, order.id, {serum: 2, toner: 4})
+    db.close()
+
+    assert exc.value.product_ids == [toner]
+    assert _stock(session_factory, serum) == 10
+    assert _stock(session_factory, toner) == 3
+
+
+def test_concurrent_checkouts_never_oversell(session_factory, stocked):
+    serum, _ = stocked
+    results = []
+    lock = threading.Lock()
+
+    def checkout():
+        db = session_factory()
+        try:
+            order = _new_order(db)
+            inventory.reserve(db, order.id, {serum: 1})
+            db.commit()
+            outcome = "ok"
+        except inventory.InsufficientStock:
+            outcome = "short"
+        finally:
+            db.close()
+        with lock:
+            results.append(outcome)
+
+    threads = [threading.Thread(target=checkout) for _ in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count("ok") == 10
+    assert results.count("short") == 30
+    assert _stock(session_factory, serum) == 0
+
+
+def test_expired_holds_are_released(session_factory, stocked):
+    serum, toner = stocked
+    db = session_factory()
+    unpaid = _new_order(db)
+    inventory.reserve(db, unpaid.id, {serum: 2, toner: 3}, ttl=60)
+    paid = _new_order(db)
+    inventory.reserve(db, paid.id, {serum: 1}, ttl=60)
+    inventory.commit_order(db, paid.id)
+    db.commit()
+
+    assert inventory.release_expired(db, now=utcnow() + timedelta(seconds=30)) == 0
+    assert inventory.release_expired(db, now=utcnow() + timedelta(seconds=120), batch_size=1) == 1
+    assert db.get(Order, unpaid.id).status == "expired"
+    assert db.get(Order, paid.id).status == "pending"
+    # releasing again is a no-op
+    assert inventory.release_order(db, unpaid.id) == []
+    db.close()
+
+    assert _stock(session_factory, serum) == 9
+    assert _stock(session_factory, toner) == 3
+
+
+def test_cancelling_a_paid_order_restocks(session_factory, stocked):
+    serum, toner = stocked
+    db = session_factory()
+    held = _new_order(db)
+    inventory.reserve(db, held.id, {serum: 2}, ttl=60)
+    inventory.apply_status(db, held.id, "paid", "pending")
+    direct = _new_order(db, status="processing")
+    inventory.reserve(db, direct.id, {toner: 3}, ttl=None)
+    db.commit()
+    assert (_stock(session_factory, serum), _stock(session_factory, toner)) == (8, 0)
+
+    inventory.apply_status(db, held.id, "cancelled", "paid")
+    changes = inventory.apply_status(db, direct.id, "refunded", "processing")
+    db.commit()
+    assert [row.id for row in changes] == [toner]
+    # a second cancel finds nothing left to put back
+    assert inventory.release_order(db, held.id) == []
+    db.close()
+
+    assert _stock(session_factory, serum) == 10
+    assert _stock(session_factory, toner) == 3
+
+
+def test_reinstated_order_takes_its_stock_again(session_factory, stocked):
+    serum, toner = stocked
+    db = session_factory()
+    order = _new_order(db)
+    db.add_all([OrderItem(order_id=order.id, product_id=serum, name="Serum", unit_price=1000.0, quantity=2),
+                OrderItem(order_id=order.id, product_id=toner, name="Toner", unit_price=800.0, quantity=3)])
+    inventory.reserve(db, order.id, {serum: 2, toner: 3}, ttl=None)
+    inventory.apply_status(db, order.id, "cancelled", "paid")
+    db.commit()
+
+    changed = inventory.apply_status(db, order.id, "paid", "cancelled")
+    assert sorted(row.id for row in changed) == sorted([serum, toner])
+    # already reserved: moving between commit statuses takes nothing more
+    inventory.apply_status(db, order.id, "shipped", "paid")
+    db.commit()
+    assert _stock(session_factory, serum) == 8
+
+    inventory.apply_status(db, order.id, "cancelled", "shipped")
+    db.commit()
+    other = _new_order(db)
+    inventory.reserve(db, other.id, {toner: 2}, ttl=None)
+    db.commit()
+    with pytest.raises(inventory.InsufficientStock):
+        inventory.apply_status(db, order.id, "paid", "cancelled")
+    db.close()
+    assert _stock(session_factory, toner) == 1
@@ -0,0 +1,68 @@
+import os
+import threading
+
+import pytest
+
+from app.utils import invoice
+from app.services.invoices import InvoiceRenderer
+
+
+@pytest.fixture
+def invoice_dir(tmp_path, monkeypatch):
+    # the env var is for spawned worker processes, which re-import the module
+    monkeypatch.setenv("INVOICE_DIR", str(tmp_path))
+    monkeypatch.setattr(invoice, "INVOICE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _job(number):
+    return {"invoice_number": number, "amount": 1500.0, "email": "a@example.com",
+            "items": [{"name": "Serum", "quantity": 3, "price": 500.0}], "date": None}
+
+
+def test_process_pool_renders_and_chains(invoice_dir):
+    renderer = InvoiceRenderer(workers=1)
+    done = threading.Event()
+    chained = []
+
+    def then(path):
+        chained.append(path)
+        done.set()
+
+    try:
+        future = renderer.submit(_job("INV-pool"), then=then)
+        # a second request for the same invoice joins the render in flight
+        again = renderer.submit(_job("INV-pool"))
+        assert future.result(timeout=60) == again.result(timeout=60)
+        assert done.wait(10)
+    finally:
+        renderer.shutdown()
+
+    assert chained == [str(invoice_dir / "invoice_INV-pool.pdf")]
+    with open(chained[0], "rb") as f:
+        assert f.read(4) == b"%PDF"
+    assert [p for p in os.listdir(invoice_dir) if p.endswith(".tmp")] == []
+
+
+def test_existing_invoice_is_not_rendered_again(invoice_dir, monkeypatch):
+    renderer = InvoiceRenderer(workers=0)
+    path = renderer.render(_job("INV-once"))
+
+    from app.services import invoices
+    monkeypatch.setattr(invoices, "generate_invoice_pdf", lambda **job: pytest.fail("rendered twice"))
+    assert renderer.render(_job("INV-once")) == path
+
+
+def test_batch_rendering(invoice_dir):
+    jobs = [_job(f"INV-{i}") for i in range(5)]
+    renderer = InvoiceRenderer(workers=0)
+    paths = renderer.render_many(jobs, batch_size=2)
+    assert paths == [str(invoice_dir / f"invoice_INV-{i}.pdf") for i in range(5)]
+
+    combined = str(invoice_dir / "reprint.pdf")
+    assert invoice.generate_invoice_pdfs(jobs, combined_path=combined) == [combined]
+    with open(combined, "rb") as f:
+        pdf = f.read()
+    # one page per invoice, all placing the same chrome form
+    assert b"/Count 5" in pdf
+    assert pdf.count(b"/Subtype /Form") == 1
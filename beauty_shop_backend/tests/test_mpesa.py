@@ -0,0 +1,74 @@
+import threading
+
+from app.utils import mpesa
+
+
+def test_token_is_fetched_once_and_connections_reused(daraja):
+    for i in range(3):
+        result = mpesa.initiate_stk_push(phone="0712345678", amount=100, invoice_no=f"INV-{i}")
+        assert result["ResponseCode"] == "0"
+
+    assert daraja.token_requests == 1
+    assert len(daraja.stk_requests) == 3
+    assert daraja.stk_requests[0]["PhoneNumber"] == "254712345678"
+    # one keep-alive connection carried the token call and all three pushes
+    assert len(daraja.connections) == 1
+
+
+def test_token_is_refreshed_before_it_expires(daraja, monkeypatch):
+    now = [1000.0]
+    daraja.expires_in = 120
+    monkeypatch.setattr(mpesa, "TOKEN_REFRESH_MARGIN", 60)
+    manager = mpesa.TokenManager(mpesa._fetch_access_token, clock=lambda: now[0])
+
+    first, _ = manager.get()
+    now[0] += 59
+    assert manager.get() == (first, None)
+    now[0] += 2  # inside the refresh margin
+    second, _ = manager.get()
+    assert second != first
+    assert daraja.token_requests == 2
+
+
+def test_concurrent_callers_share_one_token_fetch(daraja):
+    daraja.token_delay = 0.2
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(mpesa.get_access_token())) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert daraja.token_requests == 1
+    assert len({token for token, error in tokens}) == 1
+
+
+def test_rejected_token_is_replaced_and_push_retried(daraja):
+    assert mpesa.initiate_stk_push(phone="254712345678", amount=50, invoice_no="INV-a")["ResponseCode"] == "0"
+    daraja.revoke_tokens()
+
+    result = mpesa.initiate_stk_push(phone="254712345678", amount=50, invoice_no="INV-b")
+    assert result["ResponseCode"] == "0"
+    assert daraja.token_requests == 2
+
+
+def test_bad_credentials_are_reported(daraja, monkeypatch):
+    monkeypatch.setattr(mpesa, "CONSUMER_SECRET", "wrong")
+    token, error = mpesa.get_access_token()
+    assert token is None
+    assert "authentication failed" in error["errorMessage"]
+
+
+def test_refused_push_is_marked_unsent(daraja):
+    mpesa.get_access_token()
+    daraja.stop()  # the token is cached; the push itself finds nobody listening
+    mpesa.session.close()  # and no kept-alive connection to reuse
+
+    result = mpesa.initiate_stk_push(phone="0712345678", amount=10, invoice_no="INV-x")
+    assert result["requestSent"] is False
+
+
+def test_push_that_reached_daraja_is_not_marked_unsent(daraja):
+    daraja.stk_failures = 1
+    result = mpesa.initiate_stk_push(phone="0712345678", amount=10, invoice_no="INV-y")
+    assert result["errorCode"] == "500" and result["requestSent"] is True
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Order
+from app.services import payments
+from app.services.payments import CircuitBreaker, PaymentDispatcher
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'payments.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, autoflush=False)
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(payments, "PAYMENT_RETRY_BASE", 0)
+
+
+def _order(session_factory):
+    db = session_factory()
+    order = Order(total_amount=100.0, status="pending", payment_status="pending")
+    db.add(order)
+    db.commit()
+    order_id = order.id
+    db.close()
+    return order_id
+
+
+def _payment(session_factory, order_id):
+    db = session_factory()
+    try:
+        order = db.get(Order, order_id)
+        return order.payment_status, order.payment_error
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def dispatcher(session_factory):
+    d = PaymentDispatcher(session_factory, concurrency=2)
+    yield d
+    d.stop()
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] = 11
+    assert breaker.allow()       # the one trial call
+    assert not breaker.allow()   # everyone else waits for its outcome
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 22
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_push_is_sent_in_the_background(daraja, dispatcher, session_factory):
+    daraja.stk_delay = 0.5
+    order_id = _order(session_factory)
+
+    started = time.monotonic()
+    future = dispatcher.submit(order_id, "0712345678", 100, "INV-1")
+    assert time.monotonic() - started < 0.2
+    assert _payment(session_factory, order_id) == ("pending", None)
+
+    assert future.result(timeout=10)["ResponseCode"] == "0"
+    assert _payment(session_factory, order_id) == ("requested", None)
+
+
+def test_pushes_that_never_left_are_retried(daraja, dispatcher, session_factory):
+    daraja.token_failures = 2
+    order_id = _order(session_factory)
+
+    assert dispatcher.submit(order_id, "0712345678", 100, "INV-2").result(timeout=10)["ResponseCode"] == "0"
+    assert len(daraja.stk_requests) == 1
+    assert _payment(session_factory, order_id) == ("requested", None)
+
+
+def test_unconfirmed_push_is_not_resent(daraja, dispatcher, session_factory):
+    # a 5xx may come after Safaricom has sent the prompt: resending could charge twice
+    daraja.stk_failures = 1
+    order_id = _order(session_factory)
+
+    dispatcher.submit(order_id, "0712345678", 100, "INV-6").result(timeout=10)
+
+    assert len(daraja.stk_requests) == 1
+    assert _payment(session_factory, order_id) == ("unconfirmed", payments.UNCONFIRMED)
+
+
+def test_rejected_push_is_not_retried(daraja, dispatcher, session_factory):
+    order_id = _order(session_factory)
+    dispatcher.submit(order_id, "12345", 100, "INV-3").result(timeout=10)
+
+    assert daraja.stk_requests == []
+    status, error = _payment(session_factory, order_id)
+    assert status == "failed" and "phone number" in error
+
+
+def test_open_circuit_stops_calling_the_provider(daraja, session_factory, monkeypatch):
+    monkeypatch.setattr(payments, "PAYMENT_MAX_ATTEMPTS", 2)
+    dispatcher = PaymentDispatcher(session_factory, concurrency=2, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+    daraja.stk_failures = 100
+    try:
+        for n in range(2):
+            dispatcher.submit(_order(session_factory), "0712345678", 100, f"INV-{n}").result(timeout=10)
+        assert len(daraja.stk_requests) == 2
+
+        third = _order(session_factory)
+        dispatcher.submit(third, "0712345678", 100, "INV-5").result(timeout=10)
+    finally:
+        dispatcher.stop()
+
+    assert len(daraja.stk_requests) == 2
+    assert _payment(session_factory, third) == ("failed", "M-Pesa is temporarily unavailable")
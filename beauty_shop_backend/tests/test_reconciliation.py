@@ -0,0 +1,148 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Order, OrderItem, Product, StockReservation, utcnow
+from app.services import payments, reconciliation
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reconcile.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _order(db, n, minutes_ago=30, status="pending", payment_status="requested"):
+    order = Order(
+        public_id=f"ORD-{n}", total_amount=100.0, status=status, payment_status=payment_status,
+        checkout_request_id=f"ws_CO_{n}", created_at=utcnow() - timedelta(minutes=minutes_ago),
+    )
+    db.add(order)
+    db.commit()
+    return order.id
+
+
+def _state(db, order_id):
+    db.expire_all()
+    order = db.get(Order, order_id)
+    return order.status, order.payment_status
+
+
+def test_settles_paid_and_failed_orders(daraja, db):
+    product = Product(name="Serum", price=10.0, stock_quantity=5)
+    db.add(product)
+    db.commit()
+    paid = _order(db, 1)
+    db.add(StockReservation(order_id=paid, product_id=product.id, quantity=2, status="held",
+                            expires_at=utcnow() + timedelta(minutes=5)))
+    db.commit()
+    cancelled = _order(db, 2)
+    waiting = _order(db, 3)
+    daraja.stk_results = {"ws_CO_1": (0, "The service request is processed successfully."),
+                          "ws_CO_2": (1032, "Request cancelled by user")}
+
+    report = reconciliation.reconcile(db)
+
+    assert report == {"checked": 3, "paid": ["ORD-1"], "failed": ["ORD-2"], "pending": 1, "errors": 0}
+    assert _state(db, paid) == ("paid", "paid")
+    assert _state(db, cancelled) == ("pending", "failed")
+    assert db.get(Order, cancelled).payment_error == "Request cancelled by user"
+    assert _state(db, waiting) == ("pending", "requested")
+    assert db.query(StockReservation).one().status == "committed"
+
+    # a second run only asks about the one still in progress
+    daraja.query_requests.clear()
+    assert reconciliation.reconcile(db)["checked"] == 1
+    assert [q["CheckoutRequestID"] for q in daraja.query_requests] == ["ws_CO_3"]
+
+
+def test_dry_run_changes_nothing(daraja, db):
+    order_id = _order(db, 1)
+    daraja.stk_results = {"ws_CO_1": (0, "ok")}
+
+    report = reconciliation.reconcile(db, dry_run=True)
+
+    assert report["paid"] == ["ORD-1"]
+    assert _state(db, order_id) == ("pending", "requested")
+
+
+def test_only_stale_unsettled_orders_are_queried(daraja, db):
+    _order(db, 1, minutes_ago=1)                                # too recent
+    _order(db, 2, minutes_ago=60 * 24 * 3)                      # too old to query
+    _order(db, 3, status="paid", payment_status="paid")
+    _order(db, 4, payment_status="failed")
+    _order(db, 5, status="expired")                             # swept, maybe paid late
+
+    reconciliation.reconcile(db)
+
+    assert [q["CheckoutRequestID"] for q in daraja.query_requests] == ["ws_CO_5"]
+
+
+def test_batches_are_queried_with_bounded_concurrency(daraja, db):
+    daraja.query_delay = 0.05
+    for n in range(12):
+        _order(db, n, minutes_ago=30 + n)
+    daraja.stk_results = {f"ws_CO_{n}": (0, "ok") for n in range(12)}
+
+    report = reconciliation.reconcile(db, batch_size=5, concurrency=3)
+
+    assert report["checked"] == 12 and len(report["paid"]) == 12
+    assert len(daraja.query_requests) == 12
+    assert 1 < daraja.max_concurrent_queries <= 3
+    # oldest first
+    assert daraja.query_requests[0]["CheckoutRequestID"] in {"ws_CO_11", "ws_CO_10", "ws_CO_9"}
+    assert daraja.token_requests == 1
+
+
+def _expired_order(db, n, stock):
+    """An order for 2 of a product whose hold was released by the sweep."""
+    product = Product(name=f"Serum {n}", price=10.0, stock_quantity=stock)
+    db.add(product)
+    db.commit()
+    order_id = _order(db, n, status="expired")
+    db.add(OrderItem(order_id=order_id, product_id=product.id, name=product.name, unit_price=10.0, quantity=2))
+    db.add(StockReservation(order_id=order_id, product_id=product.id, quantity=2, status="released"))
+    db.commit()
+    return order_id, product.id
+
+
+def test_expired_order_paid_late_takes_its_stock_back(daraja, db):
+    order_id, product_id = _expired_order(db, 1, stock=5)
+    daraja.stk_results = {"ws_CO_1": (0, "ok")}
+
+    report = reconciliation.reconcile(db)
+
+    assert report["paid"] == ["ORD-1"]
+    assert _state(db, order_id) == ("paid", "paid")
+    assert db.get(Product, product_id).stock_quantity == 3
+    reservations = db.query(StockReservation).filter_by(order_id=order_id).all()
+    assert sorted(r.status for r in reservations) == ["committed", "released"]
+
+
+def test_expired_order_paid_after_selling_out_needs_manual_handling(daraja, db):
+    short, short_product = _expired_order(db, 1, stock=1)
+    fine, fine_product = _expired_order(db, 2, stock=2)
+    daraja.stk_results = {"ws_CO_1": (0, "ok"), "ws_CO_2": (0, "ok")}
+
+    report = reconciliation.reconcile(db)
+
+    assert report["paid"] == ["ORD-2"]
+    assert _state(db, short) == ("expired", "paid_no_stock")
+    assert "Insufficient stock" in db.get(Order, short).payment_error
+    assert db.get(Product, short_product).stock_quantity == 1
+    assert _state(db, fine) == ("paid", "paid")
+    assert db.get(Product, fine_product).stock_quantity == 0
+
+    # settled either way: neither is queried or flipped again
+    daraja.query_requests.clear()
+    assert reconciliation.reconcile(db)["checked"] == 0
+    order = db.get(Order, short)
+    assert not payments.mark_paid(db, order, "RCPT")
+    assert _state(db, short) == ("expired", "paid_no_stock")
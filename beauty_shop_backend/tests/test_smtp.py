@@ -0,0 +1,142 @@
+from email.message import EmailMessage
+
+import pytest
+
+from app.utils import email, smtp
+from app.utils.smtp import MailQueue, RateLimiter, SMTPPool
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(smtp, "MAIL_RETRY_BASE", 0)
+
+
+def _queue(server, size=1, password=None, **kwargs):
+    host, port = server.address
+    pool = SMTPPool(host, port, server.username, password or server.password, starttls=False, size=size)
+    kwargs.setdefault("max_attempts", 5)
+    return MailQueue(pool, limiter=RateLimiter(0), **kwargs)
+
+
+def _msg(n):
+    msg = EmailMessage()
+    msg["From"] = "shop@example.com"
+    msg["To"] = f"customer{n}@example.com"
+    msg["Subject"] = f"Message {n}"
+    msg.set_content("hello")
+    return msg
+
+
+def test_messages_share_one_logged_in_connection(smtp_server):
+    mail = _queue(smtp_server)
+    try:
+        for n in range(5):
+            assert mail.send(_msg(n))
+        assert mail.flush(timeout=10)
+    finally:
+        mail.stop()
+
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1 and smtp_server.logins == 1
+    assert mail.sent == 5
+
+
+def test_pool_size_bounds_connections(smtp_server):
+    mail = _queue(smtp_server, size=2, batch_size=3)
+    try:
+        for n in range(20):
+            mail.send(_msg(n))
+        assert mail.flush(timeout=10)
+    finally:
+        mail.stop()
+
+    assert len(smtp_server.messages) == 20
+    assert smtp_server.connections <= 2
+
+
+def test_dropped_connection_is_replaced(smtp_server):
+    smtp_server.drop_after = 2
+    mail = _queue(smtp_server)
+    try:
+        for n in range(5):
+            mail.send(_msg(n))
+        assert mail.flush(timeout=10)
+    finally:
+        mail.stop()
+
+    assert sorted(m["To"] for m in smtp_server.messages) == [f"customer{n}@example.com" for n in range(5)]
+    assert smtp_server.connections == 3
+    assert mail.failed == 0
+
+
+def test_temporary_failure_is_retried(smtp_server):
+    smtp_server.temp_failures = 2
+    mail = _queue(smtp_server)
+    try:
+        mail.send(_msg(1))
+        assert mail.flush(timeout=10)
+    finally:
+        mail.stop()
+
+    assert len(smtp_server.messages) == 1
+    assert (mail.sent, mail.failed) == (1, 0)
+
+
+def test_gives_up_after_max_attempts(smtp_server):
+    smtp_server.temp_failures = 10
+    mail = _queue(smtp_server, max_attempts=3)
+    try:
+        mail.send(_msg(1))
+        assert mail.flush(timeout=10)
+    finally:
+        mail.stop()
+
+    assert smtp_server.messages == []
+    assert smtp_server.temp_failures == 7
+    assert (mail.sent, mail.failed) == (0, 1)
+
+
+def test_bad_credentials_are_not_retried(smtp_server):
+    mail = _queue(smtp_server, size=0, password="wrong")
+    assert mail.send(_msg(1)) is False
+    assert smtp_server.connections == 1 and mail.failed == 1
+
+
+def test_rate_limiter_paces_sends():
+    now, slept = [0.0], []
+    limiter = RateLimiter(rate=2, burst=2, clock=lambda: now[0], sleep=slept.append)
+    for _ in range(3):
+        limiter.acquire()
+    assert slept == [0.5]
+
+    now[0] = 10  # the bucket refills, but only up to the burst
+    for _ in range(3):
+        limiter.acquire()
+    assert slept == [0.5, 0.5]
+
+
+def test_limiters_are_shared_per_provider(monkeypatch):
+    monkeypatch.setattr(smtp, "_limiters", {})
+    monkeypatch.setattr(smtp, "MAIL_RATE_LIMITS", "smtp.gmail.com=1:10")
+    gmail = smtp.limiter_for("SMTP.gmail.com")
+    assert smtp.limiter_for("smtp.gmail.com") is gmail
+    assert (gmail.rate, gmail.burst) == (1.0, 10)
+    assert smtp.limiter_for("smtp.example.com").rate == smtp.MAIL_RATE
+
+
+def test_invoice_email_goes_through_the_queue(smtp_server, monkeypatch, tmp_path):
+    pdf = tmp_path / "invoice.pdf"
+    pdf.write_bytes(b"%PDF-1.4 test")
+    mail = _queue(smtp_server, size=0)
+    monkeypatch.setattr(smtp, "mail_queue", mail)
+    monkeypatch.setattr(smtp, "MAIL_FROM", "shop@example.com")
+    monkeypatch.setattr(smtp, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(smtp, "MAIL_USERNAME", smtp_server.username)
+    monkeypatch.setattr(smtp, "MAIL_PASSWORD", smtp_server.password)
+
+    assert email.send_invoice_email("jane@example.com", "INV-7", str(pdf))
+
+    [msg] = smtp_server.messages
+    assert msg["To"] == "jane@example.com" and msg["From"] == "shop@example.com"
+    attachments = [part.get_filename() for part in msg.walk() if part.get_filename()]
+    assert attachments == ["Invoice_INV-7.pdf"]